@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import glob
+import time
+import platform
+import subprocess
+import multiprocessing
+import argh
+import pandas as pd
+
+import metagov # Adds solidity-parser submodule to sys.path
+from solidity_parser import parser
+from metagov.astcache import PARSER_VERSION
+from metagov.contractmodel import extract_objects_and_parameters, extract_commented_objects_and_parameters, parse_contract_source
+from metagov.contractcomments import add_docstring_comments, add_inline_comments, remove_duplicate_comments_in_parameters
+from metagov.contractkeywords import code_objects, CodingCache, set_coding_cache
+
+CWD = os.path.join(os.path.dirname(__file__))
+TMPDIR = os.path.join(CWD, 'tmp')
+CONTRACTS_DIR = os.path.join(CWD, 'data', 'contracts', 'Compound')
+
+STAGES = ['parse', 'extract', 'docstring_comments', 'inline_comments', 'duplicate_comments', 'extract_and_comments',
+          'keywords', 'total']
+
+# Governance-flavored vocabulary for synthetic contracts (so that keyword coding has something to find)
+SYNTHETIC_NAMES = ['propose', 'castVote', 'delegate', 'queue', 'execute', 'cancel', 'setQuorum',
+                   'addMember', 'removeRole', 'createDispute', 'appeal', 'reward', 'electCandidate']
+SYNTHETIC_PARAMS = [('uint256', 'proposalId', 'The id of the proposal'),
+                    ('address', 'voter', 'The address casting the vote'),
+                    ('uint8', 'support', 'The support value for the vote'),
+                    ('string', 'reason', 'The reason given for the vote'),
+                    ('address', 'delegatee', 'The address to delegate votes to'),
+                    ('uint256', 'threshold', 'The proposal threshold')]
+
+
+# =============================================================================
+# Corpora
+# =============================================================================
+def make_synthetic_contract(nFunctions, index=0):
+    """Return Solidity source for a synthetic governance contract with nFunctions functions
+
+    Each function has a NatSpec docstring and a few parameters, and each has a matching
+    event and state variable with inline comments, so that every comment pass has work to do"""
+
+    lines = ['pragma solidity ^0.8.0;', '', f'/// @title Synthetic governance contract {index}',
+             f'contract SyntheticGovernor{index} {{']
+    for i in range(nFunctions):
+        name = f"{SYNTHETIC_NAMES[i % len(SYNTHETIC_NAMES)]}{i}"
+        params = [SYNTHETIC_PARAMS[(i + j) % len(SYNTHETIC_PARAMS)] for j in range(1 + i % 4)]
+        args = ', '.join(f"{t} {p}{j}" for j, (t, p, d) in enumerate(params))
+        lines += ['', f"    /// @notice The number of votes recorded by {name}",
+                  f"    uint256 public {name}Votes = {i}; // Votes counted for {name}",
+                  f"    /// @notice An event emitted by {name}",
+                  f"    event {name[0].upper() + name[1:]}Event({args});",
+                  '    /**',
+                  f"     * @notice Run {name}, which may change the governance state",
+                  f"     * @dev Synthetic function {i} for benchmarking"]
+        lines += [f"     * @param {p}{j} {d}" for j, (t, p, d) in enumerate(params)]
+        lines += ['     */',
+                  f"    function {name}({args}) public returns (uint256) {{",
+                  f"        {name}Votes += 1;",
+                  f"        return {name}Votes;",
+                  '    }']
+    lines += ['}', '']
+
+    return '\n'.join(lines)
+
+
+def load_corpus(name):
+    """Return list of (filename, source) for a named corpus
+
+    - 'compound': the Compound contracts in data/contracts
+    - '{nFiles}x{nFunctions}' (e.g., '20x50'): synthetic contracts (see make_synthetic_contract)
+    """
+
+    if name == 'compound':
+        corpus = []
+        for fpath in sorted(glob.glob(os.path.join(CONTRACTS_DIR, '*.sol'))):
+            with open(fpath, 'r', encoding='utf-8') as f:
+                corpus.append((os.path.basename(fpath), f.read()))
+    else:
+        nFiles, nFunctions = [int(n) for n in name.split('x')]
+        corpus = [(f"Synthetic{i}.sol", make_synthetic_contract(nFunctions, index=i)) for i in range(nFiles)]
+
+    return corpus
+
+
+# =============================================================================
+# Stages
+# =============================================================================
+def _get_peak_rss():
+    """Return peak resident set size of this process in MB"""
+
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024**2 if sys.platform == 'darwin' else maxrss / 1024
+
+
+def _reset_peak_rss():
+    """Reset peak RSS to the current RSS, if supported (Linux only)"""
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _code_keywords(df_objects, df_parameters):
+    keywords, topics = code_objects(df_objects, df_parameters)
+    df_objects['coding_keyword_search'] = pd.Series(keywords, index=df_objects.index, dtype=object)
+    df_objects['coding_topic_search'] = pd.Series(topics, index=df_objects.index, dtype=object)
+    return df_objects
+
+
+def _setup_stage(stage, corpus):
+    """Prepare the inputs of a stage for each file (by running the stages before it)
+
+    Returns list of argument tuples for the stage function"""
+
+    inputs = []
+    for fname, source in corpus:
+        lines = source.split('\n')
+        if stage in ['parse', 'total']:
+            inputs.append((source,))
+            continue
+        sourceUnit = parser.parse(source, loc=True)
+        if stage == 'extract':
+            inputs.append((sourceUnit,))
+            continue
+        if stage == 'extract_and_comments':
+            inputs.append((sourceUnit, lines))
+            continue
+        df_o, df_p = extract_objects_and_parameters(sourceUnit)
+        if stage == 'docstring_comments':
+            inputs.append((lines, df_o, df_p))
+            continue
+        df_o, df_p = add_docstring_comments(lines, df_o, df_p)
+        if stage == 'inline_comments':
+            inputs.append((lines, df_p))
+            continue
+        df_p = add_inline_comments(lines, df_p)
+        if stage == 'duplicate_comments':
+            inputs.append((df_o, df_p))
+            continue
+        df_p = remove_duplicate_comments_in_parameters(df_o, df_p)
+        inputs.append((df_o, df_p))
+
+    return inputs
+
+
+STAGE_FUNCTIONS = {
+    'parse': lambda source: parser.parse(source, loc=True),
+    'extract': extract_objects_and_parameters,
+    'docstring_comments': add_docstring_comments,
+    'inline_comments': add_inline_comments,
+    'duplicate_comments': remove_duplicate_comments_in_parameters,
+    'extract_and_comments': extract_commented_objects_and_parameters,
+    'keywords': _code_keywords,
+    'total': lambda source: parse_contract_source(source),
+}
+
+
+def _count_corpus(corpusName):
+    """Return number of files, objects, and parameters in a corpus"""
+
+    corpus = load_corpus(corpusName)
+    objectCount = 0
+    parameterCount = 0
+    for fname, source in corpus:
+        df_o, df_p = extract_objects_and_parameters(parser.parse(source, loc=True))
+        objectCount += len(df_o.index)
+        parameterCount += len(df_p.index)
+
+    return {'files': len(corpus), 'objects': objectCount, 'parameters': parameterCount}
+
+
+def _run_stage(stage, corpusName, repeat):
+    """Time one stage over a corpus (run in a fresh process, so that peak RSS is per stage)
+
+    Returns (fastest time in seconds, peak RSS in MB)"""
+
+    inputs = _setup_stage(stage, load_corpus(corpusName))
+    fcn = STAGE_FUNCTIONS[stage]
+
+    _reset_peak_rss()
+    times = []
+    for r in range(repeat):
+        # Stages may modify their input DataFrames, so give each run its own copy
+        runInputs = [[a.copy() if isinstance(a, pd.DataFrame) else a for a in args] for args in inputs]
+        # Start each run with an empty coding cache, so that the keyword coding itself is timed
+        set_coding_cache(CodingCache())
+        start = time.perf_counter()
+        for args in runInputs:
+            fcn(*args)
+        times.append(time.perf_counter() - start)
+
+    return min(times), _get_peak_rss()
+
+
+# =============================================================================
+# Main function
+# =============================================================================
+def _get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=CWD, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare_results(results, previousFile):
+    """Print the change in seconds per stage relative to previously saved results"""
+
+    with open(previousFile, 'r') as f:
+        previous = json.load(f)
+    prevSeconds = {(r['corpus'], r['stage']): r['seconds'] for r in previous['results']}
+
+    print(f"\nCompared to {previousFile} ({previous['metadata'].get('git_commit', '?')}):")
+    for r in results:
+        prev = prevSeconds.get((r['corpus'], r['stage']))
+        if prev:
+            print(f"  {r['corpus']:>12} {r['stage']:>20}: {prev:8.3f}s -> {r['seconds']:8.3f}s ({prev / r['seconds']:5.2f}x)")
+
+
+def benchmark(corpora='compound,20x20,4x200', stages=','.join(STAGES), repeat=3, output='', compare=''):
+    """Benchmark the contract parsing pipeline, stage by stage, offline
+
+    Arguments:
+    - corpora: comma-separated corpus names (see load_corpus)
+    - stages: comma-separated stage names (see STAGES)
+    - repeat: number of timed runs per stage (the fastest is reported)
+    - output: JSON file to save results to (default: tmp/benchmark_{commit}_{timestamp}.json)
+    - compare: JSON file of previously saved results to compare against
+    """
+
+    metadata = {'git_commit': _get_git_commit(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'parser_version': PARSER_VERSION,
+                'platform': platform.platform(),
+                'repeat': repeat}
+
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    for corpusName in corpora.split(','):
+        counts = _count_corpus(corpusName)
+        for stage in stages.split(','):
+            with ctx.Pool(1) as pool:
+                seconds, peakRSS = pool.apply(_run_stage, (stage, corpusName, repeat))
+            r = {'corpus': corpusName,
+                 'stage': stage,
+                 **counts,
+                 'seconds': seconds,
+                 'files_per_sec': counts['files'] / seconds,
+                 'objects_per_sec': counts['objects'] / seconds,
+                 'peak_rss_mb': peakRSS}
+            results.append(r)
+            print(f"{r['corpus']:>12} {r['stage']:>20}: {r['seconds']:8.3f}s "
+                  f"{r['files_per_sec']:8.2f} files/s {r['objects_per_sec']:9.1f} objects/s "
+                  f"{r['peak_rss_mb']:8.1f} MB peak RSS")
+
+    if not output:
+        os.makedirs(TMPDIR, exist_ok=True)
+        output = os.path.join(TMPDIR, f"benchmark_{metadata['git_commit']}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w') as f:
+        json.dump({'metadata': metadata, 'results': results}, f, indent=2)
+    print(f"Saved results to {output}")
+
+    if compare:
+        compare_results(results, compare)
+
+
+if __name__ == '__main__':
+    argh.dispatch_command(benchmark)
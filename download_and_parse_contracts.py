@@ -2,12 +2,29 @@ import os
 import re
 import ast
 import shutil
+import time
+import queue
+import copy
+import pickle
+import hashlib
+import threading
+import collections
+import multiprocessing
 import argh
+import requests
 import pandas as pd
 import logging
+import traceback
+from zipfile import ZipFile, BadZipFile
+from concurrent.futures import ProcessPoolExecutor
 
-from metagov.githubscrape import download_repo, construct_file_url
-from metagov.contractmodel import parse_contract_file
+from metagov.githubscrape import download_repo, get_repo_dict, get_archive, get_archive_cache, open_zipball, \
+    walk_zipball, construct_file_url, get_scheduler, get_session, DOWNLOAD_JOBS
+from metagov.contractmodel import parse_contract_file, parse_contract_source
+from metagov.contractkeywords import CodingCache, get_coding_cache, set_coding_cache
+from metagov import contractmodel, contractcomments, contractkeywords
+from metagov.astcache import ASTCache, PARSER_VERSION
+from metagov.parseprofile import ParseProfile, summarize_profiles, profile_stage
 
 CWD = os.path.join(os.path.dirname(__file__))
 TMPDIR = os.path.join(CWD, 'tmp')
@@ -17,18 +34,254 @@ EXCLUDE_DIRS = ['lib', 'libs', 'libraries', 'test', 'tests', 'test-helpers', 'te
 EXCLUDE_FILES = ['SafeMath.sol', 'lib.sol', 'Migrations.sol']
 EXCLUDE_FILE_PATTERNS = [r'I?ERC\d+\.sol', r'I?EIP\d+\.sol', r'.*\.t\.sol']
 
+CHUNK_SIZE = 5000 # Rows buffered per output file before writing, in streaming mode
+PARSE_WINDOW = 2 # Files submitted to each worker process ahead of the results being used, in parse_repo
+PIPELINE_QUEUE_SIZE = 2 # Downloaded repositories waiting to be parsed, at most, in download_and_parse_all
+CODING_CACHE_FILE = os.path.join(TMPDIR, 'coding_cache.pkl')
+# Failures specific to one repository, which are reported before going on to the next (unlike RateLimitExceeded)
+REPO_ERRORS = (requests.RequestException, AssertionError, BadZipFile, OSError, ValueError)
+# Start method for parse_repo's worker processes: not 'fork', as parse_repo may be called while other
+# threads hold locks (e.g., of the shared CodingCache) that forked workers would inherit held
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def _init_parse_worker(codingCache):
+    """Start a parse_repo worker process with a copy of the parent's CodingCache, 
+    tracking what is added to it so that _parse_repo_file can send it back"""
+    
+    codingCache.track_updates()
+    set_coding_cache(codingCache)
+
+
+def _parse_repo_file(fileItem):
+    """Parse a single file found by parse_repo
+    
+    Module-level (and exception-safe) so that it can be sent to a process pool
+    
+    fileItem is (fpath, label, cache, useProfile, source), where source is the file's
+    content read from a zipball (see _read_zip_sources), or None to read it from fpath
+    
+    Returns (df_o, df_p, errorMsg, profileDict, codingUpdates), where errorMsg is None 
+    if parsing succeeded, profileDict is None unless profiling was requested, and 
+    codingUpdates are the CodingCache's updates to merge back (None outside a worker process)"""
+    
+    fpath, label, cache, useProfile, source = fileItem
+    profile = ParseProfile() if useProfile else None
+    try:
+        if source is None:
+            df_o, df_p = parse_contract_file(fpath, label=label, cache=cache, profile=profile)
+        else:
+            with profile_stage(profile, 'read'):
+                source = source.decode('utf-8')
+            saveName = os.path.splitext(fpath.split('/')[-1])[0]
+            df_o, df_p = parse_contract_source(source, saveName=saveName, label=label, cache=cache,
+                                               profile=profile)
+        errorMsg = None
+    except Exception as e:
+        df_o, df_p = None, None
+        errorMsg = traceback.format_exc()
+    
+    return df_o, df_p, errorMsg, (profile.to_dict() if useProfile else None), get_coding_cache().take_updates()
+
+
+def _hash_file(fpath, zipFile=None):
+    """Return SHA-256 hex digest of a file's content (or of a zipball member's, if zipFile is given)"""
+    
+    if zipFile is not None:
+        return hashlib.sha256(zipFile.read(fpath)).hexdigest()
+    with open(fpath, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _map_in_order(pool, fcn, items, window):
+    """Yield fcn(item) for each item, computed in a process pool, in order
+    
+    Unlike pool.map, at most 'window' items are submitted ahead of the result being
+    yielded, so that items (e.g., from _read_zip_sources) are read and results are
+    held only a few at a time"""
+    
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.submit(fcn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
+
+
+def _read_zip_sources(zipFile, fileItems):
+    """Yield fileItems with the content of each zipball member filled in, one at a time"""
+    
+    for fpath, label, cache, useProfile, _ in fileItems:
+        yield fpath, label, cache, useProfile, zipFile.read(fpath)
+
+
+def get_pipeline_version():
+    """Return an identifier for the code that turns a file into its rows: the solidity_parser
+    version plus a hash of the contract model, comment, and keyword modules"""
+    
+    h = hashlib.sha256(PARSER_VERSION.encode('utf-8'))
+    for module in [contractmodel, contractcomments, contractkeywords]:
+        with open(module.__file__, 'rb') as f:
+            h.update(f.read())
+    
+    return h.hexdigest()[:16]
+
+
+def load_manifest(manifestFile):
+    """Load a parse_repo manifest, or return an empty one if there is none (or it is stale)
+    
+    The manifest records, for the last run on a project, the repoDict used and each
+    parsed file's relative path, content hash, and resulting (untagged) object and
+    parameter rows. It is only valid for the parsing code (see get_pipeline_version)
+    and the keyword coding scheme (contractkeywords.CODING) that produced it."""
+    
+    manifest = {'pipeline_version': get_pipeline_version(), 'coding': copy.deepcopy(contractkeywords.CODING),
+                'repoDict': None, 'files': {}}
+    if os.path.isfile(manifestFile):
+        try:
+            with open(manifestFile, 'rb') as f:
+                prevManifest = pickle.load(f)
+            if prevManifest.get('pipeline_version') == manifest['pipeline_version'] \
+                and prevManifest.get('coding') == manifest['coding']:
+                manifest = prevManifest
+        except (pickle.UnpicklingError, EOFError, AttributeError) as e:
+            logging.warning(f"Ignoring unreadable manifest {manifestFile}: {str(e)}")
+    
+    return manifest
+
+
+def save_manifest(manifestFile, manifest):
+    """Save a parse_repo manifest"""
+    
+    tmpFile = manifestFile + '.tmp'
+    with open(tmpFile, 'wb') as f:
+        pickle.dump(manifest, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpFile, manifestFile)
+
+
+class ChunkedCSVWriter():
+    """Append DataFrames to a CSV file in chunks of rows, for streaming output
+    
+    Writes the same format as df.drop(columns=dropColumns).reset_index().to_csv(path)
+    would for all appended DataFrames concatenated: the header is taken from the first
+    non-empty chunk, and the leading index runs over all rows written.
+    
+    Rows are written to a temporary file, which replaces 'path' on close(keep=True)
+    """
+    
+    def __init__(self, path, dropColumns=None, chunkSize=CHUNK_SIZE):
+        self.path = path
+        self.tmpPath = path + '.tmp'
+        self.dropColumns = dropColumns if dropColumns is not None else []
+        self.chunkSize = chunkSize
+        self.columns = None
+        self.rowCount = 0
+        self._buffer = []
+        self._bufferCount = 0
+        self._file = open(self.tmpPath, 'w')
+        
+    def append(self, df):
+        """Buffer rows of df, writing them out once chunkSize rows are buffered"""
+        
+        if len(df.index) == 0:
+            return
+        self._buffer.append(df)
+        self._bufferCount += len(df.index)
+        if self._bufferCount >= self.chunkSize:
+            self.flush()
+    
+    def flush(self):
+        """Write buffered rows to file"""
+        
+        if len(self._buffer) == 0:
+            return
+        
+        chunk = pd.concat(self._buffer).drop(columns=self.dropColumns).reset_index()
+        chunk.index = range(self.rowCount, self.rowCount + len(chunk.index))
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+            header = True
+        else:
+            chunk = chunk.reindex(columns=self.columns)
+            header = False
+        chunk.to_csv(self._file, header=header)
+        
+        self.rowCount += len(chunk.index)
+        self._buffer = []
+        self._bufferCount = 0
+    
+    def close(self, keep=True):
+        """Write any remaining rows, then move the file into place (or delete it if not keep)"""
+        
+        if keep:
+            self.flush()
+        self._file.close()
+        if keep:
+            os.replace(self.tmpPath, self.path)
+        else:
+            os.remove(self.tmpPath)
+
+
+def _add_repo_columns(df_objects, projectLabel, repoDict):
+    """Add project and repository information to objects DataFrame"""
+    
+    df_objects['project'] = projectLabel
+    df_objects['repo_update_datetime'] = repoDict['updated_at']
+    df_objects['repo_version'] = repoDict['ref']
+    df_objects['repo_url'] = repoDict['url']
+    
+    return df_objects
+
 
 def parse_repo(projectDir, repoDict, projectLabel='', useDefaults=True, clean=False,
-               excludeFiles=None, includeFiles=None, excludeDirs=None, includeDirs=None):
+               excludeFiles=None, includeFiles=None, excludeDirs=None, includeDirs=None, jobs=1,
+               useCache=True, incremental=True, stream=False, chunkSize=CHUNK_SIZE, profile=False,
+               zipSubdir='contracts'):
     """Walk through contracts and parsethe relevant files
     
-    Explicitly only attempts to parse .sol files"""
+    Explicitly only attempts to parse .sol files
+    
+    projectDir may also be an open ZipFile of the repository (see githubscrape.open_zipball),
+    in which case the members that download_repo would extract (for subdir=zipSubdir) are
+    parsed straight from the archive, with the same directory/file rules, instead of
+    being extracted and read back from disk. Files are then walked in sorted order.
+    
+    If jobs > 1, files are parsed in a pool of that many processes (started with
+    POOL_START_METHOD, so that parse_repo can be called from several threads at once);
+    results are still merged in os.walk order, so the output matches a serial run. Each
+    worker starts with a copy of the default CodingCache, and what it adds is merged back.
+    
+    If useCache, parsed ASTs are kept in (and reused from) the default ASTCache
+    
+    If incremental, a manifest of each file's hash and rows is kept for the project,
+    and a re-run only parses files that were added or changed since the last run
+    (dropping rows for files that were removed or are now excluded) before rewriting
+    the output files. Otherwise, existing output files are kept as they are.
+    
+    If stream, each file's rows are appended to the output files (in chunks of up to
+    chunkSize rows) as soon as it is parsed, so that memory use is bounded by the
+    largest files (PARSE_WINDOW per process, if jobs > 1) rather than the whole repository. Streaming does not keep a
+    manifest (which holds every row), so it implies incremental=False.
+    
+    If profile, the time taken by each stage of parse_contract_file (and the number of
+    AST nodes, objects, and parameters) is recorded for each parsed file, summarized
+    in the log, and saved to parse_profile_{projectLabel}.csv"""
     
     objectsFile = os.path.join(TMPDIR, f'contract_objects_{projectLabel}.csv')
     parametersFile = os.path.join(TMPDIR, f'contract_parameters_{projectLabel}.csv')
+    zipFile = projectDir if isinstance(projectDir, ZipFile) else None
+    manifestFile = os.path.join(TMPDIR, f'manifest_{projectLabel}.pkl')
+    profileFile = os.path.join(TMPDIR, f'parse_profile_{projectLabel}.csv')
+    outputsExist = os.path.isfile(objectsFile) and os.path.isfile(parametersFile)
+    
+    if stream:
+        incremental = False
     
-    if os.path.isfile(objectsFile) and os.path.isfile(parametersFile):
-        print(f"Keeping previously parsed results for {projectDir}")
+    projectName = repoDict['id'] if zipFile is not None else projectDir
+    
+    if outputsExist and not incremental:
+        print(f"Keeping previously parsed results for {projectName}")
         return
     
     if excludeFiles is None:
@@ -44,7 +297,7 @@ def parse_repo(projectDir, repoDict, projectLabel='', useDefaults=True, clean=Fa
     else:
         assert type(includeDirs) == list, "provide excludeDirs as a list of strings"
     
-    assert os.path.isdir(projectDir), "specify an existing directory"
+    assert zipFile is not None or os.path.isdir(projectDir), "specify an existing directory"
     assert not (len(excludeFiles) > 0 and len(includeFiles) > 0), "specify only files to exclude or to include, not both"
     assert not (len(excludeDirs) > 0 and len(includeDirs) > 0), "specify only subdirectory names to exclude or to include, not both"
     
@@ -52,15 +305,37 @@ def parse_repo(projectDir, repoDict, projectLabel='', useDefaults=True, clean=Fa
         excludeFiles += EXCLUDE_FILES
         excludeDirs += EXCLUDE_DIRS
 
+    cache = ASTCache() if useCache else None
+    if incremental:
+        manifest = load_manifest(manifestFile)
+        prevFiles = manifest['files']
+    else:
+        manifest = None
+        prevFiles = {}
+    
     errorFiles = []
     fileCount = 0
+    objectCount = 0
+    profiles = []
+    fileItems = []
+    fileNames = []
+    repoFiles = []
+    files = {}
 
     df_objects = pd.DataFrame()
     df_parameters = pd.DataFrame()
 
-    logging.info(f"Walking through {projectDir}...")
-    for root, dirnames, filenames in os.walk(projectDir, topdown=True):
-        subdir = root.split(projectDir)[-1]
+    logging.info(f"Walking through {projectName}...")
+    if zipFile is not None:
+        walk = walk_zipball(zipFile, subdir=zipSubdir, ext='.sol')
+    else:
+        walk = os.walk(projectDir, topdown=True)
+    for root, dirnames, filenames in walk:
+        if zipFile is not None:
+            subdir = root.partition('/')[2]
+            subdir = '/' + subdir if subdir else ''
+        else:
+            subdir = root.split(projectDir)[-1]
         logging.info(f"Parsing {subdir}...")
         
         # Filter dirnames
@@ -78,37 +353,110 @@ def parse_repo(projectDir, repoDict, projectLabel='', useDefaults=True, clean=Fa
             if useDefaults:
                 filenames = [f for f in filenames if not any([re.match(p, f) for p in EXCLUDE_FILE_PATTERNS])]
 
-        # Parse each file and append objects and parameters to main dfs
+        # Collect each file in walk order; only those not already in the manifest need parsing
         for fname in filenames:
-            fpath = os.path.join(root, fname)
-            try:
-                df_o, df_p = parse_contract_file(fpath, label=repoDict['name'])
-                fileURL = construct_file_url(f"{subdir.strip('/')}/{fname}", repoDict)
-                df_o['url'] = fileURL
-                df_p['url'] = fileURL
-                df_objects = pd.concat([df_objects, df_o])
-                df_parameters = pd.concat([df_parameters, df_p])
+            fpath = f"{root}/{fname}" if zipFile is not None else os.path.join(root, fname)
+            relpath = os.path.join(subdir, fname)
+            filepath = f"{subdir.strip('/')}/{fname}"
+            repoFiles.append((relpath, filepath))
+            fileHash = _hash_file(fpath, zipFile=zipFile) if incremental else ''
+            prevEntry = prevFiles.get(relpath)
+            if prevEntry is not None and prevEntry['hash'] == fileHash:
+                files[relpath] = prevEntry
+            else:
+                fileItems.append((fpath, repoDict['name'], cache, profile, None))
+                fileNames.append((fname, relpath, filepath, fileHash))
+
+    unchangedCount = len(files)
+    if incremental and len(fileItems) == 0 and files.keys() == prevFiles.keys() \
+        and manifest['repoDict'] == repoDict and outputsExist:
+        print(f"Keeping previously parsed results for {projectName} (no files changed)")
+        return
+    
+    if stream:
+        objectsWriter = ChunkedCSVWriter(objectsFile, dropColumns=['line_numbers'], chunkSize=chunkSize)
+        parametersWriter = ChunkedCSVWriter(parametersFile, dropColumns=['line_number'], chunkSize=chunkSize)
+    
+    # Parse each new or changed file (lazily, a few files at a time, so that streamed results need not be held)
+    if jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context(POOL_START_METHOD),
+                                   initializer=_init_parse_worker, initargs=(get_coding_cache(),))
+    else:
+        pool = None
+    if zipFile is not None:
+        fileItems = _read_zip_sources(zipFile, fileItems)
+    try:
+        if pool is not None:
+            results = _map_in_order(pool, _parse_repo_file, fileItems, PARSE_WINDOW * jobs)
+        else:
+            results = map(_parse_repo_file, fileItems)
+        for (fname, relpath, filepath, fileHash), (df_o, df_p, errorMsg, profileDict, codingUpdates) \
+            in zip(fileNames, results):
+            get_coding_cache().merge(codingUpdates)
+            if profileDict is not None:
+                profileDict['file'] = relpath
+                profiles.append(profileDict)
+            if errorMsg is not None:
+                logging.error(f"Error parsing {fname}:\n{errorMsg}")
+                errorFiles.append(relpath)
+            elif stream:
+                fileURL = construct_file_url(filepath, repoDict)
+                objectsWriter.append(_add_repo_columns(df_o.assign(url=fileURL), projectLabel, repoDict))
+                parametersWriter.append(df_p.assign(url=fileURL))
+                objectCount += len(df_o.index)
                 fileCount += 1
-            except Exception as e:
-                logging.exception(f"Error parsing {fname}:\n{str(e)}")
-                errorFiles.append(os.path.join(subdir, fname))
+            else:
+                files[relpath] = {'hash': fileHash, 'objects': df_o, 'parameters': df_p}
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    
+    if stream:
+        # Keep output files only if any objects were found
+        objectsWriter.close(keep=(objectCount > 0))
+        parametersWriter.close(keep=(objectCount > 0))
+    else:
+        # Append objects and parameters of each file to main dfs, in walk order
+        objectsList = []
+        parametersList = []
+        for relpath, filepath in repoFiles:
+            entry = files.get(relpath)
+            if entry is None:
+                continue
+            fileURL = construct_file_url(filepath, repoDict)
+            objectsList.append(entry['objects'].assign(url=fileURL))
+            parametersList.append(entry['parameters'].assign(url=fileURL))
+            fileCount += 1
+        df_objects = pd.concat([df_objects] + objectsList)
+        df_parameters = pd.concat([df_parameters] + parametersList)
         
-    # Save parsed data to files
-    if (len(df_objects.index) > 0):
-        df_objects['project'] = projectLabel
-        df_objects['repo_update_datetime'] = repoDict['updated_at']
-        df_objects['repo_version'] = repoDict['ref']
-        df_objects['repo_url'] = repoDict['url']
-        df_objects.drop(columns=['line_numbers']).reset_index().to_csv(objectsFile)
-        df_parameters.drop(columns=['line_number']).reset_index().to_csv(parametersFile)
-    
-    logging.info(f"Summary for {projectLabel}: parsed {fileCount} files")
+        # Save parsed data to files (removing those of a previous run if nothing is left)
+        if (len(df_objects.index) > 0):
+            df_objects = _add_repo_columns(df_objects, projectLabel, repoDict)
+            df_objects.drop(columns=['line_numbers']).reset_index().to_csv(objectsFile)
+            df_parameters.drop(columns=['line_number']).reset_index().to_csv(parametersFile)
+        else:
+            for f in [objectsFile, parametersFile]:
+                if os.path.isfile(f):
+                    os.remove(f)
+    
+    if profile:
+        df_profile = summarize_profiles(profiles, label=projectLabel)
+        df_profile.to_csv(profileFile, index=False)
+    
+    if incremental:
+        manifest['repoDict'] = repoDict
+        manifest['files'] = files
+        save_manifest(manifestFile, manifest)
+    
+    logging.info(f"Summary for {projectLabel}: parsed {fileCount} files "
+                 f"({unchangedCount} unchanged since last run)")
     if len(errorFiles) > 0:
         logging.warning("Could not parse the following files:")
         for f in errorFiles:
             logging.warning(f"\t{f}")
             
-    if clean:
+    if clean and zipFile is None:
         shutil.rmtree(projectDir)
             
 
@@ -131,36 +479,223 @@ def import_contracts(csv):
     return df_contracts
 
 
-def download_and_parse(githubURL, subdir, label='', kwargs={}):
+def download_and_parse(githubURL, subdir, label='', kwargs={}, fromZip=False):
     
-    repoDir, repoDict = download_repo(githubURL, subdir=subdir)
+    if fromZip:
+        parse_zipped_repo(githubURL, subdir, label=label, kwargs=kwargs)
+    else:
+        repoDir, repoDict = download_repo(githubURL, subdir=subdir)
+        parse_downloaded_repo(repoDir, repoDict, label=label, kwargs=kwargs)
+
+
+def parse_downloaded_repo(repoDir, repoDict, label='', kwargs={}):
     
     assert os.path.isdir(repoDir), "could not download/unzip file as specified"
 
     if label == '':
         label = repoDict['id']
     parse_repo(repoDir, repoDict, projectLabel=label, **kwargs)
+
+
+def parse_zipped_repo(githubURL, subdir, label='', kwargs={}):
+    """Download a repository's zipball and parse its contracts without extracting them (see parse_repo)
+    
+    Errors specific to the repository (see REPO_ERRORS) are printed; RateLimitExceeded is raised"""
+    
+    assert 'github.com' in githubURL, "Download a repository from github.com only"
+    
+    try:
+        repoDict = get_repo_dict(githubURL)
+    except REPO_ERRORS as e:
+        print(e)
+        return
+    
+    if label == '':
+        label = repoDict['id']
+    try:
+        with open_zipball(repoDict) as zipFile:
+            parse_repo(zipFile, repoDict, projectLabel=label, zipSubdir=subdir, **kwargs)
+    except (requests.RequestException, BadZipFile) as e:
+        print(e)
     
 
-def download_and_parse_all():
-    csv = os.path.join(CWD, 'repos.csv')
+def prefetch_zipped_repo(githubURL):
+    """Get a repository's metadata and (if the ArchiveCache is enabled) its zipball ahead of
+    parse_zipped_repo, which then finds both already cached"""
+    
+    try:
+        repoDict = get_repo_dict(githubURL)
+        if get_archive_cache() is not None and repoDict.get('sha'):
+            get_archive(repoDict)
+    except REPO_ERRORS as e:
+        print(e)
+
+
+def _put_unless_stopped(q, item, stop):
+    """Put item in bounded queue q, waiting for room unless 'stop' is set; returns True if put"""
+    
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    
+    return False
+
+
+def run_pipeline(items, download, parse, downloadJobs=DOWNLOAD_JOBS, parseJobs=1, queueSize=PIPELINE_QUEUE_SIZE):
+    """Call download(item) for each item in up to downloadJobs threads, while parse(item, downloaded)
+    is called in up to parseJobs threads on each item as soon as it has been downloaded
+    
+    At most queueSize downloaded items wait to be parsed, so downloads stay only a few items
+    ahead of parsing. If either stage raises, the pipeline stops and the exception is re-raised.
+    
+    Returns dict of the time (summed over threads) each stage spent busy and stalled: downloaders
+    waiting for room in the queue, and parsers waiting for a download
+    """
+    
+    todo = queue.Queue()
+    for item in items:
+        todo.put(item)
+    ready = queue.Queue(maxsize=max(1, queueSize))
+    stop = threading.Event()
+    errors = []
+    stats = {'download_sec': 0.0, 'download_stall_sec': 0.0, 'parse_sec': 0.0, 'parse_stall_sec': 0.0}
+    statsLock = threading.Lock()
+    done = object()
+    
+    def add_time(name, start):
+        with statsLock:
+            stats[name] += time.perf_counter() - start
+    
+    def downloader():
+        while not stop.is_set():
+            try:
+                item = todo.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            try:
+                downloaded = download(item)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+                return
+            add_time('download_sec', start)
+            start = time.perf_counter()
+            _put_unless_stopped(ready, (item, downloaded), stop)
+            add_time('download_stall_sec', start)
+    
+    def parser():
+        while True:
+            start = time.perf_counter()
+            entry = None
+            while entry is None and not stop.is_set():
+                try:
+                    entry = ready.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            add_time('parse_stall_sec', start)
+            if entry is done or stop.is_set():
+                return
+            start = time.perf_counter()
+            try:
+                parse(*entry)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+                return
+            add_time('parse_sec', start)
+    
+    downloaders = [threading.Thread(target=downloader, daemon=True) for _ in range(max(1, downloadJobs))]
+    parsers = [threading.Thread(target=parser, daemon=True) for _ in range(max(1, parseJobs))]
+    for t in downloaders + parsers:
+        t.start()
+    for t in downloaders:
+        t.join()
+    for t in parsers:
+        if not _put_unless_stopped(ready, done, stop):
+            break
+    for t in parsers:
+        t.join()
+    
+    if len(errors) > 0:
+        raise errors[0]
+    
+    return stats
+
+
+def download_and_parse_all(jobs=1, stream=False, profile=False, downloadJobs=DOWNLOAD_JOBS, fromZip=False,
+                           parseJobs=1, queueSize=PIPELINE_QUEUE_SIZE):
+    """Download and parse all repositories in data/repos.csv, overlapping the two (see run_pipeline)
+    
+    Up to downloadJobs repositories are downloaded at once, while up to parseJobs of those
+    already downloaded are parsed (each with a pool of 'jobs' processes, see parse_repo), and
+    at most queueSize downloaded repositories wait to be parsed. The time each stage spent
+    stalled waiting on the other is logged.
+    
+    If fromZip, each repository's contracts are instead parsed straight from its zipball
+    (see parse_zipped_repo), without extracting anything to disk"""
+    
+    csv = os.path.join(CWD, 'data', 'repos.csv')
     df_contracts = import_contracts(csv)
     
-    for i, row in df_contracts.iterrows():
+    # Share coded names/descriptions between projects (and with previous runs)
+    codingCache = CodingCache.load(CODING_CACHE_FILE)
+    set_coding_cache(codingCache)
+    
+    # Keep a connection alive for each download thread (and each parse thread, which may also
+    # download zipballs if fromZip and the ArchiveCache is disabled)
+    get_session(poolSize=downloadJobs + parseJobs)
+    
+    def download(row):
+        if fromZip:
+            return prefetch_zipped_repo(row['repoURL'])
+        return download_repo(row['repoURL'], subdir=row['subdir'])
+    
+    def parse(row, downloaded):
         print(f"\n============ {row['project']} ============\n")
         kwargs = {c: row[c] for c in ['excludeDirs', 'includeDirs', 'excludeFiles', 'includeFiles'] if row[c]}
         if 'includeFiles' in kwargs.keys():
             kwargs['useDefaults'] = False
         kwargs['clean'] = False
+        kwargs['jobs'] = jobs
+        kwargs['stream'] = stream
+        kwargs['profile'] = profile
         
         try:
-            download_and_parse(row['repoURL'], row['subdir'], label=row['project'], kwargs=kwargs)
+            if fromZip:
+                parse_zipped_repo(row['repoURL'], row['subdir'], label=row['project'], kwargs=kwargs)
+            else:
+                repoDir, repoDict = downloaded
+                parse_downloaded_repo(repoDir, repoDict, label=row['project'], kwargs=kwargs)
         except AssertionError as e:
             print(e)
+    
+    start = time.perf_counter()
+    stats = run_pipeline([row for i, row in df_contracts.iterrows()], download, parse,
+                         downloadJobs=downloadJobs, parseJobs=parseJobs, queueSize=queueSize)
+    logging.info(f"Pipeline: {len(df_contracts.index)} repositories in {time.perf_counter() - start:.1f}s; "
+                 f"download {stats['download_sec']:.1f}s busy, {stats['download_stall_sec']:.1f}s stalled (waiting for parsing); "
+                 f"parse {stats['parse_sec']:.1f}s busy, {stats['parse_stall_sec']:.1f}s stalled (waiting for downloads)")
+    
+    # (Including hits/misses and entries merged back from parse_repo's worker processes, if jobs > 1)
+    stats = codingCache.get_stats()
+    if stats['hits'] + stats['misses'] > 0:
+        logging.info(f"Coding cache: {stats['hits']} hits, {stats['misses']} misses "
+                     f"({100 * stats['hit_rate']:.1f}% hit rate), {stats['size']} entries")
+    os.makedirs(TMPDIR, exist_ok=True)
+    codingCache.save(CODING_CACHE_FILE)
+    
+    stats = get_scheduler().get_stats()
+    logging.info(f"API requests: {stats['requests']} ({stats['not_modified']} not modified, {stats['retries']} retried), "
+                 f"{stats['paced_sec']:.0f}s paced, {stats['rate_limit_wait_sec']:.0f}s waiting for the rate limit to reset")
 
 
-def main(url):
-    download_and_parse(url, 'contracts')
+def main(url, jobs=1, stream=False, profile=False, fromZip=False):
+    download_and_parse(url, 'contracts', kwargs={'jobs': jobs, 'stream': stream, 'profile': profile},
+                       fromZip=fromZip)
 
     
 if __name__ == '__main__':
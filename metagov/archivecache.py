@@ -0,0 +1,165 @@
+import os
+import json
+import threading
+from zipfile import ZipFile
+
+CWD = os.path.join(os.path.dirname(__file__))
+if CWD.rstrip('/').endswith('metagov'):
+    CWD = CWD.rstrip('/').rsplit('/', 1)[0]
+TMPDIR = os.path.join(CWD, 'tmp')
+
+ARCHIVE_DIR = os.path.join(TMPDIR, 'archives')
+ARCHIVE_SIZE_LIMIT = 2 * 1024**3 # Bytes on disk before least-recently-used archives are evicted
+ARCHIVE_EXT = '.zip'
+MANIFEST_EXT = '.json'
+
+
+# =============================================================================
+# Content-addressed cache of repository archives
+# =============================================================================
+class ArchiveCache():
+    """On-disk cache of repository zipballs, keyed by the commit SHA they were made from
+
+    Each commit is stored once, however it was referred to (e.g., by a tag and by a branch).
+    Next to each archive {sha}.zip, a manifest {sha}.json records its top-level directory
+    and the paths of the files in it, so that its content can be checked without opening it
+    (and whether it has a given subdirectory in a single set lookup, see contains_subdir).
+
+    Opening an archive refreshes its modification time, and once the total size of the
+    archives exceeds sizeLimit the least recently used ones are deleted. Entries are
+    written atomically, so a cache directory can be shared between processes.
+    """
+
+    def __init__(self, cacheDir=ARCHIVE_DIR, sizeLimit=ARCHIVE_SIZE_LIMIT):
+        self.cacheDir = cacheDir
+        self.sizeLimit = sizeLimit
+        self._manifests = {}
+        self._subdirs = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.cacheDir, exist_ok=True)
+        self.evict() # In case sizeLimit was lowered since the cache was last used
+
+    def _get_path(self, sha, ext=ARCHIVE_EXT):
+        return os.path.join(self.cacheDir, sha + ext)
+
+    def get_lock(self, sha):
+        """Return lock for adding an archive (so that a commit is not downloaded twice at once)"""
+
+        with self._lock:
+            return self._locks.setdefault(sha, threading.Lock())
+
+    def get_tmp_path(self, sha):
+        """Return a temporary path to write an archive to before add()ing it"""
+
+        return f"{self._get_path(sha)}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def get(self, sha):
+        """Return path to the archive of a commit (marking it as recently used), or None if not cached"""
+
+        path = self._get_path(sha)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return path
+
+    def add(self, sha, tmpPath):
+        """Move the archive written to tmpPath into the cache (with its manifest), then evict
+        old archives if over the size limit
+
+        Returns path to the cached archive"""
+
+        with ZipFile(tmpPath) as zipFile:
+            names = zipFile.namelist()
+        top = names[0].split('/')[0] if names else ''
+        manifest = {'top': top,
+                    'paths': [n.split('/', 1)[-1] for n in names if not n.endswith('/')],
+                    'size': os.path.getsize(tmpPath)}
+
+        manifestPath = self._get_path(sha, MANIFEST_EXT)
+        with open(tmpPath + MANIFEST_EXT, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmpPath + MANIFEST_EXT, manifestPath)
+        path = self._get_path(sha)
+        os.replace(tmpPath, path)
+        with self._lock:
+            self._manifests[sha] = manifest
+
+        self.evict(keep=sha)
+
+        return path
+
+    def get_manifest(self, sha):
+        """Return manifest {'top', 'paths', 'size'} of a cached archive, or None if not cached"""
+
+        with self._lock:
+            manifest = self._manifests.get(sha)
+        if manifest is None:
+            try:
+                with open(self._get_path(sha, MANIFEST_EXT)) as f:
+                    manifest = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                return None
+            with self._lock:
+                self._manifests[sha] = manifest
+
+        return manifest
+
+    def contains_subdir(self, sha, subdir):
+        """Return True if a cached archive has a directory named subdir (or a path of directories
+        such as 'data/contracts') anywhere in it, as githubscrape.is_repo_member matches members
+        (False if not cached)"""
+
+        with self._lock:
+            subdirs = self._subdirs.get(sha)
+        if subdirs is None:
+            manifest = self.get_manifest(sha)
+            if manifest is None:
+                return False
+            subdirs = set()
+            for p in manifest['paths']:
+                parts = p.split('/')[:-1]
+                for i in range(len(parts)):
+                    subdirs.update('/'.join(parts[i:j]) for j in range(i + 1, len(parts) + 1))
+            with self._lock:
+                self._subdirs[sha] = subdirs
+
+        return subdir.strip('/') in subdirs
+
+    def evict(self, keep=None):
+        """Delete least recently used archives (other than that of commit 'keep') until the
+        cache fits in sizeLimit"""
+
+        entries = []
+        totalSize = 0
+        for entry in os.scandir(self.cacheDir):
+            if entry.name.endswith(ARCHIVE_EXT):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                totalSize += stat.st_size
+
+        for mtime, size, path in sorted(entries):
+            if totalSize <= self.sizeLimit:
+                break
+            sha = os.path.basename(path)[:-len(ARCHIVE_EXT)]
+            if sha == keep:
+                continue
+            for p in [path, self._get_path(sha, MANIFEST_EXT)]:
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+            with self._lock:
+                self._manifests.pop(sha, None)
+                self._subdirs.pop(sha, None)
+            totalSize -= size
+
+    def get_size(self):
+        """Return total size in bytes of the cached archives"""
+
+        return sum(e.stat().st_size for e in os.scandir(self.cacheDir) if e.name.endswith(ARCHIVE_EXT))
@@ -0,0 +1,179 @@
+import os
+import zlib
+import pickle
+import hashlib
+import threading
+from importlib import metadata
+from solidity_parser import parser
+
+CWD = os.path.join(os.path.dirname(__file__))
+if CWD.rstrip('/').endswith('metagov'):
+    CWD = CWD.rstrip('/').rsplit('/', 1)[0]
+TMPDIR = os.path.join(CWD, 'tmp')
+
+CACHE_DIR = os.path.join(TMPDIR, 'astcache')
+CACHE_SIZE_LIMIT = 512 * 1024**2 # Bytes on disk before least-recently-used entries are evicted
+CACHE_EXT = '.ast'
+
+
+def get_parser_version():
+    """Return an identifier for the installed solidity_parser: its package version plus a
+    hash of its parser module, so that a changed visitor invalidates cached results even
+    if the version number was not bumped (e.g., an edited or reinstalled package)"""
+
+    try:
+        version = metadata.version('solidity-parser')
+    except metadata.PackageNotFoundError:
+        version = getattr(parser, '__version__', '')
+    with open(parser.__file__, 'rb') as f:
+        version = f"{version}-{hashlib.sha256(f.read()).hexdigest()[:16]}"
+
+    return version
+
+
+PARSER_VERSION = get_parser_version()
+
+
+def _to_plain(node):
+    """Recursively convert solidity_parser Nodes to plain dicts and lists
+
+    (Node overrides __getattr__, which makes it awkward to pickle; the rest of
+    the pipeline only uses dict access anyway). A few nodes (e.g., the 'decl' of
+    tuple variable declarations) hold raw ANTLR contexts, which are replaced
+    by their source text."""
+
+    if isinstance(node, dict):
+        return {k: _to_plain(v) for k, v in node.items()}
+    elif isinstance(node, (list, tuple)):
+        return [_to_plain(v) for v in node]
+    elif node is None or isinstance(node, (str, int, float, bool)):
+        return node
+    elif hasattr(node, 'getText'):
+        return node.getText()
+    else:
+        return str(node)
+
+
+# =============================================================================
+# Content-addressed cache of parsed sourceUnits
+# =============================================================================
+class ASTCache():
+    """On-disk cache of solidity_parser results, keyed by file content and parser version
+
+    Each parsed sourceUnit is stored as a zlib-compressed pickle in cacheDir. Reading
+    an entry refreshes its modification time, and once the total size of the cache
+    exceeds sizeLimit the least recently used entries are deleted.
+
+    Entries are written atomically, so a cache directory can be shared between
+    threads and processes (e.g., parse_repo with jobs > 1).
+
+    The total size is tracked in memory as entries are written, and the directory is
+    only scanned (and the total corrected for other processes' writes) when it goes
+    over sizeLimit.
+    """
+
+    def __init__(self, cacheDir=CACHE_DIR, sizeLimit=CACHE_SIZE_LIMIT):
+        self.cacheDir = cacheDir
+        self.sizeLimit = sizeLimit
+        self._lock = threading.Lock()
+        os.makedirs(self.cacheDir, exist_ok=True)
+        self.evict() # In case sizeLimit was lowered since the cache was last used
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock'] # (The cache is passed to worker processes)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(text):
+        """Return cache key for source text"""
+
+        h = hashlib.sha256(PARSER_VERSION.encode('utf-8'))
+        h.update(text.encode('utf-8'))
+
+        return h.hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.cacheDir, key + CACHE_EXT)
+
+    def get(self, key):
+        """Return cached sourceUnit, or None if not in the cache"""
+
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                sourceUnit = pickle.loads(zlib.decompress(f.read()))
+            os.utime(path)
+        except (FileNotFoundError, zlib.error, pickle.UnpicklingError, EOFError):
+            sourceUnit = None
+
+        return sourceUnit
+
+    def set(self, key, sourceUnit):
+        """Store sourceUnit under key, then evict old entries if over the size limit"""
+
+        path = self._get_path(key)
+        tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        data = zlib.compress(pickle.dumps(sourceUnit, protocol=pickle.HIGHEST_PROTOCOL))
+        with open(tmpPath, 'wb') as f:
+            f.write(data)
+        try:
+            os.replace(tmpPath, path)
+        except FileNotFoundError:
+            return # Lost to a concurrent write (or clearing) of the cache; the entry is just not stored
+
+        with self._lock:
+            self._size += len(data)
+            isOverLimit = self._size > self.sizeLimit
+        if isOverLimit:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in sizeLimit"""
+
+        entries = []
+        totalSize = 0
+        for entry in os.scandir(self.cacheDir):
+            if entry.name.endswith(CACHE_EXT):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                totalSize += stat.st_size
+
+        for mtime, size, path in sorted(entries):
+            if totalSize <= self.sizeLimit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            totalSize -= size
+
+        with self._lock:
+            self._size = totalSize
+
+    def parse(self, text):
+        """Return parsed sourceUnit for Solidity source text, using the cache if possible"""
+
+        key = self.get_key(text)
+        sourceUnit = self.get(key)
+        if sourceUnit is None:
+            sourceUnit = _to_plain(parser.parse(text, loc=True))
+            self.set(key, sourceUnit)
+
+        return sourceUnit
+
+    def parse_file(self, fpath):
+        """Return parsed sourceUnit for a Solidity file, using the cache if possible"""
+
+        # Read file the same way as solidity_parser.parser.parse_file
+        with open(fpath, 'r', encoding='utf-8') as f:
+            text = f.read()
+
+        return self.parse(text)
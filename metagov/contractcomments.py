@@ -1,4 +1,139 @@
 import re
+import numpy as np
+from bisect import bisect_left
+
+NATSPEC_TAGS = ['title', 'notice', 'dev', 'param', 'return'] # Tags to keep
+
+PATTERN_LINE_COMMENT = re.compile(r'//+')
+PATTERN_BLOCK_PREFIX = re.compile(r'^\s*\*\s*')
+PATTERN_NATSPEC_TAG = re.compile(r'\n@([a-z]+)')
+PATTERN_ANY_TAG = re.compile(r'@[a-z]+')
+
+
+# =============================================================================
+# Tokenize comments once per file
+# =============================================================================
+class CommentIndex():
+    """Comments of a file, tokenized once, for looking up the comment of any span of lines
+    
+    Each line is stripped and classified once: whether it is blank, is a line comment (and
+    its text without slashes), is part of a block comment (and its text without the leading
+    asterisk), has a trailing inline comment, and where any block comments open. Runs of
+    contiguous line comments are recorded as well, so that cleaning the comment in a span 
+    (see clean) only touches the lines of that comment rather than re-joining and 
+    re-searching the whole span.
+    
+    Spans are (start, end) slices of lines, as used by add_docstring_comments, 
+    add_inline_comments and contractmodel.ContractVisitor.
+    """
+    
+    def __init__(self, lines):
+        self.lines = lines
+        self.stripped = [s.strip() for s in lines]
+        self.nonEmpty = [i for i, s in enumerate(self.stripped) if s]
+        
+        # Lines opening a block comment, and offset of the first '/**' on each
+        self.blockOpenLines = []
+        self.blockOpenOffsets = {}
+        for i in self.nonEmpty:
+            offset = self.stripped[i].find('/**')
+            if offset >= 0:
+                self.blockOpenLines.append(i)
+                self.blockOpenOffsets[i] = offset
+        
+        # Start of the run of contiguous line comments (ignoring blank lines) ending at each line comment
+        self.lineCommentRunStart = {}
+        prev = None
+        for i in self.nonEmpty:
+            if self.stripped[i].startswith('//'):
+                self.lineCommentRunStart[i] = self.lineCommentRunStart[prev] if prev in self.lineCommentRunStart else i
+            prev = i
+        
+        self._lineComments = {}
+        self._inlineComments = {}
+    
+    def _line_comment(self, i):
+        """Text of line comment i, without slashes"""
+        
+        if i not in self._lineComments:
+            self._lineComments[i] = PATTERN_LINE_COMMENT.sub('', self.stripped[i]).strip()
+        return self._lineComments[i]
+    
+    def _block_line(self, s):
+        """Text of a line within a block comment, without leading asterisk"""
+        
+        return PATTERN_BLOCK_PREFIX.sub('', s).strip()
+    
+    def _inline_comment(self, i):
+        """Text after the last '//' of line i ('' if none)"""
+        
+        if i not in self._inlineComments:
+            tmp = PATTERN_LINE_COMMENT.split(self.lines[i])
+            self._inlineComments[i] = tmp[-1] if len(tmp) > 1 else ''
+        return self._inlineComments[i]
+    
+    def _get_range(self, start, end):
+        """Normalize slice (start, end) of lines to a range of line indices"""
+        
+        return range(len(self.lines))[start:end]
+    
+    def _clean_range(self, lineRange):
+        """Return comment lines at the end of a range of lines (see _clean_comment_lines)"""
+        
+        # Last non-blank line in range
+        k = bisect_left(self.nonEmpty, lineRange.stop) - 1
+        if k < 0 or self.nonEmpty[k] < lineRange.start:
+            return []
+        last = self.nonEmpty[k]
+        lastLine = self.stripped[last]
+        
+        # Try to get comment block right before the object, if there is one: i.e., from the first
+        # '/**' in range to a '*/' that ends the last line (with something in between)
+        if lastLine.endswith('*/'):
+            b = bisect_left(self.blockOpenLines, lineRange.start)
+            if b < len(self.blockOpenLines) and self.blockOpenLines[b] <= last:
+                first = self.blockOpenLines[b]
+                offset = self.blockOpenOffsets[first]
+                if first < last:
+                    blockLines = ([self.stripped[first][offset + 3:]] +
+                                  [self.stripped[i] for i in self.nonEmpty[bisect_left(self.nonEmpty, first) + 1:k]] +
+                                  [lastLine[:-2]])
+                    return [self._block_line(s) for s in blockLines if s]
+                elif len(lastLine) - offset >= 6:
+                    blockLine = lastLine[offset + 3:-2]
+                    return [self._block_line(blockLine)] if blockLine else []
+        
+        # Otherwise, get contiguous block of individual line comments right before object
+        if last not in self.lineCommentRunStart:
+            return []
+        runStart = max(self.lineCommentRunStart[last], lineRange.start)
+        return [self._line_comment(i) for i in self.nonEmpty[bisect_left(self.nonEmpty, runStart):k + 1]]
+    
+    def clean(self, start, end, includesInline=False):
+        """Return the same as clean_comment_lines(lines[start:end], includesInline)"""
+        
+        lineRange = self._get_range(start, end)
+        if includesInline:
+            # Clean comment lines prior to inline, and add inline comment
+            lines_new = self._clean_range(lineRange[:-1]) + [self._inline_comment(lineRange[-1])]
+        else:
+            lines_new = self._clean_range(lineRange)
+        
+        return [s.strip() for s in lines_new if s.strip()]
+    
+    def parse_object_comments(self, start, end):
+        """Return the same as parse_object_comments(lines[start:end])"""
+        
+        return _parse_object_comment_lines(self.clean(start, end))
+    
+    def parse_parameter_comments(self, start, end):
+        """Return the same as parse_parameter_comments(lines[start:end])"""
+        
+        lineRange = self._get_range(start, end)
+        lines = self.clean(start, end, includesInline=True)
+        
+        return _parse_parameter_comment_lines(lines, self.lines[lineRange[-1]])
+
 
 # =============================================================================
 # Populate object and parameter comments
@@ -16,30 +151,7 @@ def _clean_comment_lines(lines):
     - lines_new (list(str)): cleaned list of comments (may be empty list)
     """
     
-    lines = [s.strip() for s in lines if s.strip()]
-    linesStr = '\n'.join(lines)
-    
-    # Try to get comment block right before the object, if there is one
-    pattern_commentBlock = re.compile(r'/\*\*(.+?)\*/$', re.DOTALL)
-    match = re.search(pattern_commentBlock, linesStr)
-    if match:
-        # Remove asterisks
-        lines_new = match.group(1).split('\n')
-        lines_new = [re.sub('^\s*\*\s*', '', s).strip() for s in lines_new if s]
-    else:
-        # Otherwise, get contiguous block of individual line comments right before object
-        lines_new = []
-        i = len(lines) - 1
-        endFlag = False
-        while i >= 0 and not endFlag:
-            if lines[i].startswith('//'):
-                lines_new.append(re.sub(r'//+', '', lines[i]).strip())
-            else:
-                endFlag = True
-            i -= 1
-        lines_new = lines_new[::-1]
-    
-    return lines_new
+    return CommentIndex(lines)._clean_range(range(len(lines)))
 
 
 def clean_comment_lines(lines_raw, includesInline=False):
@@ -54,20 +166,7 @@ def clean_comment_lines(lines_raw, includesInline=False):
       - lines_new (list(str)): cleaned list of comments (may be empty list)
     """
     
-    if includesInline:
-        # Clean comment lines prior to inline
-        prevLines = _clean_comment_lines(lines_raw[:-1])
-        
-        # Clean inline comment separately and add to prior comments
-        tmp = re.split(r'//+', lines_raw[-1])
-        inLine = [tmp[-1]] if len(tmp) > 1 else ['']
-        lines_new = prevLines + inLine
-    else:
-        lines_new = _clean_comment_lines(lines_raw)
-    
-    lines_new = [s.strip() for s in lines_new if s.strip()]
-    
-    return lines_new
+    return CommentIndex(lines_raw).clean(0, len(lines_raw), includesInline=includesInline)
 
 
 def parse_object_comments(lines_raw):
@@ -87,11 +186,14 @@ def parse_object_comments(lines_raw):
             string and one-line description
     """
 
+    return _parse_object_comment_lines(clean_comment_lines(lines_raw))
+
+
+def _parse_object_comment_lines(lines):
+    """Parse cleaned comment lines of an object (see parse_object_comments)"""
+
     commentDict = {}    
     
-    # Clean lines
-    lines = clean_comment_lines(lines_raw)  
-    
     # Don't bother with the rest if no description was found
     if len(lines) == 0:
         return commentDict
@@ -100,7 +202,7 @@ def parse_object_comments(lines_raw):
     commentDict['full_comment'] = '\n'.join(lines)  
     
     # Add tag values, if NatSpec is used
-    splitLines = re.split(r'\n@([a-z]+)', '\n' + '\n'.join(lines))[1:] 
+    splitLines = PATTERN_NATSPEC_TAG.split('\n' + commentDict['full_comment'])[1:] 
     if len(splitLines) > 0:
         values = zip(splitLines[::2], splitLines[1::2])
         for (tag, value) in values:
@@ -145,9 +247,15 @@ def parse_parameter_comments(lines_raw):
             string and one-line description
     """
 
-    # Clean lines
     lines = clean_comment_lines(lines_raw, includesInline=True)
     
+    return _parse_parameter_comment_lines(lines, lines_raw[-1])
+
+
+def _parse_parameter_comment_lines(lines, definitionLine):
+    """Parse cleaned comment lines of a parameter, given the (raw) line defining it 
+    (see parse_parameter_comments)"""
+    
     commentDict = {}
 
     # Don't bother with the rest if no description was found
@@ -158,10 +266,10 @@ def parse_parameter_comments(lines_raw):
     commentDict['full_comment'] = '\n'.join(lines)      
 
     # Strip any tags from the description
-    lines_noTags = [re.split(r'@[a-z]+', s)[-1].strip() for s in lines]
+    lines_noTags = [PATTERN_ANY_TAG.split(s)[-1].strip() for s in lines]
     
     # Add description
-    hasInline = (lines[-1] in lines_raw[-1])
+    hasInline = (lines[-1] in definitionLine)
     if hasInline and len(lines) == 1:
         inline = lines[0]
         description = inline
@@ -177,18 +285,54 @@ def parse_parameter_comments(lines_raw):
     return commentDict
 
 
+def index_parameters(contracts, objectNames, parameterNames, lineNumbers):
+    """Index parameters by (contract, object name, parameter name)
+    
+    Arguments are equal-length sequences (e.g., columns of the parameters DataFrame).
+    Returns dict of key: list of (line number, position) for each parameter with that key,
+    in order (more than one if e.g. an object name is overloaded within a contract)
+    """
+    
+    paramIndex = {}
+    for position, (contract, objectName, paramName, lineNumber) in enumerate(zip(contracts, objectNames, 
+                                                                                 parameterNames, lineNumbers)):
+        paramIndex.setdefault((contract, objectName, paramName), []).append((lineNumber, position))
+    
+    return paramIndex
+
+
+def find_parameter(paramIndex, contract, objectName, paramName, objectLines):
+    """Return position of the parameter named in an object's docstring (see index_parameters)
+    
+    Picks the parameter that is defined within the object's (start, end) lines, so that 
+    overloaded objects get their own parameters; raises KeyError if there is no such parameter
+    (including if only another overload of the object has a parameter of that name)
+    """
+    
+    candidates = paramIndex.get((contract, objectName, paramName), [])
+    for lineNumber, position in candidates:
+        if objectLines[0] <= lineNumber <= objectLines[-1]:
+            return position
+    
+    raise KeyError((contract, objectName, paramName))
+
+
 def add_docstring_comments(lines, df_objects, df_parameters):
     """Parse comments and add them to the relevant rows in the object and parameter DataFrames"""
 
     df_o = df_objects.copy(deep=True)
     df_p = df_parameters.copy(deep=True)
 
-    # Define tags to keep
-    NATSPEC_TAGS = ['title', 'notice', 'dev', 'param', 'return']
     for tag in NATSPEC_TAGS:
         df_o[tag] = ''
     df_o['description'] = ''
     df_o['full_comment'] = ''
+    
+    commentIndex = CommentIndex(lines)
+    
+    paramIndex = index_parameters(df_p.get('contract', []), df_p.get('object_name', []),
+                                  df_p.get('parameter_name', []), df_p.get('line_number', []))
+    descriptionLoc = df_p.columns.get_loc('description') if 'description' in df_p.columns else None
         
     prevObjectLoc = (0,0)
     for i, row in df_o.iterrows():
@@ -198,8 +342,7 @@ def add_docstring_comments(lines, df_objects, df_parameters):
             commentStart = prevObjectLoc[1]
         else:
             commentStart = prevObjectLoc[0]
-        commentLines = lines[commentStart:commentEnd]
-        commentDict = parse_object_comments(commentLines)
+        commentDict = commentIndex.parse_object_comments(commentStart, commentEnd)
 
         # Add object descriptions to objects
         for key, value in commentDict.items():
@@ -208,11 +351,13 @@ def add_docstring_comments(lines, df_objects, df_parameters):
                     value = list(value.keys())
                 df_o.iat[i, df_o.columns.get_loc(key)] = value               
 
-        # Add parameter descriptions to parameters
+        # Add parameter descriptions to parameters (skipping tags for parameters the object does not have)
         for paramName, paramDescription in commentDict.get('param', {}).items():
-            index = df_p.loc[(df_p['object_name']==row['object_name']) &
-                             (df_p['parameter_name']==paramName)].index[0]
-            df_p.iat[index, df_p.columns.get_loc('description')] = paramDescription
+            try:
+                index = find_parameter(paramIndex, row['contract'], row['object_name'], paramName, row['line_numbers'])
+            except KeyError:
+                continue
+            df_p.iat[index, descriptionLoc] = paramDescription
 
         prevObjectLoc = row['line_numbers']
 
@@ -220,47 +365,134 @@ def add_docstring_comments(lines, df_objects, df_parameters):
 
 
 def add_inline_comments(lines, df_parameters):
-    """Parse comments and add them to the relevant rows in the parameter DataFrame"""
+    """Parse comments and add them to the relevant rows in the parameter DataFrame
+    
+    Each parameter's comment spans the lines since the previous parameter (in line order)
+    up to and including its own; comments are parsed for all parameters, then assigned
+    one column at a time"""
 
     df_p = df_parameters.copy(deep=True)
     df_p['full_comment'] = ''
+    if len(df_p.index) == 0:
+        return df_p
+    
+    commentIndex = CommentIndex(lines)
 
-    commentStart = 0
-    for i, row in df_p.iterrows():   
-        # Grab and parse comment lines
-        commentEnd = int(row['line_number'])
-        commentLines = lines[min(commentStart, commentEnd - 2):commentEnd]
-        commentDict = parse_parameter_comments(commentLines)
-        
-        # Add to dict (but don't overwrite previously found value)
-        for key, value in commentDict.items():
-            if key in df_p.columns:
-                currentValue = df_p.iat[i, df_p.columns.get_loc(key)]
-                if not currentValue:
-                    df_p.iat[i, df_p.columns.get_loc(key)] = value
-
-        commentStart = commentEnd
+    # Get line of the previous parameter, in line order (stable, so parameters on one line keep their order)
+    commentEnds = df_p['line_number'].to_numpy().astype(int)
+    order = np.argsort(commentEnds, kind='stable')
+    prevEnds = np.zeros_like(commentEnds)
+    prevEnds[order[1:]] = commentEnds[order[:-1]]
+    commentStarts = np.minimum(prevEnds, commentEnds - 2)
+    
+    # Grab and parse comment lines
+    commentDicts = [commentIndex.parse_parameter_comments(start, end)
+                    for start, end in zip(commentStarts.tolist(), commentEnds.tolist())]
+    
+    # Add to columns (but don't overwrite previously found value)
+    for key in df_p.columns:
+        if not any(key in commentDict for commentDict in commentDicts):
+            continue
+        values = df_p[key].to_numpy(copy=True)
+        for i, commentDict in enumerate(commentDicts):
+            if key in commentDict and not values[i]:
+                values[i] = commentDict[key]
+        df_p[key] = values
 
     return df_p
 
 
 def remove_duplicate_comments_in_parameters(df_o, df_parameters):
     """Remove description and/or full comment for a parameter if it is 
-    the same as its parent object's description"""
+    the same as its parent object's description
+    
+    Each parameter is joined to its parent object (the first object with the same
+    object_name and contract) once, and the comments of all parameters compared at once"""
     
     df_p = df_parameters.copy(deep=True)
+    if len(df_p.index) == 0:
+        return df_p
     
-    for i, row in df_parameters.iterrows():
-        # Get parent object's comments
-        index = df_o.loc[(df_o['object_name']==row['object_name']) &
-                         (df_o['contract']==row['contract'])].index[0]
-        object_fullComment = df_o.iat[index, df_o.columns.get_loc('full_comment')]
-        object_description = df_o.iat[index, df_o.columns.get_loc('description')]
-        
-        # Delete parameter's comment(s) if duplicate of parent object's (i.e., not parameter-specific)
-        if (row['full_comment'] == object_fullComment) or ('@param' in object_fullComment):
-            df_p.iat[i, df_p.columns.get_loc('full_comment')] = ''
-        if row['description'] == object_description:
-            df_p.iat[i, df_p.columns.get_loc('description')] = ''
+    # Get parent objects' comments
+    df_parents = df_o.drop_duplicates(subset=['object_name', 'contract'])[['object_name', 'contract', 'full_comment', 'description']]
+    df_joined = df_p[['object_name', 'contract']].merge(df_parents, how='left', on=['object_name', 'contract'])
+    if df_joined['full_comment'].isna().any():
+        raise IndexError("parameter has no parent object")
+    object_fullComments = df_joined['full_comment'].to_numpy()
+    object_descriptions = df_joined['description'].to_numpy()
+    
+    # Delete parameters' comment(s) if duplicate of parent object's (i.e., not parameter-specific)
+    fullComments = df_p['full_comment'].to_numpy(copy=True)
+    isDuplicate = (fullComments == object_fullComments) | np.array(['@param' in c for c in object_fullComments], dtype=bool)
+    fullComments[isDuplicate] = ''
+    df_p['full_comment'] = fullComments
+    
+    descriptions = df_p['description'].to_numpy(copy=True)
+    descriptions[descriptions == object_descriptions] = ''
+    df_p['description'] = descriptions
         
     return df_p
+
+
+def attach_comments(lines, objectRecords, parameterRecords, objectSpans, parameterSpans):
+    """Parse comments and add them to object and parameter records in place
+    
+    Records are dicts as returned by ContractObject.to_dict() and ContractParameter.to_dict(),
+    and spans are the (start, end) slices of 'lines' holding the comments for each, as
+    recorded by contractmodel.ContractVisitor. 
+    
+    Gives the same result as add_docstring_comments, add_inline_comments, and
+    remove_duplicate_comments_in_parameters applied in turn to the corresponding DataFrames,
+    but related objects/parameters are looked up by key instead of by filtering DataFrames
+    """
+    
+    commentIndex = CommentIndex(lines)
+    
+    # Index parameters by (contract, object name, parameter name), and first object with each (object name, contract)
+    paramIndex = index_parameters([p['contract'] for p in parameterRecords], [p['object_name'] for p in parameterRecords],
+                                  [p['parameter_name'] for p in parameterRecords], 
+                                  [p['line_number'] for p in parameterRecords])
+    objectIndex = {}
+    for i, o in enumerate(objectRecords):
+        objectIndex.setdefault((o['object_name'], o['contract']), i)
+    
+    # Add object descriptions to objects, and @param descriptions to parameters
+    for o in objectRecords:
+        o['description'] = ''
+        for tag in NATSPEC_TAGS:
+            o[tag] = ''
+        o['full_comment'] = ''
+    
+    for o, (commentStart, commentEnd) in zip(objectRecords, objectSpans):
+        commentDict = commentIndex.parse_object_comments(commentStart, commentEnd)
+        for key, value in commentDict.items():
+            if key in o:
+                if key == 'param':
+                    value = list(value.keys())
+                o[key] = value
+        for paramName, paramDescription in commentDict.get('param', {}).items():
+            try:
+                position = find_parameter(paramIndex, o['contract'], o['object_name'], paramName, o['line_numbers'])
+            except KeyError:
+                continue
+            parameterRecords[position]['description'] = paramDescription
+    
+    # Add inline/preceding comments to parameters (but don't overwrite previously found value)
+    for p in parameterRecords:
+        p['full_comment'] = ''
+    
+    for p, (commentStart, commentEnd) in zip(parameterRecords, parameterSpans):
+        commentDict = commentIndex.parse_parameter_comments(commentStart, commentEnd)
+        for key, value in commentDict.items():
+            if key in p and not p[key]:
+                p[key] = value
+    
+    # Remove parameter comments that duplicate their parent object's
+    for p in parameterRecords:
+        o = objectRecords[objectIndex[(p['object_name'], p['contract'])]]
+        if (p['full_comment'] == o['full_comment']) or ('@param' in o['full_comment']):
+            p['full_comment'] = ''
+        if p['description'] == o['description']:
+            p['description'] = ''
+    
+    return objectRecords, parameterRecords
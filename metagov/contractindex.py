@@ -0,0 +1,336 @@
+import os
+import re
+import ast
+import glob
+import pickle
+import bisect
+import pandas as pd
+
+CWD = os.path.join(os.path.dirname(__file__))
+if CWD.rstrip('/').endswith('metagov'):
+    CWD = CWD.rstrip('/').rsplit('/', 1)[0]
+TMPDIR = os.path.join(CWD, 'tmp')
+
+INDEX_FILE = os.path.join(TMPDIR, 'contract_index.pkl')
+KINDS = ['objects', 'parameters']
+LIST_COLUMNS = ['inheritance', 'modifiers', 'values', 'coding_keyword_search', 'coding_topic_search']
+
+PATTERN_NAME_TOKEN = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+PATTERN_QUERY_TOKEN = re.compile(r'\(|\)|[A-Za-z_]+:\(|[^\s()]+')
+
+
+# =============================================================================
+# Terms of each object/parameter
+# =============================================================================
+def split_name(name):
+    """Return lowercase camelCase/snake_case tokens of an identifier
+
+    E.g., '_setProposalThreshold' --> ['set', 'proposal', 'threshold'], 'ERC20Votes' --> ['erc', '20', 'votes']
+    """
+
+    return [t.lower() for t in PATTERN_NAME_TOKEN.findall(str(name))]
+
+
+def _load_list(s):
+    """Return list from its string representation in a saved CSV (or [] if there is none)"""
+
+    if isinstance(s, list):
+        return s
+    try:
+        l = ast.literal_eval(s)
+    except (ValueError, SyntaxError):
+        return []
+    return l if isinstance(l, list) else []
+
+
+def get_object_terms(obj, project):
+    """Return set of 'field:value' terms for an object (a row of the objects DataFrame)
+
+    Fields: name (tokens of object_name), contract (tokens of contract), type (e.g., 'function'
+    for FunctionDefinition), keyword/topic (coding_keyword_search/coding_topic_search),
+    modifier, visibility, project
+    """
+
+    terms = {f"name:{t}" for t in split_name(obj['object_name'])}
+    terms.update(f"contract:{t}" for t in split_name(obj['contract']))
+    terms.add(f"type:{str(obj['type']).replace('Definition', '').lower()}")
+    terms.update(f"keyword:{k}" for k in obj['coding_keyword_search'])
+    terms.update(f"topic:{t}" for t in obj['coding_topic_search'] if t)
+    terms.update(f"modifier:{m.lower()}" for m in obj['modifiers'])
+    if obj['visibility']:
+        terms.add(f"visibility:{obj['visibility']}")
+    terms.add(f"project:{str(project).lower()}")
+
+    return terms
+
+
+def get_parameter_terms(param, project):
+    """Return set of 'field:value' terms for a parameter (a row of the parameters DataFrame)
+
+    Fields: name (tokens of parameter_name), contract (tokens of contract), type (e.g., 'uint256'),
+    typecat (type_category, e.g., 'uint'), visibility, project
+    """
+
+    terms = {f"name:{t}" for t in split_name(param['parameter_name'])}
+    terms.update(f"contract:{t}" for t in split_name(param['contract']))
+    terms.add(f"type:{str(param['type']).replace(' ', '').lower()}")
+    terms.add(f"typecat:{str(param['type_category']).lower()}")
+    if param['visibility']:
+        terms.add(f"visibility:{param['visibility']}")
+    terms.add(f"project:{str(project).lower()}")
+
+    return terms
+
+
+# =============================================================================
+# Inverted index over parsed contracts
+# =============================================================================
+class ContractIndex():
+    """Inverted index from terms (see get_object_terms/get_parameter_terms) to the objects
+    and parameters of parsed projects, for boolean queries across the whole corpus
+
+    Projects are added from the DataFrames written by parse_repo (or the CSV files they were
+    saved to), and can be removed/replaced one at a time; update() re-indexes only the
+    projects whose output files have changed since they were indexed.
+
+    Query syntax (see query):
+      - field:value, e.g. name:delegate, keyword:voting, type:function, typecat:uint,
+        modifier:onlyowner; a trailing * matches any value with that prefix (name:deleg*)
+      - AND (or just a space), OR, NOT, and parentheses
+      - for objects, param:(...) matches objects with any parameter matching the query inside
+
+    E.g., objects defining a vote-delegation function with a uint threshold parameter:
+      type:function AND name:delegate* AND keyword:voting AND param:(name:threshold AND typecat:uint)
+    """
+
+    def __init__(self):
+        self.frames = {}      # label: {'objects': df, 'parameters': df}
+        self.docs = {}        # kind: {docId: (label, row position)}
+        self.postings = {}    # kind: {term: set(docIds)}
+        self.projectDocs = {} # label: {kind: set(docIds)}
+        self.projectTerms = {}# label: {kind: set(terms)}
+        self.parents = {}     # parameter docId: set(object docIds)
+        self.sources = {}     # label: file stats when indexed from file
+        self.nextId = 0
+        for kind in KINDS:
+            self.docs[kind] = {}
+            self.postings[kind] = {}
+        self._sortedTerms = {}
+
+    def add_project(self, label, df_objects, df_parameters):
+        """Index the objects and parameters of a project (replacing any previous version of it)"""
+
+        if label in self.frames:
+            self.remove_project(label)
+
+        df_objects = df_objects.reset_index(drop=True)
+        df_parameters = df_parameters.reset_index(drop=True)
+        for col in LIST_COLUMNS:
+            if col in df_objects.columns:
+                df_objects[col] = df_objects[col].apply(_load_list)
+        df_objects = df_objects.fillna('')
+        df_parameters = df_parameters.fillna('')
+
+        self.frames[label] = {'objects': df_objects, 'parameters': df_parameters}
+        self.projectDocs[label] = {kind: set() for kind in KINDS}
+        self.projectTerms[label] = {kind: set() for kind in KINDS}
+
+        # Objects, and which objects each parameter may belong to (overloads share a name)
+        objectKeys = {}
+        for i, obj in enumerate(df_objects.to_dict('records')):
+            docId = self._add_doc('objects', label, i, get_object_terms(obj, label))
+            objectKeys.setdefault((obj.get('url', ''), obj['contract'], obj['object_name']), set()).add(docId)
+
+        for i, param in enumerate(df_parameters.to_dict('records')):
+            docId = self._add_doc('parameters', label, i, get_parameter_terms(param, label))
+            self.parents[docId] = objectKeys.get((param.get('url', ''), param['contract'], param['object_name']), set())
+
+        self._sortedTerms = {}
+
+    def _add_doc(self, kind, label, row, terms):
+        docId = self.nextId
+        self.nextId += 1
+        self.docs[kind][docId] = (label, row)
+        self.projectDocs[label][kind].add(docId)
+        self.projectTerms[label][kind].update(terms)
+        postings = self.postings[kind]
+        for term in terms:
+            postings.setdefault(term, set()).add(docId)
+
+        return docId
+
+    def remove_project(self, label):
+        """Remove a project from the index"""
+
+        for kind in KINDS:
+            docIds = self.projectDocs[label][kind]
+            postings = self.postings[kind]
+            for term in self.projectTerms[label][kind]:
+                postings[term] -= docIds
+                if not postings[term]:
+                    del postings[term]
+            for docId in docIds:
+                del self.docs[kind][docId]
+                self.parents.pop(docId, None)
+
+        del self.frames[label]
+        del self.projectDocs[label]
+        del self.projectTerms[label]
+        self.sources.pop(label, None)
+        self._sortedTerms = {}
+
+    def add_project_files(self, label, objectsFile, parametersFile):
+        """Index a project from the CSV files saved by parse_repo"""
+
+        df_objects = pd.read_csv(objectsFile, index_col=0, keep_default_na=False)
+        df_parameters = pd.read_csv(parametersFile, index_col=0, keep_default_na=False)
+        self.add_project(label, df_objects, df_parameters)
+        self.sources[label] = _get_file_stats(objectsFile, parametersFile)
+
+    def update(self, tmpDir=TMPDIR):
+        """Bring the index up to date with the contract_objects/parameters_{label}.csv files in
+        tmpDir: (re-)index projects that are new or have changed, and remove projects whose
+        files are gone. Returns (list of labels that were (re-)indexed, list of labels removed)"""
+
+        updated = []
+        removed = []
+        found = set()
+        for objectsFile in sorted(glob.glob(os.path.join(tmpDir, 'contract_objects_*.csv'))):
+            label = os.path.basename(objectsFile)[len('contract_objects_'):-len('.csv')]
+            parametersFile = os.path.join(tmpDir, f'contract_parameters_{label}.csv')
+            if not os.path.isfile(parametersFile):
+                continue
+            found.add(label)
+            if self.sources.get(label) != _get_file_stats(objectsFile, parametersFile):
+                self.add_project_files(label, objectsFile, parametersFile)
+                updated.append(label)
+
+        for label in list(self.sources.keys()):
+            if label not in found:
+                self.remove_project(label)
+                removed.append(label)
+
+        return updated, removed
+
+    def get_terms(self, kind='objects', prefix=''):
+        """Return sorted list of indexed terms (optionally, only those starting with prefix)"""
+
+        if kind not in self._sortedTerms:
+            self._sortedTerms[kind] = sorted(self.postings[kind].keys())
+        terms = self._sortedTerms[kind]
+        start = bisect.bisect_left(terms, prefix)
+        end = bisect.bisect_left(terms, prefix + '\uffff') if prefix else len(terms)
+
+        return terms[start:end]
+
+    # -------------------------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------------------------
+    def search(self, expression, kind='objects'):
+        """Return set of docIds of the given kind matching a query (see class docstring)"""
+
+        assert kind in KINDS, f"kind must be one of {KINDS}"
+        tokens = PATTERN_QUERY_TOKEN.findall(expression)
+        docIds, position = self._parse_or(tokens, 0, kind)
+        if position != len(tokens):
+            raise ValueError(f"Unexpected '{tokens[position]}' in query: {expression}")
+
+        return docIds
+
+    def query(self, expression, kind='objects'):
+        """Return DataFrame of the objects/parameters matching a query (see class docstring)"""
+
+        return self.to_frame(self.search(expression, kind=kind), kind=kind)
+
+    def to_frame(self, docIds, kind='objects'):
+        """Return DataFrame of the rows of the given docIds, in indexing order"""
+
+        rows = {}
+        for docId in sorted(docIds):
+            label, row = self.docs[kind][docId]
+            rows.setdefault(label, []).append(row)
+        if len(rows) == 0:
+            return pd.DataFrame()
+
+        frames = [self.frames[label][kind].iloc[r].assign(project=label) for label, r in rows.items()]
+        return pd.concat(frames, ignore_index=True)
+
+    def _parse_or(self, tokens, position, kind):
+        result, position = self._parse_and(tokens, position, kind)
+        while position < len(tokens) and tokens[position] == 'OR':
+            other, position = self._parse_and(tokens, position + 1, kind)
+            result = result | other
+
+        return result, position
+
+    def _parse_and(self, tokens, position, kind):
+        result, position = self._parse_not(tokens, position, kind)
+        while position < len(tokens) and tokens[position] not in ('OR', ')'):
+            if tokens[position] == 'AND':
+                position += 1
+            other, position = self._parse_not(tokens, position, kind)
+            result = result & other
+
+        return result, position
+
+    def _parse_not(self, tokens, position, kind):
+        if position < len(tokens) and tokens[position] == 'NOT':
+            result, position = self._parse_not(tokens, position + 1, kind)
+            return set(self.docs[kind].keys()) - result, position
+
+        return self._parse_atom(tokens, position, kind)
+
+    def _parse_atom(self, tokens, position, kind):
+        if position >= len(tokens):
+            raise ValueError("Unexpected end of query")
+        token = tokens[position]
+
+        if token == '(' or token.endswith(':('):
+            subKind = kind
+            if token != '(':
+                assert token == 'param:(' and kind == 'objects', f"Unknown subquery '{token}'"
+                subKind = 'parameters'
+            result, position = self._parse_or(tokens, position + 1, subKind)
+            if position >= len(tokens) or tokens[position] != ')':
+                raise ValueError("Missing ')' in query")
+            if subKind != kind:
+                # Objects with any matching parameter
+                result = set().union(*[self.parents[docId] for docId in result])
+            return result, position + 1
+
+        if ':' not in token:
+            raise ValueError(f"Expected field:value in query, got '{token}'")
+        field, value = token.split(':', 1)
+        term = f"{field.lower()}:{value.lower()}"
+        postings = self.postings[kind]
+        if term.endswith('*'):
+            result = set().union(*[postings[t] for t in self.get_terms(kind, prefix=term[:-1])])
+        else:
+            result = set(postings.get(term, set()))
+
+        return result, position + 1
+
+    # -------------------------------------------------------------------------
+    # Saving/loading
+    # -------------------------------------------------------------------------
+    def save(self, path=INDEX_FILE):
+        tmpPath = f"{path}.{os.getpid()}.tmp"
+        with open(tmpPath, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, path)
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        """Return index saved to path, or a new (empty) index if there is none"""
+
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+            return cls()
+
+
+def _get_file_stats(*paths):
+    """Return (modification time, size) of each file, for noticing when they are rewritten"""
+
+    return tuple((os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in paths)
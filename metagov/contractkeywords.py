@@ -1,3 +1,8 @@
+import os
+import copy
+import pickle
+import threading
+from collections import OrderedDict
 import pandas as pd
 
 # =============================================================================
@@ -20,6 +25,315 @@ CODING = {
 }
 
 
+# =============================================================================
+# Matcher compiled from CODING
+# =============================================================================
+def _unique_terms(terms):
+    """Return tuple of distinct non-empty terms, in order (the empty term is found in any string)"""
+    
+    return tuple(dict.fromkeys(t for t in terms if t))
+
+
+def in_coding_order(found, order):
+    """Return the distinct items of 'found' in the order they have in 'order' (the coding keys,
+    or the topics of a category), so that coding results do not depend on set order (which
+    differs between processes); any not in 'order' follow, sorted"""
+    
+    found = set(found)
+    ordered = [x for x in dict.fromkeys(order) if x in found]
+    
+    return ordered + sorted(found.difference(ordered))
+
+
+def _index_terms(coding, field, lower=False):
+    """Return dict of term: list of coding keys that have the term in coding[key][field]"""
+    
+    termIndex = {}
+    for c, v in coding.items():
+        for t in v[field]:
+            t = t.lower() if lower else t
+            if c not in termIndex.setdefault(t, []):
+                termIndex[t].append(c)
+    
+    return termIndex
+
+
+class CodingMatcher():
+    """Keyword and topic matcher for a coding scheme like CODING, compiled once
+    
+    Holds the distinct terms (keywords and topics) of all categories, as given and 
+    lowercased, and which categories each belongs to. A string is lowercased once and
+    each term tested once, however many categories it appears in, and the keywords and
+    topics found are read off the terms found. Gives the same results as testing the 
+    terms of each category in turn, including repeated categories/topics and the empty topic.
+    """
+    
+    def __init__(self, coding):
+        self.coding = {c: {'keywords': list(v['keywords']), 'topics': list(v['topics'])} for c, v in coding.items()}
+        self.snapshot = copy.deepcopy(coding) # For noticing when coding has been changed
+        
+        # Categories of each term
+        self.keywordIndex = _index_terms(self.coding, 'keywords')
+        self.keywordIndexLower = _index_terms(self.coding, 'keywords', lower=True)
+        self.topicIndex = _index_terms(self.coding, 'topics')
+        self.topicIndexLower = _index_terms(self.coding, 'topics', lower=True)
+        self.topicsLower = {c: [t.lower() for t in v['topics']] for c, v in self.coding.items()}
+        
+        # Terms to look for: keywords only, keywords and topics, or the topics of one category
+        self.terms = {'keywords': (_unique_terms(self.keywordIndex), _unique_terms(self.keywordIndexLower)),
+                      'all': (_unique_terms(list(self.keywordIndex) + list(self.topicIndex)),
+                              _unique_terms(list(self.keywordIndexLower) + list(self.topicIndexLower)))}
+        for c, v in self.coding.items():
+            self.terms[('topics', c)] = (_unique_terms(v['topics']), _unique_terms(self.topicsLower[c]))
+    
+    def scan(self, s, camelCase=False, terms='all'):
+        """Return terms found in s, as (set of contained terms, set of lowercase prefix terms)
+        
+        camelCase: terms contained in s (case-sensitive), and that s starts with (ignoring
+        leading underscores and case); otherwise: terms contained in s (ignoring case).
+        Looks for all terms, only 'keywords', or only the topics of one category (('topics', kw))
+        """
+        
+        termsAsGiven, termsLower = self.terms[terms]
+        if camelCase:
+            contained = {t for t in termsAsGiven if t in s}
+            sLower = s.strip('_').lower()
+            prefixed = {t for t in termsLower if sLower.startswith(t)}
+            prefixed.add('')
+        else:
+            sLower = s.lower()
+            contained = {t for t in termsLower if t in sLower}
+            prefixed = None
+        contained.add('')
+        
+        return contained, prefixed
+    
+    def _get_categories(self, found, termIndex):
+        """Return list of coding keys with any of the found terms, in coding order"""
+        
+        categories = set()
+        for t in found:
+            categories.update(termIndex.get(t, []))
+        
+        return [c for c in self.coding.keys() if c in categories]
+    
+    def find_keywords(self, found, camelCase=False):
+        """Return list of coding keys given terms found by scan (see find_keywords_in_str)"""
+        
+        contained, prefixed = found
+        if camelCase:
+            kw = self._get_categories(contained, self.keywordIndex) + self._get_categories(prefixed, self.keywordIndexLower)
+        else:
+            kw = self._get_categories(contained, self.keywordIndexLower)
+        
+        return kw
+    
+    def find_topics(self, found, kw, camelCase=False):
+        """Return list of topics under the keyword 'kw' given terms found by scan (see find_topics_in_str)"""
+        
+        contained, prefixed = found
+        topics = self.coding[kw]['topics']
+        if camelCase:
+            return ([t for t in topics if t in contained] + 
+                    [t for t, tLower in zip(topics, self.topicsLower[kw]) if tLower in prefixed])
+        else:
+            return [t for t, tLower in zip(topics, self.topicsLower[kw]) if tLower in contained]
+    
+    def match(self, s, camelCase=False):
+        """Return (list of coding keys, dict of coding key: list of topics) for string s,
+        for all coding keys at once (see find_keywords_in_str and find_topics_in_str)"""
+        
+        topics = {c: [] for c in self.coding.keys()}
+        if not s:
+            return [], topics
+        
+        found = self.scan(s, camelCase=camelCase)
+        if camelCase:
+            topicCategories = (self._get_categories(found[0], self.topicIndex) + 
+                               self._get_categories(found[1], self.topicIndexLower))
+        else:
+            topicCategories = self._get_categories(found[0], self.topicIndexLower)
+        for c in topicCategories:
+            topics[c] = self.find_topics(found, c, camelCase=camelCase)
+        
+        return self.find_keywords(found, camelCase=camelCase), topics
+
+
+_matcher = None
+
+
+def get_coding_matcher():
+    """Return CodingMatcher for CODING, compiling it again if CODING has changed since"""
+    
+    global _matcher
+    if _matcher is None or _matcher.snapshot != CODING:
+        _matcher = CodingMatcher(CODING)
+    
+    return _matcher
+
+
+# =============================================================================
+# Cache of coded strings, shared between files/projects
+# =============================================================================
+CODING_CACHE_SIZE = 100000 # Strings kept before least-recently-used entries are dropped
+
+
+class CodingCache():
+    """Bounded LRU cache of CodingMatcher.match results, keyed by (string, camelCase)
+    
+    The same names (propose, castVote, quorumVotes, ...) turn up in most governance 
+    contracts, so a cache shared by a batch run codes each of them once. Entries are
+    dropped whenever the matcher's coding changes, and hits/misses are counted.
+    Cached results are shared, so should not be modified. Safe to use from several threads.
+    
+    Can be saved to and loaded from file (entries are only loaded back if CODING
+    is unchanged since they were saved), and pickled to be sent to worker processes,
+    which track what they add (see take_updates) so that it can be merged back.
+    """
+    
+    def __init__(self, maxSize=CODING_CACHE_SIZE):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.snapshot = None
+        self.matcher = None
+        self.hits = 0
+        self.misses = 0
+        self.updates = None
+        self._lock = threading.Lock()
+    
+    def __getstate__(self):
+        with self._lock:
+            state = {'maxSize': self.maxSize, 'entries': OrderedDict(self.entries), 'snapshot': self.snapshot}
+        return state
+    
+    def __setstate__(self, state):
+        self.__init__(maxSize=state['maxSize'])
+        self.entries = state['entries']
+        self.snapshot = state['snapshot']
+    
+    def match(self, matcher, s, camelCase=False):
+        """Return matcher.match(s, camelCase), using the cache if possible"""
+        
+        with self._lock:
+            if matcher is not self.matcher:
+                if matcher.snapshot != self.snapshot:
+                    self.entries.clear()
+                    self.snapshot = matcher.snapshot
+                self.matcher = matcher
+            
+            key = (s, camelCase)
+            try:
+                result = self.entries[key]
+                self.entries.move_to_end(key)
+                self.hits += 1
+                if self.updates is not None:
+                    self.updates['hits'] += 1
+            except KeyError:
+                result = matcher.match(s, camelCase=camelCase)
+                self._add(key, result)
+                self.misses += 1
+                if self.updates is not None:
+                    self.updates['misses'] += 1
+                    self.updates['entries'].append((key, result))
+        
+        return result
+    
+    def _add(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+    
+    def track_updates(self):
+        """Start recording entries added and hits/misses counted, for take_updates"""
+        
+        with self._lock:
+            self.updates = {'entries': [], 'hits': 0, 'misses': 0}
+    
+    def take_updates(self):
+        """Return (and reset) entries added and hits/misses counted since the last call,
+        or None if not tracking updates (see track_updates)"""
+        
+        with self._lock:
+            updates = self.updates
+            if updates is not None:
+                updates['coding'] = self.snapshot
+                self.updates = {'entries': [], 'hits': 0, 'misses': 0}
+        
+        return updates
+    
+    def merge(self, updates):
+        """Add entries and hits/misses from another cache's take_updates (e.g., in a worker process)
+        
+        Entries are only added if they were found with the same coding as this cache's"""
+        
+        if updates is None:
+            return
+        with self._lock:
+            self.hits += updates['hits']
+            self.misses += updates['misses']
+            if self.snapshot is None and len(self.entries) == 0:
+                self.snapshot = updates['coding']
+            if updates['coding'] == self.snapshot:
+                for key, result in updates['entries']:
+                    self._add(key, result)
+    
+    def get_stats(self):
+        """Return dict of hits, misses, hit rate, and number of entries"""
+        
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 
+                'misses': self.misses, 
+                'hit_rate': self.hits / lookups if lookups else 0.0, 
+                'size': len(self.entries)}
+    
+    def save(self, path):
+        """Save entries (and the coding they were found with) to file"""
+        
+        tmpPath = f"{path}.{os.getpid()}.tmp"
+        with self._lock:
+            saved = {'coding': self.snapshot, 'entries': list(self.entries.items())}
+        with open(tmpPath, 'wb') as f:
+            pickle.dump(saved, f)
+        os.replace(tmpPath, path)
+    
+    @classmethod
+    def load(cls, path, maxSize=CODING_CACHE_SIZE):
+        """Return cache with entries loaded from file, if it exists and CODING has not changed since"""
+        
+        cache = cls(maxSize=maxSize)
+        try:
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+            return cache
+        
+        if saved.get('coding') == CODING:
+            cache.snapshot = saved['coding']
+            cache.entries.update(saved['entries'][-maxSize:])
+        
+        return cache
+
+
+_codingCache = CodingCache()
+
+
+def get_coding_cache():
+    """Return the CodingCache shared by default (e.g., by all files parsed in this process)"""
+    
+    return _codingCache
+
+
+def set_coding_cache(cache):
+    """Replace the CodingCache shared by default (e.g., with one loaded from file)"""
+    
+    global _codingCache
+    _codingCache = cache
+
+
+# =============================================================================
+# Keyword/topic search
+# =============================================================================
 def find_keywords_in_str(s, camelCase=False):
     """Return list of coding keys in string s
     
@@ -27,11 +341,8 @@ def find_keywords_in_str(s, camelCase=False):
     """
     
     if s:
-        if camelCase:
-            kw = [c for c in CODING.keys() if any([(k in s) for k in CODING[c]['keywords']])]
-            kw = kw + [c for c in CODING.keys() if any([(s.strip('_').lower().startswith(k.lower())) for k in CODING[c]['keywords']])]
-        else:
-            kw = [c for c in CODING.keys() if any([(k.lower() in s.lower()) for k in CODING[c]['keywords']])]
+        matcher = get_coding_matcher()
+        kw = matcher.find_keywords(matcher.scan(s, camelCase=camelCase, terms='keywords'), camelCase=camelCase)
     else:
         kw = []
 
@@ -45,11 +356,8 @@ def find_topics_in_str(s, kw, camelCase=False):
     """
     
     if s:
-        if camelCase:
-            topics = [t for t in CODING[kw]['topics'] if (t in s)]
-            topics = topics + [t for t in CODING[kw]['topics'] if (s.strip('_').lower().startswith(t.lower()))]
-        else:
-            topics = [t for t in CODING[kw]['topics'] if (t.lower() in s.lower())]
+        matcher = get_coding_matcher()
+        topics = matcher.find_topics(matcher.scan(s, camelCase=camelCase, terms=('topics', kw)), kw, camelCase=camelCase)
     else:
         topics = []
 
@@ -71,7 +379,7 @@ def find_keywords_in_obj(obj, df_params):
     except KeyError as e:
         pass # TODO: Works okay (skips over case of no params) but there is something funny here... revisit
     
-    return list(set(kw_name + kw_description + kw_params))
+    return in_coding_order(kw_name + kw_description + kw_params, CODING.keys())
 
 
 def find_topics_in_obj(obj, df_params):
@@ -92,6 +400,80 @@ def find_topics_in_obj(obj, df_params):
         except KeyError:
             pass
 
-        topics = topics + list(set(t_name + t_description + t_params))  
+        topics = topics + in_coding_order(t_name + t_description + t_params, CODING[kw]['topics'])
+    
+    return topics
+
+# =============================================================================
+# Batch coding of many objects
+# =============================================================================
+def code_objects(df_objects, df_params, groupColumns=None, matcher=None, cache=None):
+    """Return coding keywords and topics of all objects at once
+    
+    Gives the same results as applying find_keywords_in_obj and then find_topics_in_obj
+    to each object, but parameters are grouped by parent object once, and each distinct
+    name/description is coded once (using CodingMatcher.match, through the shared 
+    CodingCache unless another cache is given) however often it appears.
+    
+    Parameters belong to the objects with the same values in groupColumns (by default,
+    just 'object_name', as in find_keywords_in_obj); for a corpus of many files or 
+    projects, e.g. ['url', 'object_name'] keeps objects in different files apart.
+    
+    Returns (keywords, topics): lists with an entry per object, for the 
+    'coding_keyword_search' and 'coding_topic_search' columns (keywords in coding order,
+    and topics in the order of their category's topics; see in_coding_order)
+    """
+    
+    if groupColumns is None:
+        groupColumns = ['object_name']
+    if matcher is None:
+        matcher = get_coding_matcher()
+    if cache is None:
+        cache = get_coding_cache()
+    
+    def code(s, camelCase):
+        return cache.match(matcher, s, camelCase=camelCase)
+    
+    # Group parameters by parent object (skipping them altogether if there are none)
+    paramGroups = {}
+    if all(c in df_params.columns for c in groupColumns + ['parameter_name', 'description']):
+        keys = zip(*[df_params[c] for c in groupColumns])
+        for key, paramName, paramDescription in zip(keys, df_params['parameter_name'], df_params['description']):
+            paramGroups.setdefault(key, []).append((paramName, paramDescription))
+    
+    # Code each group of parameters, keeping each keyword/topic found once
+    groupCodes = {}
+    def code_group(key):
+        if key not in groupCodes:
+            kw = {}
+            topics = {c: {} for c in matcher.coding.keys()}
+            for paramName, paramDescription in paramGroups.get(key, []):
+                for s, camelCase in [(paramName, True), (paramDescription, False)]:
+                    k, t = code(s, camelCase)
+                    kw.update(dict.fromkeys(k))
+                    for c in t.keys():
+                        topics[c].update(dict.fromkeys(t[c]))
+            groupCodes[key] = (list(kw), {c: list(t) for c, t in topics.items()})
+        return groupCodes[key]
+    
+    keywords = []
+    topics = []
+    if len(df_objects.index) == 0:
+        return keywords, topics
+    
+    keys = zip(*[df_objects[c] for c in groupColumns])
+    for key, objectName, objectDescription in zip(keys, df_objects['object_name'], df_objects['description']):
+        kw_name, t_name = code(objectName, True)
+        kw_description, t_description = code(objectDescription, False)
+        kw_params, t_params = code_group(key)
+        
+        objectKeywords = in_coding_order(kw_name + kw_description + kw_params, matcher.coding.keys())
+        objectTopics = []
+        for kw in objectKeywords:
+            objectTopics = objectTopics + in_coding_order(t_name[kw] + t_description[kw] + t_params[kw],
+                                                          matcher.coding[kw]['topics'])
+        
+        keywords.append(objectKeywords)
+        topics.append(objectTopics)
     
-    return topics
\ No newline at end of file
+    return keywords, topics
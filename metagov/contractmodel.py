@@ -1,5 +1,6 @@
 import os
 import re
+import sys
 import requests
 import pprint
 import validators
@@ -9,8 +10,9 @@ from dataclasses import dataclass, field
 from typing import Any
 from solidity_parser import parser
 
-from metagov.contractcomments import add_docstring_comments, add_inline_comments, remove_duplicate_comments_in_parameters
-from metagov.contractkeywords import find_keywords_in_obj, find_topics_in_obj
+from metagov.contractcomments import attach_comments, NATSPEC_TAGS
+from metagov.contractkeywords import code_objects, get_coding_cache
+from metagov.parseprofile import profile_stage, count_ast_nodes
 
 ERRORMSG = 'error: could not parse'
 IGNORE_CONTRACTS = ['SafeMath']
@@ -44,6 +46,12 @@ class ContractObject():
     def from_ast_node(cls, ast_node, contractName):
         """Use node of AST tree and the name of the contract"""
         
+        return cls(**cls.get_ast_node_vars(ast_node, contractName))
+    
+    @classmethod
+    def get_ast_node_vars(cls, ast_node, contractName):
+        """Get initialization arguments from node of AST tree and the name of the contract"""
+        
         vars = {}
 
         vars['contract'] = contractName
@@ -64,7 +72,7 @@ class ContractObject():
             
         vars['lineNumbers'] = (ast_node['loc']['start']['line'], ast_node['loc']['end']['line'])
 
-        return cls(**vars)
+        return vars
     
     @classmethod
     def get_object_modifiers(cls, ast_node):
@@ -90,8 +98,8 @@ class ContractObject():
     def add_parameter(self, paramObj):
         self.parameters.append(paramObj)
 
-    def to_row(self):
-        """Return variables as pd.Series"""
+    def to_dict(self):
+        """Return variables as a dict (one record of the objects DataFrame)"""
         
         objDict = {'object_name': self.objectName, 
                    'contract': self.contract, 
@@ -103,7 +111,12 @@ class ContractObject():
                    'line_numbers': self.lineNumbers, 
                    'description': self.description
                   }
-        return pd.Series(objDict).to_frame().T
+        return objDict
+
+    def to_row(self):
+        """Return variables as pd.Series"""
+        
+        return pd.Series(self.to_dict()).to_frame().T
 
     def __str__(self):
         return f"{self.objectType} {self.objectName} ({self.contract})"
@@ -130,6 +143,12 @@ class ContractParameter():
     def from_ast_node(cls, ast_node, parentObject):
         """Initialize parameter given portion of AST tree"""
         
+        return cls(**cls.get_ast_node_vars(ast_node, parentObject))
+    
+    @classmethod
+    def get_ast_node_vars(cls, ast_node, parentObject):
+        """Get initialization arguments from portion of AST tree"""
+        
         vars = {}
 
         vars['parameterName'] = ast_node['name']
@@ -142,7 +161,7 @@ class ContractParameter():
         vars['typeCategory'] = cls.get_parameter_type_category(ast_node)
         vars['initialValue'] = cls.get_parameter_initialValue(ast_node)
         
-        return cls(**vars)
+        return vars
     
     @classmethod
     def get_parameter_type(cls, param):
@@ -207,9 +226,127 @@ class ContractParameter():
 
         return paramCategory
 
+    def to_dict(self):
+        """Return variables as a dict (one record of the parameters DataFrame)"""
+        
+        paramDict = {'parameter_name': self.parameterName, 
+                     'object_name': self.parentObject.objectName, 
+                     'contract': self.parentObject.contract, 
+                     'type': self.parameterType, 
+                     'type_category': self.typeCategory, 
+                     'line_number': self.lineNumber, 
+                     'initial_value': self.initialValue, 
+                     'visibility': self.visibility, 
+                     'description': self.description
+                    }
+        return paramDict
+
     def to_row(self):
         """Return variables as pd.Series"""
         
+        return pd.Series(self.to_dict()).to_frame().T
+
+    def __str__(self):
+        return f"{self.parameterName}: (parameter of {str(self.parentObject)})"
+
+
+# =============================================================================
+# Compact variants of the data model, for holding many files in memory
+# =============================================================================
+def _intern(s):
+    """Intern string s (so that repeated names/types share one object); pass through anything else"""
+    return sys.intern(s) if isinstance(s, str) else s
+
+
+class CompactContractObject():
+    """Slotted, compact equivalent of ContractObject
+    
+    No per-instance __dict__; repeated strings (contract, type, name, visibility, and the
+    entries of inheritance/modifiers/values) are interned and stored in tuples, and the 
+    id is computed only when requested. Parameters are not collected on their parent 
+    (use CompactContractParameter.parentObject instead).
+    """
+    
+    __slots__ = ('contract', 'objectType', 'objectName', 'lineNumbers', 'inheritance', 'modifiers',
+                 'values', 'visibility', 'description')
+    
+    def __init__(self, contract, objectType, objectName, lineNumbers, inheritance=(), modifiers=(),
+                 values=(), visibility='', description=''):
+        self.contract = _intern(contract)
+        self.objectType = _intern(objectType)
+        self.objectName = _intern(objectName)
+        self.lineNumbers = tuple(lineNumbers)
+        self.inheritance = tuple(_intern(s) for s in inheritance)
+        self.modifiers = tuple(_intern(s) for s in modifiers)
+        self.values = tuple(_intern(s) for s in values)
+        self.visibility = _intern(visibility)
+        self.description = description
+    
+    @property
+    def id(self):
+        return f"{self.contract}.{self.objectName}@{self.lineNumbers[0]}"
+    
+    @classmethod
+    def from_ast_node(cls, ast_node, contractName):
+        """Use node of AST tree and the name of the contract (see ContractObject)"""
+        
+        return cls(**ContractObject.get_ast_node_vars(ast_node, contractName))
+    
+    def to_dict(self):
+        """Return variables as a dict (one record of the objects DataFrame)"""
+        
+        objDict = {'object_name': self.objectName, 
+                   'contract': self.contract, 
+                   'type': self.objectType, 
+                   'inheritance': list(self.inheritance), 
+                   'modifiers': list(self.modifiers), 
+                   'values': list(self.values), 
+                   'visibility': self.visibility, 
+                   'line_numbers': self.lineNumbers, 
+                   'description': self.description
+                  }
+        return objDict
+    
+    @classmethod
+    def to_frame(cls, objects):
+        """Return DataFrame of many objects (see objects_to_frame)"""
+        
+        return objects_to_frame(objects)
+    
+    def __str__(self):
+        return f"{self.objectType} {self.objectName} ({self.contract})"
+    
+
+class CompactContractParameter():
+    """Slotted, compact equivalent of ContractParameter (see CompactContractObject)"""
+    
+    __slots__ = ('parameterName', 'parentObject', 'lineNumber', 'visibility', 'parameterType',
+                 'typeCategory', 'initialValue', 'description')
+    
+    def __init__(self, parameterName, parentObject, lineNumber, visibility='', parameterType='',
+                 typeCategory='', initialValue=None, description=''):
+        self.parameterName = _intern(parameterName)
+        self.parentObject = parentObject
+        self.lineNumber = lineNumber
+        self.visibility = _intern(visibility)
+        self.parameterType = _intern(parameterType)
+        self.typeCategory = _intern(typeCategory)
+        self.initialValue = initialValue
+        self.description = description
+    
+    @property
+    def id(self):
+        return f"{self.parentObject.contract}.{str(self.parentObject)}.{self.parameterName}@{self.lineNumber}"
+    
+    @classmethod
+    def from_ast_node(cls, ast_node, parentObject):
+        """Initialize parameter given portion of AST tree (see ContractParameter)"""
+        
+        return cls(**ContractParameter.get_ast_node_vars(ast_node, parentObject))
+    
+    def to_dict(self):
+        """Return variables as a dict (one record of the parameters DataFrame)"""
+        
         paramDict = {'parameter_name': self.parameterName, 
                      'object_name': self.parentObject.objectName, 
                      'contract': self.parentObject.contract, 
@@ -220,15 +357,170 @@ class ContractParameter():
                      'visibility': self.visibility, 
                      'description': self.description
                     }
-        return pd.Series(paramDict).to_frame().T
-
+        return paramDict
+    
+    @classmethod
+    def to_frame(cls, parameters):
+        """Return DataFrame of many parameters (see parameters_to_frame)"""
+        
+        return parameters_to_frame(parameters)
+    
     def __str__(self):
         return f"{self.parameterName}: (parameter of {str(self.parentObject)})"
 
 
+def objects_to_frame(objects):
+    """Return objects DataFrame for many ContractObjects (or CompactContractObjects) at once
+    
+    Builds each column directly from the instances rather than going through to_dict/to_row
+    for each; gives the same DataFrame as records_to_frame([o.to_dict() for o in objects])
+    """
+    
+    if len(objects) == 0:
+        return pd.DataFrame()
+    
+    columns = {'object_name': [o.objectName for o in objects], 
+               'contract': [o.contract for o in objects], 
+               'type': [o.objectType for o in objects], 
+               'inheritance': [list(o.inheritance) for o in objects], 
+               'modifiers': [list(o.modifiers) for o in objects], 
+               'values': [list(o.values) for o in objects], 
+               'visibility': [o.visibility for o in objects], 
+               'line_numbers': [o.lineNumbers for o in objects], 
+               'description': [o.description for o in objects]
+              }
+    return pd.DataFrame(columns).astype(object)
+
+
+def parameters_to_frame(parameters):
+    """Return parameters DataFrame for many ContractParameters (or CompactContractParameters) at once
+    
+    Gives the same DataFrame as records_to_frame([p.to_dict() for p in parameters])
+    """
+    
+    if len(parameters) == 0:
+        return pd.DataFrame()
+    
+    columns = {'parameter_name': [p.parameterName for p in parameters], 
+               'object_name': [p.parentObject.objectName for p in parameters], 
+               'contract': [p.parentObject.contract for p in parameters], 
+               'type': [p.parameterType for p in parameters], 
+               'type_category': [p.typeCategory for p in parameters], 
+               'line_number': [p.lineNumber for p in parameters], 
+               'initial_value': [p.initialValue for p in parameters], 
+               'visibility': [p.visibility for p in parameters], 
+               'description': [p.description for p in parameters]
+              }
+    return pd.DataFrame(columns).astype(object)
+
+
 # =============================================================================
 # Populate data model based on solidity_parser AST
 # =============================================================================    
+def records_to_frame(records, emptyColumns=None):
+    """Build a DataFrame from a list of to_dict() records in one step
+    
+    All columns are kept as object dtype, as they were when rows were concatenated
+    one at a time; an empty list of records gives an empty DataFrame with no columns
+    (or with emptyColumns, if given).
+    """
+    
+    if len(records) == 0:
+        return pd.DataFrame(columns=emptyColumns)
+    
+    return pd.DataFrame.from_records(records).astype(object)
+
+
+class ContractVisitor():
+    """Walk a solidity_parser sourceUnit once, collecting contract objects and their parameters
+    along with the line spans needed to attach comments to each of them
+    
+    Objects and parameters are collected in definition order as ContractObject and
+    ContractParameter instances. Comment spans are (start, end) slices of the source lines,
+    following the same rules as add_docstring_comments (for objects: lines since the end
+    of the previous object, or since its start if nested) and add_inline_comments (for
+    parameters: lines since the previous parameter, including the parameter's own line).
+    
+    If compact, collects CompactContractObjects and CompactContractParameters instead
+    (e.g., for holding the model of many files in memory at once).
+    """
+    
+    def __init__(self, compact=False):
+        self.objectClass = CompactContractObject if compact else ContractObject
+        self.parameterClass = CompactContractParameter if compact else ContractParameter
+        self.objects = []
+        self.parameters = []
+        self.objectSpans = []
+        self.parameterSpans = []
+    
+    def visit(self, sourceUnit):
+        """Collect objects, parameters, and comment spans from sourceUnit; returns self"""
+        
+        # Get list of relevant contract nodes defined in Solidity file
+        contracts = [c for c in sourceUnit['children'] if c.get('type') == 'ContractDefinition']
+        contracts = [c for c in contracts if c['name'] not in IGNORE_CONTRACTS]
+        
+        # Iterate through contracts to extract objects and their parameters
+        for c in contracts:
+            contractName = c['name']
+        
+            # Add object for the contract itself
+            contract = self.objectClass.from_ast_node(c, contractName)
+            self.add_object(contract)
+
+            # Iterate through relevant subnodes in contract
+            for item in c.get('subNodes', []):
+                itemType = item['type']
+                
+                if itemType == 'StateVariableDeclaration':
+                    # Add contract state variables to parameters
+                    for param in item.get('variables', {}):
+                        self.add_parameter(self.parameterClass.from_ast_node(param, contract))
+                else:
+                    try: 
+                        # Add function/event/modifier definition to objects
+                        contractObj = self.objectClass.from_ast_node(item, contractName)
+                        self.add_object(contractObj)
+
+                        # Add each of its parameters
+                        paramObj = item.get('parameters', (item.get('members', {})))
+                        if isinstance(paramObj, dict):
+                            values = paramObj.get('parameters', [])
+                        elif isinstance(paramObj, list) and itemType == 'StructDefinition':
+                            values = paramObj
+                        else:
+                            values = []
+                        for param in values:
+                            self.add_parameter(self.parameterClass.from_ast_node(param, contractObj))
+                    except AssertionError as e:
+                        # If unsupported object type is encountered
+                        pass
+        
+        return self
+    
+    def add_object(self, contractObj):
+        """Add object, with span of lines from the previous object to the start of this one"""
+        
+        prevObjectLoc = self.objects[-1].lineNumbers if self.objects else (0, 0)
+        commentEnd = contractObj.lineNumbers[0] - 1
+        if prevObjectLoc[1] <= commentEnd:
+            commentStart = prevObjectLoc[1]
+        else:
+            commentStart = prevObjectLoc[0]
+        
+        self.objects.append(contractObj)
+        self.objectSpans.append((commentStart, commentEnd))
+    
+    def add_parameter(self, contractParam):
+        """Add parameter, with span of lines from the previous parameter up to and including this one"""
+        
+        commentStart = int(self.parameters[-1].lineNumber) if self.parameters else 0
+        commentEnd = int(contractParam.lineNumber)
+        
+        self.parameters.append(contractParam)
+        self.parameterSpans.append((min(commentStart, commentEnd - 2), commentEnd))
+
+
 def extract_objects_and_parameters(sourceUnit):
     """Collect information on contract objects and their parameters
     
@@ -240,88 +532,71 @@ def extract_objects_and_parameters(sourceUnit):
         parameters needed to define or call the above
         
     Each contract/parameter is first defined using the ContractObject or ContractParameter class
-    to pull the relevant information from the AST node, then exported to a Series for storage in
-    the corresponding DataFrame.
+    to pull the relevant information from the AST node (see ContractVisitor). Each DataFrame is
+    then built once from all of them (rather than concatenating one-row frames, which copies the
+    growing frame for every object/parameter).
     """
     
-    # Get list of relevant contract nodes defined in Solidity file
-    contracts = [c for c in sourceUnit['children'] if c.get('type') == 'ContractDefinition']
-    contracts = [c for c in contracts if c['name'] not in IGNORE_CONTRACTS]
-    
-    df_objects = pd.DataFrame()
-    df_parameters = pd.DataFrame()
-    
-    # Iterate through contracts to extract objects and their parameters
-    for c in contracts:
-        contractName = c['name']
+    visitor = ContractVisitor().visit(sourceUnit)
     
-        # Append object for the contract itself
-        contract = ContractObject.from_ast_node(c, contractName)
-        df_objects = pd.concat([df_objects, contract.to_row()], ignore_index=True)
+    df_objects = objects_to_frame(visitor.objects)
+    df_parameters = parameters_to_frame(visitor.parameters)
+
+    return df_objects, df_parameters
 
-        # Iterate through relevant subnodes in contract
-        for item in c.get('subNodes', []):
-            itemType = item['type']
-            
-            if itemType == 'StateVariableDeclaration':
-                # Append contract state variables to parameters DataFrame
-                for param in item.get('variables', {}):
-                    stateVar = ContractParameter.from_ast_node(param, contract)
-                    df_parameters = pd.concat([df_parameters, stateVar.to_row()], ignore_index=True)
-            else:
-                try: 
-                    # Append function/event/modifier definition to objects DataFrame
-                    contractObj = ContractObject.from_ast_node(item, contractName)
-                    df_objects = pd.concat([df_objects, contractObj.to_row()], ignore_index=True)
-
-                    # Append each parameter to DataFrame
-                    paramObj = item.get('parameters', (item.get('members', {})))
-                    if isinstance(paramObj, dict):
-                        values = paramObj.get('parameters', [])
-                    elif isinstance(paramObj, list) and itemType == 'StructDefinition':
-                        values = paramObj
-                    else:
-                        values = []
-                    for param in values:
-                        contractParam = ContractParameter.from_ast_node(param, contractObj)
-                        df_parameters = pd.concat([df_parameters, contractParam.to_row()], ignore_index=True)
-                except AssertionError as e:
-                    # If unsupported object type is encountered
-                    pass
 
+def extract_commented_objects_and_parameters(sourceUnit, lines):
+    """Collect information on contract objects and their parameters, including their comments
+    
+    Same as extract_objects_and_parameters followed by add_docstring_comments, add_inline_comments,
+    and remove_duplicate_comments_in_parameters, but walks the AST once (see ContractVisitor) and
+    attaches comments to the records before building the DataFrames (see attach_comments)
+    
+    returns df_objects, df_parameters
+    """
+    
+    visitor = ContractVisitor().visit(sourceUnit)
+    objectRecords = [o.to_dict() for o in visitor.objects]
+    parameterRecords = [p.to_dict() for p in visitor.parameters]
+    
+    attach_comments(lines, objectRecords, parameterRecords, visitor.objectSpans, visitor.parameterSpans)
+    
+    # Empty DataFrames get the columns that the DataFrame comment functions would have added
+    df_objects = records_to_frame(objectRecords, emptyColumns=NATSPEC_TAGS + ['description', 'full_comment'])
+    df_parameters = records_to_frame(parameterRecords, emptyColumns=['full_comment'])
+    
     return df_objects, df_parameters
 
 
 # =============================================================================
 # Main function
 # =============================================================================
-def parse_contract_file(uri, label='', debug=False):
-    """Parse a Solidity contract file from a filepath or a URL
+def parse_contract_source(source, saveName='', label='', debug=False, cache=None, profile=None):
+    """Parse Solidity source code given as a string (or utf-8 encoded bytes)
     
-    If present, prepend 'label' to parsed AST filename for easier batch parsing
+    The same in-memory text is used both for the grammar parse and for comment
+    extraction, so nothing is written to or read back from disk (except the parsed
+    AST if debug=True, saved as tmp/parsed_{label}_{saveName}.txt)
+    
+    If an ASTCache is given as 'cache', reuse the parsed AST for previously seen
+    source instead of running the grammar again
+    
+    If a ParseProfile is given as 'profile', record the wall time of each stage and
+    the number of AST nodes, objects, and parameters in it
     
     returns df_objects, df_parameters
     """
     
-    assert (validators.url(uri) == True or os.path.isfile(uri)), 'supply a valid file path or URL'
+    if isinstance(source, bytes):
+        source = source.decode('utf-8')
+    lines = source.split('\n')
     
-    if validators.url(uri) == True:
-        # Download content of file from URL 
-        content = requests.get(uri).text
-        fpath = 'tmp/solidity.txt'
-        with open(fpath, 'w') as f:
-            f.write(content)
-        lines = content.split('\n')
-        saveName = uri.split('/')[-1].split('.')[0]
-    else:
-        # Open existing file
-        fpath = uri
-        with open(fpath, 'r') as f:
-            lines = f.readlines()
-        saveName = os.path.splitext(os.path.split(uri)[-1])[0]
-
     # Get file structure as OrderedList and split into contracts
-    sourceUnit = parser.parse_file(fpath, loc=True)
+    with profile_stage(profile, 'parse'):
+        if cache is not None:
+            sourceUnit = cache.parse(source)
+        else:
+            sourceUnit = parser.parse(source, loc=True)
     
     # Save AST to file for debugging
     if debug:
@@ -330,20 +605,62 @@ def parse_contract_file(uri, label='', debug=False):
         with open(f"tmp/parsed_{saveName}.txt", 'w') as f:
             pprint.pprint(sourceUnit, stream=f)    
     
-    # Get object and parameter DataFrames (selecting from solidity_parser AST)
-    df_objects, df_parameters = extract_objects_and_parameters(sourceUnit)
-    
-    # Add comments to the DataFrames
-    df_objects, df_parameters = add_docstring_comments(lines, df_objects, df_parameters)
-    df_parameters = add_inline_comments(lines, df_parameters)
-    df_parameters = remove_duplicate_comments_in_parameters(df_objects, df_parameters)
+    # Get object and parameter DataFrames (selecting from solidity_parser AST), with comments
+    with profile_stage(profile, 'extract_and_comments'):
+        df_objects, df_parameters = extract_commented_objects_and_parameters(sourceUnit, lines)
 
     # Add coding keywords/topics to the DataFrames
-    df_objects['coding_keyword_search'] = df_objects.apply(lambda row: find_keywords_in_obj(row, df_parameters), axis=1)
-    df_objects['coding_topic_search'] = df_objects.apply(lambda row: find_topics_in_obj(row, df_parameters), axis=1)  
+    codingCache = get_coding_cache()
+    codingLookups = (codingCache.hits, codingCache.misses)
+    with profile_stage(profile, 'keyword_search'):
+        keywords, topics = code_objects(df_objects, df_parameters, cache=codingCache)
+        df_objects['coding_keyword_search'] = pd.Series(keywords, index=df_objects.index, dtype=object)
+        df_objects['coding_topic_search'] = pd.Series(topics, index=df_objects.index, dtype=object)
+    
+    if profile is not None:
+        profile.count('lines', len(lines))
+        profile.count('ast_nodes', count_ast_nodes(sourceUnit))
+        profile.count('objects', len(df_objects.index))
+        profile.count('parameters', len(df_parameters.index))
+        profile.count('coding_cache_hits', codingCache.hits - codingLookups[0])
+        profile.count('coding_cache_misses', codingCache.misses - codingLookups[1])
     
     return df_objects, df_parameters
 
 
+def parse_contract_file(uri, label='', debug=False, cache=None, profile=None):
+    """Parse a Solidity contract file from a filepath or a URL
+    
+    If present, prepend 'label' to parsed AST filename for easier batch parsing
+    
+    If an ASTCache is given as 'cache', reuse the parsed AST for previously seen
+    file content instead of running the grammar again
+    
+    URL content is parsed in memory (see parse_contract_source), so concurrent
+    calls in separate threads or processes do not interfere with each other
+    
+    If a ParseProfile is given as 'profile', record the time taken by each stage
+    (including reading/downloading the file)
+    
+    returns df_objects, df_parameters
+    """
+    
+    assert (validators.url(uri) == True or os.path.isfile(uri)), 'supply a valid file path or URL'
+    
+    with profile_stage(profile, 'read'):
+        if validators.url(uri) == True:
+            # Download content of file from URL 
+            source = requests.get(uri).text
+            saveName = uri.split('/')[-1].split('.')[0]
+        else:
+            # Open existing file (same as solidity_parser.parser.parse_file)
+            with open(uri, 'r', encoding='utf-8') as f:
+                source = f.read()
+            saveName = os.path.splitext(os.path.split(uri)[-1])[0]
+
+    return parse_contract_source(source, saveName=saveName, label=label, debug=debug, cache=cache,
+                                 profile=profile)
+
+
 if __name__ == "__main__":
     argh.dispatch_command(parse_contract_file)
\ No newline at end of file
@@ -1,10 +1,18 @@
 import os
+import json
 import shutil
+import tempfile
+import threading
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metagov.repostore import RepoStore, REPO_STORE_FILE
+from metagov.ratelimit import RequestScheduler, RateLimitExceeded
+from metagov.archivecache import ArchiveCache, ARCHIVE_DIR
 from json.decoder import JSONDecodeError
 from zipfile import ZipFile
-from io import BytesIO
 
 CWD = os.path.join(os.path.dirname(__file__))
 if CWD.rstrip('/').endswith('metagov'):
@@ -12,11 +20,106 @@ if CWD.rstrip('/').endswith('metagov'):
 TMPDIR = os.path.join(CWD, 'tmp')
 DATADIR = os.path.join(CWD, 'data')
 
-REPODICT_FILE = os.path.join(DATADIR, 'repodicts.csv')
-if not os.path.isfile(REPODICT_FILE):
-    open(REPODICT_FILE, 'a').close()
-
 HEADERS = {'User-Agent': 'metagov'}
+API_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com') # Can point to a local stand-in for testing
+DOWNLOAD_JOBS = 4 # Repositories downloaded at once by download_repos
+ZIP_CHUNK_SIZE = 1 << 20 # Bytes read from the zipball response at a time
+ZIP_SPOOL_SIZE = 8 << 20 # Zipballs larger than this are spooled to disk rather than kept in memory
+PROGRESS_INTERVAL = 16 << 20 # Report download progress every this many bytes
+EXTRACTED_FILE = '.extracted.json' # Records which commit/subdir/ext a repository directory was extracted from
+
+_session = None
+_sessionPoolSize = 0
+_sessionLock = threading.Lock()
+_scheduler = None
+_repoStore = None
+_repoStoreLock = threading.Lock()
+_archiveCache = None
+_useArchiveCache = True
+_repoLocksLock = threading.Lock()
+_repoLocks = {}
+
+
+def get_session(poolSize=None):
+    """Return the requests.Session shared by all API and zipball requests
+    
+    Keeps connections to the API alive between requests (rather than opening one per
+    request), with a connection pool large enough for poolSize threads (by default,
+    DOWNLOAD_JOBS); the pool is enlarged if a later call asks for more"""
+    
+    global _session, _sessionPoolSize
+    poolSize = max(1, poolSize or DOWNLOAD_JOBS)
+    with _sessionLock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers.update(HEADERS)
+        if poolSize > _sessionPoolSize:
+            adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+            _sessionPoolSize = poolSize
+    
+    return _session
+
+
+def get_scheduler():
+    """Return the RequestScheduler through which all API and zipball requests are made
+    (over the shared session), keeping them within the API rate limit"""
+    
+    global _scheduler
+    session = get_session()
+    with _sessionLock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(session)
+    
+    return _scheduler
+
+
+def get_repo_store():
+    """Return the RepoStore of repository metadata (at REPO_STORE_FILE) shared by this process"""
+    
+    global _repoStore
+    with _repoStoreLock:
+        if _repoStore is None:
+            _repoStore = RepoStore(REPO_STORE_FILE)
+    
+    return _repoStore
+
+
+def set_repo_store(store):
+    """Replace the shared RepoStore (e.g., with one using a different file or ttl)"""
+    
+    global _repoStore
+    with _repoStoreLock:
+        _repoStore = store
+
+
+def get_archive_cache():
+    """Return the ArchiveCache (at ARCHIVE_DIR) of zipballs shared by this process, or None
+    if disabled with set_archive_cache(None)"""
+    
+    global _archiveCache
+    with _repoStoreLock:
+        if _archiveCache is None and _useArchiveCache:
+            _archiveCache = ArchiveCache(ARCHIVE_DIR)
+    
+    return _archiveCache
+
+
+def set_archive_cache(cache):
+    """Replace the shared ArchiveCache (e.g., with one using a different quota), or disable it if None"""
+    
+    global _archiveCache, _useArchiveCache
+    with _repoStoreLock:
+        _archiveCache = cache
+        _useArchiveCache = cache is not None
+
+
+def _get_repo_lock(githubURL):
+    """Return lock for downloading a repository (so that it is not downloaded twice at once)"""
+    
+    with _repoLocksLock:
+        return _repoLocks.setdefault(githubURL, threading.Lock())
 
 
 def assert_api_rate_limit_not_exceeded(r):
@@ -43,9 +146,31 @@ def construct_file_url(filepath, repoDict):
     return fileURL
         
 
-def get_github_api_info(githubURL):
+def get_api_json(apiURL, etags=None):
+    """Return JSON content of an API request, raising an HTTPError if it failed
+    
+    If a dict of etags {apiURL: ETag} from previous requests is given, make the request
+    conditional on the content having changed since (returning None if it has not), and
+    record the new response's ETag in it"""
+    
+    r = get_scheduler().get(apiURL, etag=(etags.get(apiURL) if etags is not None else None))
+    if r.status_code == 304:
+        return None
+    assert_api_rate_limit_not_exceeded(r)
+    r.raise_for_status()
+    if etags is not None and r.headers.get('ETag'):
+        etags[apiURL] = r.headers['ETag']
+    
+    return r.json()
+    
+
+def get_github_api_info(githubURL, etags=None, prevDict=None):
     """Get relevant info from the URL string itself and from an API request
     
+    To refresh previously collected info, pass the previous repoDict as prevDict and the
+    ETags of the responses it was built from as etags (see get_api_json): values from
+    responses that have not changed are then taken from prevDict. etags is updated in place.
+    
     Returns repoDict: dictionary containing repository owner, name, ref, ..."""
     
     # Separate original URL into components
@@ -59,22 +184,29 @@ def get_github_api_info(githubURL):
         ref = ''
     
     # For reference, get the date that the repository was most recently updated
-    apiURL = f"https://api.github.com/repos/{repoOwner}/{repoName}"
-    r = requests.get(apiURL)
-    assert_api_rate_limit_not_exceeded(r)
-    r_base = r.json()
+    if prevDict is None:
+        prevDict = {}
+        if etags:
+            etags.clear() # Without previous values, unchanged responses cannot be used
+    apiURL = f"{API_URL}/repos/{repoOwner}/{repoName}"
+    r_base = get_api_json(apiURL, etags)
+    if r_base is None:
+        r_base = {'default_branch': prevDict['default_branch'], 'updated_at': prevDict['updated_at']}
     defaultBranch = r_base.get('default_branch', 'master') # May be main tho!
     dateUpdated = ''
     if ref:
         # If version/tag specified
-        apiURL = apiURL + '/commits/' + ref
-        r = requests.get(apiURL)
-        assert_api_rate_limit_not_exceeded(r)
-        r_ref = r.json()
+        r_ref = get_api_json(apiURL + '/commits/' + ref, etags)
+        if r_ref is None:
+            r_ref = {'sha': prevDict.get('sha', ''), 'commit': {'committer': {'date': prevDict['updated_at']}}}
         dateUpdated = r_ref.get('commit', {}).get('committer', {}).get('date', '')
     else:
         # If main/master
         dateUpdated = r_base.get('updated_at')   
+        r_ref = get_api_json(apiURL + '/commits/' + defaultBranch, etags)
+        if r_ref is None:
+            r_ref = {'sha': prevDict.get('sha', '')}
+    sha = r_ref.get('sha', '') # Commit the ref currently resolves to (see ArchiveCache)
 
     # Define metadata
     repoDict = {'owner': repoOwner,
@@ -83,7 +215,8 @@ def get_github_api_info(githubURL):
                 'ref': ref,
                 'updated_at': dateUpdated,
                 'url': githubURL,
-                'id': f"{repoOwner}_{repoName}" + (f"_{ref}" if ref else f"_{defaultBranch}")
+                'id': f"{repoOwner}_{repoName}" + (f"_{ref}" if ref else f"_{defaultBranch}"),
+                'sha': sha
                 }
     
     return repoDict
@@ -92,19 +225,210 @@ def get_github_api_info(githubURL):
 def get_zipball_api_url(repoDict):
     """Given repository information, construct url for zipball
     
-    Returns zipball URL, for specific version of repo if specified
+    Returns zipball URL, for the commit the repo version resolved to (or else for the
+    specific version of repo if specified)
     """
     
     # Construct zip URL
-    zipURL = f"https://api.github.com/repos/{repoDict['owner']}/{repoDict['name']}/zipball"
-    if repoDict['ref']:
-        zipURL = zipURL + '/' + repoDict['ref']
+    zipURL = f"{API_URL}/repos/{repoDict['owner']}/{repoDict['name']}/zipball"
+    ref = repoDict.get('sha') or repoDict['ref']
+    if ref:
+        zipURL = zipURL + '/' + ref
     
     return zipURL
     
 
+def download_zipball(zipURL, f, chunkSize=ZIP_CHUNK_SIZE):
+    """Stream the zipball at zipURL into the open binary file f, chunkSize bytes at a time
+    (so that at most one chunk of the archive is held in memory here)
+    
+    Returns number of bytes downloaded"""
+    
+    with get_scheduler().get(zipURL, stream=True) as r:
+        if r.status_code != 200:
+            assert_api_rate_limit_not_exceeded(r)
+            r.raise_for_status()
+        totalBytes = int(r.headers.get('Content-Length', 0) or 0)
+        nBytes = 0
+        nextReport = PROGRESS_INTERVAL
+        for chunk in r.iter_content(chunk_size=chunkSize):
+            f.write(chunk)
+            nBytes += len(chunk)
+            if nBytes >= nextReport:
+                print(f"Downloaded {nBytes/1e6:.1f}" + (f"/{totalBytes/1e6:.1f}" if totalBytes else '') + f" MB from {zipURL}")
+                nextReport += PROGRESS_INTERVAL
+    
+    return nBytes
+    
+
 def download_repo(githubURL, subdir='contracts', ext='.sol'):
     """Download a specific type of file in a specific subdirectory from a GitHub repository zip file
+    (see _download_repo); safe to call from several threads at once"""
+    
+    with _get_repo_lock(githubURL):
+        return _download_repo(githubURL, subdir=subdir, ext=ext)
+
+
+def download_repos(repos, ext='.sol', jobs=DOWNLOAD_JOBS):
+    """Download many repositories at once, in a pool of up to 'jobs' threads sharing one session
+    
+    Arguments:
+    - repos: list of (githubURL, subdir) (see download_repo)
+    - ext: see download_repo
+    - jobs: maximum number of repositories to download at the same time
+    
+    Returns list of (repoDir, repoDict) for each repository, in the same order
+    """
+    
+    get_session(poolSize=jobs)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        return list(executor.map(lambda repo: download_repo(repo[0], subdir=repo[1], ext=ext), repos))
+
+
+def get_repo_dict(githubURL):
+    """Return repoDict for a repository (see get_github_api_info), read from the shared RepoStore
+    if previously collected (to prevent unnecessary API calls) or else requested and stored
+    
+    Entries older than the store's ttl are refreshed with conditional requests (which do
+    not count against the rate limit if nothing changed); if that fails, the old entry is used"""
+    
+    store = get_repo_store()
+    entry = store.get_entry(githubURL)
+    hasSHA = (entry is not None) and bool(entry['repoDict'].get('sha'))
+    if hasSHA and not store.is_stale(entry):
+        return entry['repoDict']
+    
+    etags = dict(entry['etags']) if hasSHA else {} # (Entries from before commits were resolved are fetched again)
+    try:
+        repoDict = get_github_api_info(githubURL, etags=etags,
+                                       prevDict=(entry['repoDict'] if entry is not None else None))
+    except (requests.RequestException, AssertionError, RateLimitExceeded) as e:
+        if entry is None:
+            raise
+        print(f"Could not refresh metadata for {githubURL}, using previous: {str(e)}")
+        return entry['repoDict']
+    store.put(repoDict, etags=etags)
+    
+    return repoDict
+
+
+def get_archive(repoDict):
+    """Return path to the zipball of the commit repoDict['sha'] in the shared ArchiveCache,
+    streaming it there first (see download_zipball) if not yet cached"""
+    
+    cache = get_archive_cache()
+    sha = repoDict['sha']
+    with cache.get_lock(sha):
+        path = cache.get(sha)
+        if path is not None:
+            print(f"Using cached archive of {repoDict['url']} (commit {sha[:7]})")
+            return path
+        
+        zipURL = get_zipball_api_url(repoDict)
+        tmpPath = cache.get_tmp_path(sha)
+        try:
+            with open(tmpPath, 'wb') as f:
+                nBytes = download_zipball(zipURL, f)
+            print(f"Downloaded {nBytes/1e6:.1f} MB from {zipURL}")
+            path = cache.add(sha, tmpPath)
+        finally:
+            if os.path.isfile(tmpPath):
+                os.remove(tmpPath)
+    
+    return path
+
+
+@contextmanager
+def open_zipball(repoDict):
+    """Context manager yielding a repository's zipball as an open ZipFile
+    
+    The zipball is read from the shared ArchiveCache (see get_archive) if it is enabled and
+    the commit is known; otherwise it is streamed to a temporary file (see download_zipball),
+    which is removed on exit"""
+    
+    if get_archive_cache() is not None and repoDict.get('sha'):
+        with ZipFile(get_archive(repoDict)) as zipFile:
+            yield zipFile
+        return
+    
+    zipURL = get_zipball_api_url(repoDict)
+    with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE, dir=TMPDIR) as f:
+        nBytes = download_zipball(zipURL, f)
+        print(f"Downloaded {nBytes/1e6:.1f} MB from {zipURL}")
+        f.seek(0)
+        with ZipFile(f) as zipFile:
+            yield zipFile
+
+
+def is_repo_member(item, subdir='contracts', ext='.sol'):
+    """Return True if zipball member 'item' is one that download_repo extracts"""
+    
+    return (f"/{subdir.strip('/')}/" in item) and item.endswith(ext)
+
+
+def walk_zipball(zipFile, subdir='contracts', ext='.sol'):
+    """Walk through the members of a zipball that download_repo would extract, like os.walk
+    (top-down) would through the extracted repository directory, without extracting anything
+    
+    Yields (root, dirnames, filenames), where root is the member name prefix (starting with
+    the zipball's top-level directory, which stands in for the repository directory) and
+    dirnames/filenames are sorted. As for os.walk, dirnames may be modified in place to
+    prune the walk. Member names are root + '/' + filename.
+    """
+    
+    if ext is None:
+        ext = ''
+    
+    # Build tree of directories from the selected members' paths
+    tree = {}
+    files = {}
+    baseDir = ''
+    for item in zipFile.namelist():
+        if item.endswith('/') or not is_repo_member(item, subdir=subdir, ext=ext):
+            continue
+        parts = item.split('/')
+        baseDir = parts[0]
+        node = tree
+        for part in parts[1:-1]:
+            node = node.setdefault(part, {})
+        files.setdefault('/'.join(parts[:-1]), []).append(parts[-1])
+    
+    if not baseDir:
+        return
+    
+    stack = [(baseDir, tree)]
+    while stack:
+        root, node = stack.pop()
+        dirnames = sorted(node.keys())
+        yield root, dirnames, sorted(files.get(root, []))
+        stack.extend((f"{root}/{d}", node[d]) for d in reversed(dirnames))
+
+
+def _read_extracted(repoDir):
+    """Return what repoDir was extracted from (see EXTRACTED_FILE), or None if unknown"""
+    
+    try:
+        with open(os.path.join(repoDir, EXTRACTED_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+        return None
+
+
+def get_repo_dir(repoDict, subdir='contracts'):
+    """Return local directory that download_repo extracts a repository's subdir to
+    
+    The directory is named after both (e.g., tmp/{owner}_{name}_{ref}__{subdir}), so that
+    several subdirectories of one repository can be downloaded and parsed independently"""
+    
+    targetName = repoDict['id']
+    if subdir:
+        targetName += '__' + subdir.strip('/').replace('/', '_')
+    
+    return os.path.join(TMPDIR, targetName)
+
+
+def _download_repo(githubURL, subdir='contracts', ext='.sol'):
+    """Download a specific type of file in a specific subdirectory from a GitHub repository zip file
     
     Arguments:
     - githubURL: valid GitHub URL to repository root (main or a specific version)
@@ -112,7 +436,7 @@ def download_repo(githubURL, subdir='contracts', ext='.sol'):
     - ext: specific file extension to keep items from. Can also be '' 
     
     Returns:
-    - repoDir: path to local directory
+    - repoDir: path to local directory (see get_repo_dir)
     - repoDict: see get_github_api_info
     
     NOTE: for ease of use with current repo structures of interest, subdir 
@@ -124,75 +448,56 @@ def download_repo(githubURL, subdir='contracts', ext='.sol'):
         ext = ''    
     
     repoDir = ''
+    repoDict = {}
     
-    # Read repo API info if previously collected
-    # (To prevent unnecessary API calls)
     try:
-        repoDicts = pd.read_csv(REPODICT_FILE, index_col=False)
-        repoDicts.fillna('', inplace=True)
-        entries = repoDicts.loc[repoDicts['url'] == githubURL]
-        if len(entries.index) > 0:
-            repoDict = entries.iloc[0].to_dict()
-        else:
-            repoDict = {}
-    except (FileNotFoundError, pd.errors.EmptyDataError):
-        repoDict = {}
+        # Get API info (from file if previously collected)
+        repoDict = get_repo_dict(githubURL)
     
-    try:
-        # Get and save API info if not yet collected
-        if repoDict == {}:
-            repoDict = get_github_api_info(githubURL)
-            with open(REPODICT_FILE, 'a') as f:
-                if os.stat(REPODICT_FILE).st_size == 0:
-                    f.write(','.join(repoDict.keys()))
-                f.write('\n' + ','.join(repoDict.values()))
-    
-        # If target directory does not yet exist, or if subdir is not in it, download and extract
-        # (To prevent unnecessary API calls; Does not overwrite existing files!)        
-        targetName = repoDict['id']
-        repoDir = os.path.join(TMPDIR, targetName)
-        downloadFlag = False
-        if not(os.path.isdir(repoDir)):
-            downloadFlag = True
+        # If target directory was not extracted from the same commit, subdir and ext, (download and) extract
+        # (To prevent unnecessary API calls and extraction)
+        repoDir = get_repo_dir(repoDict, subdir=subdir)
+        extracted = {'sha': repoDict.get('sha', ''), 'subdir': subdir, 'ext': ext}
+        if extracted['sha'] and _read_extracted(repoDir) == extracted:
+            print(f"Using files already in {repoDir}")
         else:
-            foundSubdir = False
-            for r, d, f in os.walk(repoDir):
-                if (r == subdir) or (subdir in d):
-                    foundSubdir = True
-            if foundSubdir == False:
-                downloadFlag = True
-        
-        if downloadFlag:
-            # Get zip file
-            zipURL = get_zipball_api_url(repoDict)
-            r = requests.get(zipURL)
-            assert_api_rate_limit_not_exceeded(r)
-            zipFile = ZipFile(BytesIO(r.content))
-            
-            # Extract just the relevant subdirectory(-ies) from the zip file
-            zipItems = zipFile.infolist()
-            baseItem = zipItems[0].filename
-            itemCount = 0
-            if subdir:
-                baseItem = baseItem + subdir.strip('/') + '/'
-            for zi in zipItems:
-                item = zi.filename
-                if (f"/{subdir.strip('/')}/" in item) and item.endswith(ext):
-                    zipFile.extract(item, TMPDIR)
-                    itemCount += 1
+            with open_zipball(repoDict) as zipFile:
+                cache = get_archive_cache()
+                if subdir and cache is not None and cache.get_manifest(extracted['sha']) is not None \
+                    and not cache.contains_subdir(extracted['sha'], subdir):
+                    raise FileNotFoundError(f"No {subdir} directory in {githubURL}")
+                
+                # Extract just the relevant subdirectory(-ies) from the zip file
+                # (to a new directory, in case another ref of the same commit is extracted at once)
+                extractDir = tempfile.mkdtemp(dir=TMPDIR)
+                try:
+                    zipItems = zipFile.infolist()
+                    baseItem = zipItems[0].filename
+                    itemCount = 0
+                    itemBytes = 0
+                    for zi in zipItems:
+                        if is_repo_member(zi.filename, subdir=subdir, ext=ext):
+                            zipFile.extract(zi, extractDir)
+                            itemCount += 1
+                            itemBytes += zi.file_size
+                    
+                    # Move directory to {owner}_{name}_{ref}__{subdir}
+                    oldName = baseItem.split('/')[0]
+                    repoDir_old = os.path.join(extractDir, oldName)
+                    if os.path.isdir(repoDir):
+                        print(f"Overwriting existing repository {repoDir}...")
+                        shutil.rmtree(repoDir)
+                    os.rename(repoDir_old, repoDir)
+                finally:
+                    shutil.rmtree(extractDir, ignore_errors=True)
             
-            # Rename directory to {owner}_{name}
-            oldName = baseItem.split('/')[0]
-            repoDir_old = os.path.join(TMPDIR, oldName)
-            if os.path.isdir(repoDir):
-                print(f"Overwriting existing repository {repoDir}...")
-                shutil.rmtree(repoDir)
-            os.rename(repoDir_old, repoDir)
-            
-            print(f"Extracted {itemCount} items from {githubURL} to {repoDir}")
-        else:
-            print(f"Using files already in {repoDir}")
+            with open(os.path.join(repoDir, EXTRACTED_FILE), 'w') as f:
+                json.dump(extracted, f)
+            print(f"Extracted {itemCount} items ({itemBytes/1e6:.1f} MB) from {githubURL} to {repoDir}")
 
+    except RateLimitExceeded:
+        # Not specific to this repository, so do not carry on without it
+        raise
     except Exception as e: 
         print(e)
         repoDir = ''
@@ -0,0 +1,106 @@
+import time
+import logging
+import pandas as pd
+from contextlib import contextmanager, nullcontext
+
+STAGES = ['read', 'parse', 'extract_and_comments', 'keyword_search']
+
+
+# =============================================================================
+# Opt-in instrumentation of parse_contract_file
+# =============================================================================
+class ParseProfile():
+    """Wall time per stage of the parsing pipeline, plus counts of what was parsed, for one file
+
+    Pass an instance as 'profile' to parse_contract_file/parse_contract_source to fill it in
+    """
+
+    def __init__(self, label=''):
+        self.label = label
+        self.times = {}
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager adding the wall time of its block to stage 'name'"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0) + time.perf_counter() - start
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+    def to_dict(self):
+        """Return flat dict of times (as '{stage}_sec') and counts"""
+
+        profileDict = {'file': self.label}
+        for s in STAGES + [s for s in self.times.keys() if s not in STAGES]:
+            profileDict[f"{s}_sec"] = self.times.get(s, 0.0)
+        profileDict['total_sec'] = sum(self.times.values())
+        profileDict.update(self.counts)
+
+        return profileDict
+
+
+def profile_stage(profile, name):
+    """Return profile.stage(name), or a no-op context manager if profile is None"""
+
+    if profile is None:
+        return nullcontext()
+    return profile.stage(name)
+
+
+def count_ast_nodes(node):
+    """Return number of AST nodes (dicts with a 'type') in a solidity_parser sourceUnit"""
+
+    count = 0
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        if isinstance(n, dict):
+            if 'type' in n:
+                count += 1
+            stack.extend(n.values())
+        elif isinstance(n, list):
+            stack.extend(n)
+
+    return count
+
+
+def summarize_profiles(profiles, label='', nSlowest=5):
+    """Roll up ParseProfile dicts of many files into a DataFrame and log a summary
+
+    Logs time per stage summed over all files, and the slowest files with their
+    most expensive stage (so that pathological files are easy to spot)
+
+    Returns df_profile, with one row per file
+    """
+
+    df_profile = pd.DataFrame(profiles)
+    if len(df_profile.index) == 0:
+        return df_profile
+
+    timeCols = [c for c in df_profile.columns if c.endswith('_sec') and c != 'total_sec']
+    totals = df_profile[timeCols].sum()
+    total = df_profile['total_sec'].sum()
+
+    logging.info(f"Profile for {label}: {total:.2f}s over {len(df_profile.index)} files")
+    for col, seconds in totals.items():
+        logging.info(f"\t{col[:-4]:>20}: {seconds:8.2f}s ({100 * seconds / total if total else 0:5.1f}%)")
+
+    if 'coding_cache_hits' in df_profile.columns:
+        hits = df_profile['coding_cache_hits'].sum()
+        lookups = hits + df_profile['coding_cache_misses'].sum()
+        logging.info(f"\t{'coding cache':>20}: {hits}/{lookups} hits ({100 * hits / lookups if lookups else 0:5.1f}%)")
+
+    logging.info(f"Slowest files for {label}:")
+    for i, row in df_profile.nlargest(nSlowest, 'total_sec').iterrows():
+        slowestStage = row[timeCols].astype(float).idxmax()[:-4]
+        logging.info(f"\t{row['file']}: {row['total_sec']:.2f}s (mostly {slowestStage}; "
+                     f"{row.get('ast_nodes', 0)} AST nodes, {row.get('objects', 0)} objects, "
+                     f"{row.get('parameters', 0)} parameters)")
+
+    return df_profile
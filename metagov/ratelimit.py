@@ -0,0 +1,198 @@
+import time
+import logging
+import threading
+import requests
+
+API_RATE = 10.0 # Requests per second, on average, at most
+API_BURST = 20 # Requests that can be made at once before they are paced
+RATE_LIMIT_LOW = 0.1 # Fraction of the rate limit below which the remaining requests are spread until the reset
+RATE_LIMIT_RESERVE = 0 # Requests to leave unused in each rate limit window
+RATE_LIMIT_MAX_WAIT = 3600 # Seconds to wait for the rate limit to reset before giving up
+RESET_MARGIN = 1.0 # Seconds to wait past the reset time (which is given in whole seconds)
+MAX_RETRIES = 5
+BACKOFF = 1.0 # Seconds before the first retry of a failed request (doubled for each next one)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when the API rate limit is used up and does not reset within the allowed wait"""
+
+
+# =============================================================================
+# Pacing of requests
+# =============================================================================
+class TokenBucket():
+    """Thread-safe token bucket: tokens are added at 'rate' per second, up to 'capacity',
+    and acquire() takes one, waiting until one is added if there are none"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Take a token, waiting for one if necessary; returns seconds waited"""
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class RequestScheduler():
+    """Makes GET requests through a requests.Session, keeping within an API's rate limit
+
+    - Requests are paced by a TokenBucket of up to 'rate' per second (in bursts of up to 'burst')
+    - The X-RateLimit-Remaining/-Reset headers of each response are tracked: once fewer than
+      lowFraction of the limit remain, the bucket is slowed down to spread the remaining
+      requests until the reset, and once none remain (but 'reserve'), requests wait for the
+      reset (raising RateLimitExceeded if that is more than maxWait seconds away)
+    - Connection errors, RETRY_STATUSES responses and 403 responses due to the rate limit
+      are retried up to maxRetries times, after Retry-After, the reset, or an exponential
+      backoff starting at 'backoff' seconds
+    - With an etag, the request is conditional (If-None-Match), and an unchanged resource
+      is returned as a 304 response (which does not count against GitHub's rate limit)
+
+    One scheduler is meant to be shared by all threads making requests to the same API
+    """
+
+    def __init__(self, session, rate=API_RATE, burst=API_BURST, lowFraction=RATE_LIMIT_LOW,
+                 reserve=RATE_LIMIT_RESERVE, maxWait=RATE_LIMIT_MAX_WAIT, maxRetries=MAX_RETRIES, backoff=BACKOFF):
+        self.session = session
+        self.rate = rate
+        self.bucket = TokenBucket(rate, burst)
+        self.lowFraction = lowFraction
+        self.reserve = reserve
+        self.maxWait = maxWait
+        self.maxRetries = maxRetries
+        self.backoff = backoff
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.stats = {'requests': 0, 'not_modified': 0, 'retries': 0, 'paced_sec': 0.0, 'rate_limit_wait_sec': 0.0}
+        self._lock = threading.Lock()
+
+    def _update_limits(self, r):
+        """Update rate limit state (and the pacing of requests) from a response's headers"""
+
+        try:
+            remaining = int(r.headers['X-RateLimit-Remaining'])
+            reset = float(r.headers['X-RateLimit-Reset'])
+            limit = int(r.headers.get('X-RateLimit-Limit', 0))
+        except (KeyError, ValueError):
+            return
+
+        with self._lock:
+            if self.reset is not None and reset == self.reset and self.remaining is not None:
+                remaining = min(remaining, self.remaining) # Responses to concurrent requests may arrive out of order
+            self.limit, self.remaining, self.reset = limit, remaining, reset
+            if limit and remaining < self.lowFraction * limit:
+                secondsLeft = max(reset - time.time(), 1.0)
+                self.bucket.rate = min(self.rate, max(remaining - self.reserve, 1) / secondsLeft)
+            else:
+                self.bucket.rate = self.rate
+
+    def _wait_for_quota(self):
+        """Count a request against the remaining rate limit, first waiting for the reset if none remain"""
+
+        with self._lock:
+            if self.remaining is None or self.remaining > self.reserve:
+                if self.remaining is not None:
+                    self.remaining -= 1
+                return
+            wait = self.reset + RESET_MARGIN - time.time()
+
+        if wait > 0:
+            self._sleep_for_rate_limit(wait)
+        with self._lock:
+            if self.reset is not None and self.reset + RESET_MARGIN <= time.time():
+                self.remaining = None # Unknown until the next response
+                self.bucket.rate = self.rate
+
+    def _sleep_for_rate_limit(self, wait):
+        if wait > self.maxWait:
+            raise RateLimitExceeded(f"API rate limit exceeded; resets in {wait:.0f}s")
+        logging.warning(f"API rate limit reached; waiting {wait:.0f}s for it to reset")
+        time.sleep(wait)
+        with self._lock:
+            self.stats['rate_limit_wait_sec'] += wait
+
+    def _get_retry_wait(self, r, attempt):
+        """Return seconds to wait before retrying the request that got response r, or None if
+        it should not be retried"""
+
+        isRateLimited = (r.status_code in (403, 429)) and (r.headers.get('X-RateLimit-Remaining') == '0'
+                                                            or 'Retry-After' in r.headers)
+        if not (isRateLimited or r.status_code in RETRY_STATUSES):
+            return None
+        try:
+            return float(r.headers['Retry-After'])
+        except (KeyError, ValueError):
+            pass
+        if isRateLimited and self.reset is not None:
+            # (At least the backoff, in case the reset time is off, e.g., by clock skew)
+            return max(self.reset + RESET_MARGIN - time.time(), self.backoff * 2**attempt)
+
+        return self.backoff * 2**attempt
+
+    def get(self, url, etag=None, **kwargs):
+        """Make a GET request (see class docstring); keyword arguments are passed to session.get
+
+        Returns the response (which may still be an error, if retries did not help)"""
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if etag:
+            headers['If-None-Match'] = etag
+
+        for attempt in range(self.maxRetries + 1):
+            self._wait_for_quota()
+            paced = self.bucket.acquire()
+            with self._lock:
+                self.stats['requests'] += 1
+                self.stats['paced_sec'] += paced
+                self.stats['retries'] += (attempt > 0)
+            try:
+                r = self.session.get(url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.maxRetries:
+                    raise
+                wait = self.backoff * 2**attempt
+                logging.warning(f"Retrying {url} in {wait:.0f}s: {str(e)}")
+                time.sleep(wait)
+                continue
+
+            self._update_limits(r)
+            if r.status_code == 304:
+                with self._lock:
+                    self.stats['not_modified'] += 1
+            wait = self._get_retry_wait(r, attempt)
+            if wait is None or attempt == self.maxRetries:
+                return r
+            r.close()
+            if r.status_code in (403, 429):
+                self._sleep_for_rate_limit(wait)
+            else:
+                logging.warning(f"Retrying {url} in {wait:.0f}s: status {r.status_code}")
+                time.sleep(wait)
+
+    def get_stats(self):
+        """Return copy of request counts and time spent waiting, plus the last known rate limit state"""
+
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update({'limit': self.limit, 'remaining': self.remaining, 'reset': self.reset})
+
+        return stats
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import pandas as pd
+
+CWD = os.path.join(os.path.dirname(__file__))
+if CWD.rstrip('/').endswith('metagov'):
+    CWD = CWD.rstrip('/').rsplit('/', 1)[0]
+TMPDIR = os.path.join(CWD, 'tmp')
+DATADIR = os.path.join(CWD, 'data')
+
+REPO_STORE_FILE = os.path.join(TMPDIR, 'repometadata.sqlite')
+REPODICT_FILE = os.path.join(DATADIR, 'repodicts.csv') # Previously collected entries, used to seed a new store
+REPO_FIELDS = ['owner', 'name', 'default_branch', 'ref', 'updated_at', 'url', 'id', 'sha']
+REPO_METADATA_TTL = 7 * 24 * 3600 # Seconds before an entry is refreshed from the API (None: never)
+
+
+# =============================================================================
+# Indexed store of repository metadata
+# =============================================================================
+class RepoStore():
+    """SQLite store of repository metadata (repoDicts, see githubscrape.get_github_api_info)
+
+    Entries are keyed by URL and indexed by repository id. Each entry also records when
+    it was fetched and the ETag of each API response it was built from, so that once it
+    is older than ttl it can be refreshed with conditional requests.
+
+    Each thread gets its own connection; SQLite serializes writes between threads and
+    processes (waiting up to 'timeout' seconds for a lock), so a store file can be shared.
+
+    A new store is seeded with the entries in seedFile (the old repodicts.csv), if any.
+    """
+
+    def __init__(self, path=REPO_STORE_FILE, ttl=REPO_METADATA_TTL, seedFile=REPODICT_FILE, timeout=30):
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        self._local = threading.local()
+
+        isNew = not os.path.isfile(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS repos ("
+                         + ', '.join(f"{f} TEXT" + (" PRIMARY KEY" if f == 'url' else '') for f in REPO_FIELDS)
+                         + ", etags TEXT, fetched_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS repos_id ON repos (id)")
+            columns = [r['name'] for r in conn.execute("PRAGMA table_info(repos)")]
+            for f in REPO_FIELDS:
+                if f not in columns:
+                    conn.execute(f"ALTER TABLE repos ADD COLUMN {f} TEXT DEFAULT ''")
+        if isNew and seedFile:
+            self.import_csv(seedFile)
+
+    def _connect(self):
+        """Return this thread's connection to the store"""
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+
+        return conn
+
+    @staticmethod
+    def _to_entry(row):
+        return {'repoDict': {f: row[f] for f in REPO_FIELDS},
+                'etags': json.loads(row['etags'] or '{}'),
+                'fetched_at': row['fetched_at']}
+
+    def get_entry(self, url):
+        """Return {'repoDict', 'etags', 'fetched_at'} stored for a repository URL, or None"""
+
+        row = self._connect().execute("SELECT * FROM repos WHERE url = ?", (url,)).fetchone()
+
+        return self._to_entry(row) if row is not None else None
+
+    def get(self, url):
+        """Return repoDict stored for a repository URL, or None"""
+
+        entry = self.get_entry(url)
+
+        return entry['repoDict'] if entry is not None else None
+
+    def get_by_id(self, repoId):
+        """Return repoDict stored for a repository id (owner_name_ref), or None"""
+
+        row = self._connect().execute("SELECT * FROM repos WHERE id = ?", (repoId,)).fetchone()
+
+        return self._to_entry(row)['repoDict'] if row is not None else None
+
+    def is_stale(self, entry):
+        """Return True if an entry is older than the store's ttl"""
+
+        return (self.ttl is not None) and (time.time() - (entry['fetched_at'] or 0) > self.ttl)
+
+    def put(self, repoDict, etags=None, fetchedAt=None):
+        """Add or replace the entry for repoDict['url']"""
+
+        values = [repoDict.get(f, '') for f in REPO_FIELDS]
+        values += [json.dumps(etags or {}), time.time() if fetchedAt is None else fetchedAt]
+        with self._connect() as conn:
+            conn.execute(f"INSERT OR REPLACE INTO repos ({', '.join(REPO_FIELDS)}, etags, fetched_at) "
+                         f"VALUES ({', '.join('?' * len(values))})", values)
+
+    def import_csv(self, csvFile):
+        """Add entries from a repodicts CSV file (as fetched at the file's modification time),
+        keeping any entries already in the store"""
+
+        try:
+            df = pd.read_csv(csvFile, index_col=False, dtype=str).fillna('')
+        except (FileNotFoundError, pd.errors.EmptyDataError):
+            return
+
+        fetchedAt = os.path.getmtime(csvFile)
+        rows = [[r.get(f, '') for f in REPO_FIELDS] + ['{}', fetchedAt] for r in df.to_dict('records')]
+        with self._connect() as conn:
+            conn.executemany(f"INSERT OR IGNORE INTO repos ({', '.join(REPO_FIELDS)}, etags, fetched_at) "
+                             f"VALUES ({', '.join('?' * (len(REPO_FIELDS) + 2))})", rows)
+
+    def to_frame(self):
+        """Return all stored repoDicts as a DataFrame (with the columns of repodicts.csv)"""
+
+        rows = self._connect().execute(f"SELECT {', '.join(REPO_FIELDS)} FROM repos ORDER BY rowid").fetchall()
+
+        return pd.DataFrame([tuple(r) for r in rows], columns=REPO_FIELDS)
+
+    def export_csv(self, csvFile=REPODICT_FILE):
+        """Write all stored repoDicts to a (properly quoted) repodicts CSV file"""
+
+        self.to_frame().to_csv(csvFile, index=False)
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM repos").fetchone()[0]
@@ -0,0 +1,33 @@
+import argh
+import pandas as pd
+
+from metagov.contractindex import ContractIndex, INDEX_FILE, TMPDIR
+
+
+def query(expression, kind='objects', columns='project,contract,object_name,type', limit=50, tmpDir=TMPDIR):
+    """Query the objects/parameters of all parsed projects (the contract_*_{label}.csv files in tmpDir)
+    
+    The index is brought up to date with the parsed files first (only re-indexing projects 
+    that were parsed again since), and saved for next time. See ContractIndex for the query 
+    syntax; e.g.:
+      type:function AND name:delegate* AND param:(name:threshold AND typecat:uint)
+    """
+    
+    index = ContractIndex.load(INDEX_FILE)
+    updated, removed = index.update(tmpDir)
+    if updated:
+        print(f"Indexed {', '.join(updated)}")
+    if removed:
+        print(f"Removed {', '.join(removed)}")
+    if updated or removed:
+        index.save(INDEX_FILE)
+    
+    df_results = index.query(expression, kind=kind)
+    print(f"{len(df_results.index)} {kind} match {expression}")
+    if len(df_results.index) > 0:
+        with pd.option_context('display.max_rows', limit, 'display.width', 200):
+            print(df_results[columns.split(',')].head(limit).to_string())
+
+
+if __name__ == '__main__':
+    argh.dispatch_command(query)
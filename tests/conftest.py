@@ -0,0 +1,41 @@
+import os
+import sys
+import pytest
+
+# Make the repository's modules (metagov, download_and_parse_contracts, ...) importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def github_stub(tmp_path, monkeypatch):
+    """Return function starting a GitHubStub (see githubstub.py) for the given (owner, name) repositories
+    
+    metagov.githubscrape is pointed at it (as GITHUB_API_URL would), with a fresh session and
+    scheduler, and extracts repositories to, and keeps its RepoStore and ArchiveCache in, tmp_path
+    """
+    
+    from githubstub import GitHubStub
+    from metagov import githubscrape
+    from metagov.repostore import RepoStore
+    from metagov.archivecache import ArchiveCache
+    
+    stubs = []
+    
+    def start(repos, **kwargs):
+        stub = GitHubStub(repos, **kwargs).__enter__()
+        stubs.append(stub)
+        monkeypatch.setattr(githubscrape, 'API_URL', stub.url)
+        return stub
+    
+    monkeypatch.setattr(githubscrape, 'TMPDIR', str(tmp_path))
+    monkeypatch.setattr(githubscrape, '_session', None)
+    monkeypatch.setattr(githubscrape, '_sessionPoolSize', 0)
+    monkeypatch.setattr(githubscrape, '_scheduler', None)
+    monkeypatch.setattr(githubscrape, '_repoStore', RepoStore(str(tmp_path / 'repometadata.sqlite'), seedFile=None))
+    monkeypatch.setattr(githubscrape, '_archiveCache', ArchiveCache(str(tmp_path / 'archives')))
+    monkeypatch.setattr(githubscrape, '_useArchiveCache', True)
+    
+    yield start
+    
+    for stub in stubs:
+        stub.__exit__(None, None, None)
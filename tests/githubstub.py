@@ -0,0 +1,155 @@
+"""Local stand-in for the parts of the GitHub API used by metagov.githubscrape
+
+Serves, for each repository it is given:
+  - /repos/{owner}/{name}: default branch and update date
+  - /repos/{owner}/{name}/commits/{ref}: commit SHA and date
+  - /repos/{owner}/{name}/zipball[/{ref}]: zipball built from fixture contracts
+
+Every response carries X-RateLimit-Limit/-Remaining/-Reset headers for a limit of 'limit'
+requests per 'window' seconds (403 once used up), and an ETag; requests with a matching
+If-None-Match get a 304, which does not count against the limit. The next 'fail' requests
+get a 502, and each request is delayed by 'delay' seconds (or delays[(owner, name)]).
+"""
+
+import io
+import os
+import json
+import time
+import hashlib
+import zipfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CWD = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPOUND_DIR = os.path.join(CWD, 'data', 'contracts', 'Compound')
+
+# Fixture repository content: {subdir: [files from COMPOUND_DIR]}, like Moloch's v1_contracts and contracts
+FIXTURE_SUBDIRS = {'contracts': ['Comp.sol', 'GovernorBravoDelegate.sol', 'GovernorBravoInterfaces_delegate.sol'],
+                   'v1_contracts': ['Timelock.sol']}
+
+
+def make_zipball(owner, name, sha, subdirs=None):
+    """Return bytes of a zipball like GitHub's: everything under '{owner}-{name}-{sha[:7]}/'"""
+
+    if subdirs is None:
+        subdirs = FIXTURE_SUBDIRS
+    top = f"{owner}-{name}-{sha[:7]}/"
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr(top, '')
+        z.writestr(top + 'README.md', f"# {name}\n")
+        for subdir, fnames in subdirs.items():
+            for fname in fnames:
+                z.write(os.path.join(COMPOUND_DIR, fname), top + f"{subdir}/{fname}")
+
+    return buf.getvalue()
+
+
+class GitHubStub():
+    """HTTP server standing in for the GitHub API (see module docstring); use as a context manager"""
+
+    def __init__(self, repos, delay=0.0, delays=None, limit=5000, window=3600, fail=0):
+        self.delay = delay
+        self.delays = delays if delays is not None else {}
+        self.limit = limit
+        self.window = window
+        self.fail = fail
+        self.remaining = limit
+        self.resetAt = time.time() + window
+        self.shas = {(o, n): hashlib.sha1(f"{o}/{n}".encode()).hexdigest() for o, n in repos}
+        self.zipballs = {key: make_zipball(*key, sha) for key, sha in self.shas.items()}
+
+        self.requests = [] # (path, status) of each request
+        self.connections = set() # Client addresses, one per connection
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self._lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_paths(self, kind=None):
+        """Return paths requested so far (only those for zipballs, commits, ... if kind is given)"""
+
+        with self._lock:
+            return [p for p, _ in self.requests if kind is None or f"/{kind}" in p]
+
+    def _respond(self, parts):
+        """Return (status, body, contentType, etag) for the path split into parts"""
+
+        key = tuple(parts[1:3]) if len(parts) >= 3 and parts[0] == 'repos' else None
+        if key not in self.shas:
+            return 404, json.dumps({'message': 'Not Found'}).encode(), 'application/json', None
+        sha = self.shas[key]
+        if len(parts) == 3:
+            body = {'default_branch': 'main', 'updated_at': '2022-01-01T00:00:00Z'}
+            return 200, json.dumps(body).encode(), 'application/json', f'"{sha}-repo"'
+        if parts[3] == 'commits':
+            body = {'sha': sha, 'commit': {'committer': {'date': '2021-06-01T00:00:00Z'}}}
+            return 200, json.dumps(body).encode(), 'application/json', f'"{sha}-commit"'
+        if parts[3] == 'zipball':
+            return 200, self.zipballs[key], 'application/zip', f'"{sha}"'
+
+        return 404, json.dumps({'message': 'Not Found'}).encode(), 'application/json', None
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep connections alive
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parts = self.path.strip('/').split('/')
+                with stub._lock:
+                    stub.connections.add(self.client_address)
+                    stub.inFlight += 1
+                    stub.maxInFlight = max(stub.maxInFlight, stub.inFlight)
+                try:
+                    time.sleep(stub.delays.get(tuple(parts[1:3]), stub.delay))
+                    status, body, contentType, etag = stub._respond(parts)
+
+                    with stub._lock:
+                        if time.time() >= stub.resetAt:
+                            stub.remaining = stub.limit
+                            stub.resetAt = time.time() + stub.window
+                        if stub.fail > 0:
+                            stub.fail -= 1
+                            status, body, etag = 502, b'{}', None
+                        elif etag is not None and self.headers.get('If-None-Match') == etag:
+                            status, body = 304, b''
+                        elif stub.remaining <= 0:
+                            status, etag = 403, None
+                            body = json.dumps({'message': 'API rate limit exceeded for 127.0.0.1.'}).encode()
+                        else:
+                            stub.remaining -= 1
+                        stub.requests.append((self.path, status))
+                        remaining, resetAt = stub.remaining, stub.resetAt
+
+                    self.send_response(status)
+                    self.send_header('Content-Type', contentType)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.send_header('X-RateLimit-Limit', str(stub.limit))
+                    self.send_header('X-RateLimit-Remaining', str(max(remaining, 0)))
+                    self.send_header('X-RateLimit-Reset', str(int(resetAt)))
+                    if etag is not None:
+                        self.send_header('ETag', etag)
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with stub._lock:
+                        stub.inFlight -= 1
+
+        return Handler
@@ -0,0 +1,80 @@
+import os
+import time
+
+from githubstub import make_zipball
+from metagov import githubscrape
+from metagov.archivecache import ArchiveCache
+from metagov.githubscrape import download_repos, get_repo_dict, get_archive
+
+SHAS = [c * 40 for c in 'abcd']
+
+
+def _add(cache, sha, usedAt=None):
+    """Add a fixture zipball for commit sha, as last used at usedAt"""
+
+    tmpPath = cache.get_tmp_path(sha)
+    with open(tmpPath, 'wb') as f:
+        f.write(make_zipball('org0', 'gov0', sha))
+    path = cache.add(sha, tmpPath)
+    if usedAt is not None:
+        os.utime(path, (usedAt, usedAt))
+
+    return path
+
+
+def _cached(cache):
+    return sorted(sha for sha in SHAS if os.path.isfile(os.path.join(cache.cacheDir, sha + '.zip')))
+
+
+def test_add_and_get(tmp_path):
+    cache = ArchiveCache(str(tmp_path))
+
+    path = _add(cache, SHAS[0])
+
+    assert cache.get(SHAS[0]) == path
+    assert cache.get(SHAS[1]) is None
+    assert cache.get_manifest(SHAS[0])['top'] == f"org0-gov0-{SHAS[0][:7]}"
+    assert 'v1_contracts/Timelock.sol' in cache.get_manifest(SHAS[0])['paths']
+    assert cache.contains_subdir(SHAS[0], 'contracts') and cache.contains_subdir(SHAS[0], '/v1_contracts/')
+    assert not cache.contains_subdir(SHAS[0], 'src') and not cache.contains_subdir(SHAS[1], 'contracts')
+    assert sorted(os.listdir(str(tmp_path))) == [f"{SHAS[0]}.json", f"{SHAS[0]}.zip"]
+
+
+def test_least_recently_used_evicted_over_size_limit(tmp_path):
+    cache = ArchiveCache(str(tmp_path))
+    now = time.time()
+    for i, sha in enumerate(SHAS[:3]):
+        _add(cache, sha, usedAt=now - 100 + i)
+    archiveSize = cache.get_manifest(SHAS[0])['size']
+    cache.sizeLimit = int(3.5 * archiveSize)
+
+    # Using the oldest makes the next oldest the least recently used
+    cache.get(SHAS[0])
+    _add(cache, SHAS[3])
+
+    assert _cached(cache) == [SHAS[0], SHAS[2], SHAS[3]]
+    assert cache.get_manifest(SHAS[1]) is None and not cache.contains_subdir(SHAS[1], 'contracts')
+    assert cache.get_size() <= cache.sizeLimit
+
+    # A lower limit applies when the cache is next opened, and the archive just added is always kept
+    cache = ArchiveCache(str(tmp_path), sizeLimit=int(1.5 * archiveSize))
+    assert _cached(cache) == [SHAS[3]]
+    cache.sizeLimit = 0
+    _add(cache, SHAS[1])
+    assert _cached(cache) == [SHAS[1]]
+
+
+def test_refs_of_one_commit_downloaded_once(github_stub):
+    stub = github_stub([('org0', 'gov0')])
+    urls = ['https://github.com/org0/gov0', 'https://github.com/org0/gov0/tree/v1.0']
+
+    (mainDir, mainDict), (tagDir, tagDict) = download_repos([(url, 'contracts') for url in urls], jobs=2)
+
+    assert mainDir != tagDir and mainDict['sha'] == tagDict['sha'] == stub.shas[('org0', 'gov0')]
+    assert len(stub.get_paths('zipball')) == 1
+    cache = githubscrape.get_archive_cache()
+    assert [f for f in os.listdir(cache.cacheDir) if f.endswith('.zip')] == [f"{mainDict['sha']}.zip"]
+
+    # Also when the commit is next needed
+    assert get_archive(get_repo_dict(urls[0])) == cache.get(mainDict['sha'])
+    assert len(stub.get_paths('zipball')) == 1
@@ -0,0 +1,54 @@
+import os
+import pickle
+from importlib import metadata
+from concurrent.futures import ThreadPoolExecutor
+from solidity_parser import parser
+
+from metagov.astcache import ASTCache, CACHE_EXT, get_parser_version
+
+CWD = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMELOCK_FILE = os.path.join(CWD, 'data', 'contracts', 'Compound', 'Timelock.sol')
+
+
+def test_concurrent_writes_of_same_key(tmp_path):
+    cache = ASTCache(cacheDir=str(tmp_path))
+    with open(TIMELOCK_FILE, encoding='utf-8') as f:
+        text = f.read()
+    
+    with ThreadPoolExecutor(8) as executor:
+        sourceUnits = list(executor.map(lambda _: cache.parse(text), range(8)))
+    
+    assert all(s == sourceUnits[0] for s in sourceUnits)
+    assert os.listdir(tmp_path) == [cache.get_key(text) + CACHE_EXT]
+    assert cache.get(cache.get_key(text)) == sourceUnits[0]
+
+
+def test_eviction_only_when_over_limit(tmp_path):
+    cache = ASTCache(cacheDir=str(tmp_path), sizeLimit=10**6)
+    for i in range(5):
+        cache.set(f"key{i}", {'children': [i]})
+    assert len(os.listdir(tmp_path)) == 5
+    
+    cache.sizeLimit = 2 * os.path.getsize(os.path.join(tmp_path, 'key0' + CACHE_EXT))
+    cache.set('key5', {'children': [5]})
+    assert len(os.listdir(tmp_path)) == 2
+    assert cache.get('key5') == {'children': [5]}
+
+
+def test_pickle_roundtrip(tmp_path):
+    cache = pickle.loads(pickle.dumps(ASTCache(cacheDir=str(tmp_path))))
+    cache.set('key', {'children': []})
+    assert cache.get('key') == {'children': []}
+
+
+def test_parser_version_of_installed_package(tmp_path, monkeypatch):
+    version = get_parser_version()
+    assert version.startswith(metadata.version('solidity-parser') + '-')
+    
+    # A changed parser module (with the same version number) gets another identifier
+    with open(parser.__file__, 'rb') as f:
+        source = f.read()
+    changedFile = tmp_path / 'parser.py'
+    changedFile.write_bytes(source + b'\n# Changed\n')
+    monkeypatch.setattr(parser, '__file__', str(changedFile))
+    assert get_parser_version() != version
@@ -0,0 +1,198 @@
+import re
+import os
+import glob
+import pytest
+import pandas as pd
+from solidity_parser import parser
+
+from metagov.contractmodel import parse_contract_source, extract_objects_and_parameters, \
+    extract_commented_objects_and_parameters
+from metagov.contractcomments import CommentIndex, add_docstring_comments, add_inline_comments, \
+    remove_duplicate_comments_in_parameters, parse_object_comments, parse_parameter_comments
+
+CWD = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPOUND_FILES = sorted(glob.glob(os.path.join(CWD, 'data', 'contracts', 'Compound', '*.sol')))
+
+OVERLOADED_SOURCE = """pragma solidity ^0.8.0;
+
+contract Overloaded {
+    /// @notice Two-argument version
+    /// @param b Second value
+    function f(uint a, uint b) public {}
+
+    /// @notice One-argument version
+    /// @param b Not a parameter of this overload
+    function f(uint a) public {}
+
+    /// @param c Not a parameter at all
+    function g(uint a) public {}
+}
+"""
+
+
+def _descriptions(df_parameters):
+    return {(r['object_name'], r['parameter_name'], r['line_number']): r['description']
+            for r in df_parameters.to_dict('records')}
+
+
+def test_param_tag_only_documents_own_overload():
+    df_objects, df_parameters = parse_contract_source(OVERLOADED_SOURCE)
+    descriptions = _descriptions(df_parameters)
+    
+    assert descriptions[('f', 'b', 6)] == 'Second value'
+    assert 'Not a parameter of this overload' not in descriptions.values()
+    assert 'Not a parameter at all' not in descriptions.values()
+    assert list(df_objects['param']) == ['', ['b'], ['b'], ['c']]
+
+
+def _read_contract(fpath):
+    with open(fpath) as f:
+        lines = f.read().split('\n')
+    return parser.parse_file(fpath, loc=True), lines
+
+
+def previous_remove_duplicate_comments_in_parameters(df_o, df_parameters):
+    """Previous removal of duplicate comments: each parameter's parent object looked up in turn"""
+    
+    df_p = df_parameters.copy(deep=True)
+    for i, row in df_parameters.iterrows():
+        index = df_o.loc[(df_o['object_name']==row['object_name']) & (df_o['contract']==row['contract'])].index[0]
+        object_fullComment = df_o.iat[index, df_o.columns.get_loc('full_comment')]
+        object_description = df_o.iat[index, df_o.columns.get_loc('description')]
+        if (row['full_comment'] == object_fullComment) or ('@param' in object_fullComment):
+            df_p.iat[i, df_p.columns.get_loc('full_comment')] = ''
+        if row['description'] == object_description:
+            df_p.iat[i, df_p.columns.get_loc('description')] = ''
+    
+    return df_p
+
+
+@pytest.mark.parametrize('fpath', COMPOUND_FILES, ids=os.path.basename)
+def test_remove_duplicate_comments_matches_previous(fpath):
+    sourceUnit, lines = _read_contract(fpath)
+    df_objects, df_parameters = extract_objects_and_parameters(sourceUnit)
+    df_objects, df_parameters = add_docstring_comments(lines, df_objects, df_parameters)
+    df_parameters = add_inline_comments(lines, df_parameters)
+    
+    expected = previous_remove_duplicate_comments_in_parameters(df_objects, df_parameters)
+    
+    pd.testing.assert_frame_equal(remove_duplicate_comments_in_parameters(df_objects, df_parameters), expected)
+
+
+def previous_clean_comment_lines(lines_raw, includesInline=False):
+    """Previous comment cleaning: the lines joined and searched again for each slice"""
+    
+    def clean(lines):
+        lines = [s.strip() for s in lines if s.strip()]
+        match = re.search(re.compile(r'/\*\*(.+?)\*/$', re.DOTALL), '\n'.join(lines))
+        if match:
+            return [re.sub(r'^\s*\*\s*', '', s).strip() for s in match.group(1).split('\n') if s]
+        lines_new = []
+        for s in lines[::-1]:
+            if not s.startswith('//'):
+                break
+            lines_new.append(re.sub(r'//+', '', s).strip())
+        return lines_new[::-1]
+    
+    if includesInline:
+        tmp = re.split(r'//+', lines_raw[-1])
+        lines_new = clean(lines_raw[:-1]) + ([tmp[-1]] if len(tmp) > 1 else [''])
+    else:
+        lines_new = clean(lines_raw)
+    
+    return [s.strip() for s in lines_new if s.strip()]
+
+
+EDGE_CASE_LINES = ['/** One-line block */', 'uint a;', '/**', ' * Block', ' *', ' * @param x X', ' */', '',
+                   '// Line', '//// More', '', '  // Indented', 'uint b; // Inline', '/***/', '/** a */ /** b */',
+                   '/** unclosed', '// after', 'code(); /* not a docstring */', ' */', '/** x */ y();', '']
+
+
+@pytest.mark.parametrize('fpath', COMPOUND_FILES + ['edge cases'], ids=os.path.basename)
+def test_comment_index_matches_previous_cleaning(fpath):
+    lines = _read_contract(fpath)[1] if fpath != 'edge cases' else EDGE_CASE_LINES
+    commentIndex = CommentIndex(lines)
+    
+    # Spans of every length up to 30 lines (as for objects and parameters), and from the top of the file
+    for end in range(1, len(lines) + 1):
+        for start in sorted({0} | set(range(max(end - 30, 0), end))):
+            for includesInline in [False, True]:
+                expected = previous_clean_comment_lines(lines[start:end], includesInline=includesInline)
+                assert commentIndex.clean(start, end, includesInline=includesInline) == expected, (start, end)
+            assert commentIndex.parse_object_comments(start, end) == parse_object_comments(lines[start:end])
+            assert commentIndex.parse_parameter_comments(start, end) == parse_parameter_comments(lines[start:end])
+
+
+def previous_add_inline_comments(lines, df_parameters):
+    """Previous inline comments: parameters walked in row order, each comment read since the previous row's line"""
+    
+    df_p = df_parameters.copy(deep=True)
+    df_p['full_comment'] = ''
+    commentStart = 0
+    for i, row in df_p.iterrows():
+        commentEnd = int(row['line_number'])
+        commentDict = parse_parameter_comments(lines[min(commentStart, commentEnd - 2):commentEnd])
+        for key, value in commentDict.items():
+            if key in df_p.columns and not df_p.iat[i, df_p.columns.get_loc(key)]:
+                df_p.iat[i, df_p.columns.get_loc(key)] = value
+        commentStart = commentEnd
+    
+    return df_p
+
+
+def _docstring_commented(fpath):
+    sourceUnit, lines = _read_contract(fpath)
+    df_objects, df_parameters = add_docstring_comments(lines, *extract_objects_and_parameters(sourceUnit))
+    
+    return lines, df_parameters
+
+
+@pytest.mark.parametrize('fpath', COMPOUND_FILES, ids=os.path.basename)
+def test_inline_comments_match_previous(fpath):
+    lines, df_parameters = _docstring_commented(fpath)
+    
+    expected = previous_add_inline_comments(lines, df_parameters)
+    
+    pd.testing.assert_frame_equal(add_inline_comments(lines, df_parameters), expected)
+
+
+def test_inline_comments_do_not_depend_on_row_order():
+    lines, df_parameters = _docstring_commented(os.path.join(CWD, 'data', 'contracts', 'Compound', 'Comp.sol'))
+    
+    # Lines in random order (parameters on the same line keep theirs, as it decides which gets the comment above)
+    lineNumbers = df_parameters['line_number'].drop_duplicates().sample(frac=1, random_state=0)
+    lineOrder = {lineNumber: i for i, lineNumber in enumerate(lineNumbers)}
+    shuffled = df_parameters.iloc[df_parameters['line_number'].map(lineOrder).argsort(kind='stable')]
+    assert not shuffled.index.is_monotonic_increasing
+    
+    # (The previous version read each comment since the previous row's line, so needed rows in line order)
+    df_p = add_inline_comments(lines, df_parameters)
+    pd.testing.assert_frame_equal(add_inline_comments(lines, shuffled).sort_index(), df_p)
+    assert (df_p['full_comment'] != '').any()
+
+
+@pytest.mark.parametrize('fpath', COMPOUND_FILES, ids=os.path.basename)
+def test_attach_comments_matches_separate_functions(fpath):
+    sourceUnit, lines = _read_contract(fpath)
+    df_objects, df_parameters = extract_objects_and_parameters(sourceUnit)
+    df_objects, df_parameters = add_docstring_comments(lines, df_objects, df_parameters)
+    df_parameters = add_inline_comments(lines, df_parameters)
+    df_parameters = remove_duplicate_comments_in_parameters(df_objects, df_parameters)
+    
+    df_o, df_p = extract_commented_objects_and_parameters(sourceUnit, lines)
+    
+    pd.testing.assert_frame_equal(df_o, df_objects)
+    pd.testing.assert_frame_equal(df_p, df_parameters)
+
+
+def test_attach_comments_without_parameters():
+    source = OVERLOADED_SOURCE.replace('uint a, uint b', '').replace('uint a', '')
+    sourceUnit = parser.parse(source, loc=True)
+    lines = source.split('\n')
+    df_objects, df_parameters = add_docstring_comments(lines, *extract_objects_and_parameters(sourceUnit))
+    df_parameters = add_inline_comments(lines, df_parameters)
+    
+    df_o, df_p = extract_commented_objects_and_parameters(sourceUnit, lines)
+    
+    pd.testing.assert_frame_equal(df_o, df_objects)
+    assert len(df_p.index) == 0 and list(df_p.columns) == list(df_parameters.columns)
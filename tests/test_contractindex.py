@@ -0,0 +1,156 @@
+import os
+import pytest
+import pandas as pd
+
+import query_contracts
+from metagov.contractindex import ContractIndex, split_name
+
+URL = 'https://github.com/org/gov/blob/main/contracts/Gov.sol'
+
+
+def _objects(rows):
+    columns = ['object_name', 'contract', 'type', 'modifiers', 'visibility', 'coding_keyword_search', 'coding_topic_search']
+    df = pd.DataFrame(rows, columns=columns)
+    df['inheritance'] = [[] for _ in rows]
+    df['values'] = [[] for _ in rows]
+    df['url'] = URL
+    return df
+
+
+def _parameters(rows):
+    df = pd.DataFrame(rows, columns=['parameter_name', 'object_name', 'contract', 'type', 'type_category', 'visibility'])
+    df['url'] = URL
+    return df
+
+
+GOV_OBJECTS = _objects([
+    ('Governor', 'Governor', 'ContractDefinition', [], '', [], []),
+    ('delegate', 'Governor', 'FunctionDefinition', [], 'external', ['voting'], ['delegate']),
+    ('delegateBySig', 'Governor', 'FunctionDefinition', [], 'public', ['voting'], ['delegate']),
+    ('propose', 'Governor', 'FunctionDefinition', ['onlyOwner'], 'public', ['proposal'], ['create']),
+    ('ProposalCreated', 'Governor', 'EventDefinition', [], '', ['proposal'], ['create']),
+])
+GOV_PARAMETERS = _parameters([
+    ('proposalThreshold', '', 'Governor', 'uint256', 'uint', 'public'),
+    ('delegatee', 'delegate', 'Governor', 'address', 'address', ''),
+    ('delegatee', 'delegateBySig', 'Governor', 'address', 'address', ''),
+    ('threshold', 'delegateBySig', 'Governor', 'uint96', 'uint', ''),
+    ('threshold', 'propose', 'Governor', 'address', 'address', ''),
+])
+TOKEN_OBJECTS = _objects([
+    ('Token', 'Token', 'ContractDefinition', [], '', [], []),
+    ('delegates', 'Token', 'FunctionDefinition', [], 'external', ['voting'], []),
+])
+TOKEN_PARAMETERS = _parameters([('account', 'delegates', 'Token', 'address', 'address', '')])
+
+
+def _names(index, expression, kind='objects'):
+    df = index.query(expression, kind=kind)
+    column = 'object_name' if kind == 'objects' else 'parameter_name'
+    return sorted(df[column]) if len(df.index) > 0 else []
+
+
+def _index():
+    index = ContractIndex()
+    index.add_project('gov', GOV_OBJECTS, GOV_PARAMETERS)
+    index.add_project('token', TOKEN_OBJECTS, TOKEN_PARAMETERS)
+    return index
+
+
+def test_split_name():
+    assert split_name('_setProposalThreshold') == ['set', 'proposal', 'threshold']
+    assert split_name('ERC20Votes') == ['erc', '20', 'votes']
+
+
+def test_terms():
+    index = _index()
+
+    assert _names(index, 'name:delegate') == ['delegate', 'delegateBySig']
+    assert _names(index, 'keyword:voting type:function') == ['delegate', 'delegateBySig', 'delegates']
+    assert _names(index, 'modifier:onlyowner') == ['propose']
+    assert _names(index, 'Type:Event') == ['ProposalCreated']
+    assert _names(index, 'project:token AND type:function') == ['delegates']
+    assert _names(index, 'typecat:uint', kind='parameters') == ['proposalThreshold', 'threshold']
+    assert _names(index, 'name:nothing') == []
+
+
+def test_boolean_operators():
+    index = _index()
+
+    assert _names(index, 'keyword:proposal OR name:delegates') == ['ProposalCreated', 'delegates', 'propose']
+    assert _names(index, 'type:function AND NOT keyword:voting') == ['propose']
+    assert _names(index, 'NOT (type:function OR type:event)') == ['Governor', 'Token']
+
+
+def test_prefix_matching():
+    index = _index()
+
+    assert _names(index, 'name:deleg*') == ['delegate', 'delegateBySig', 'delegates']
+    assert _names(index, 'name:deleg*', kind='parameters') == ['delegatee', 'delegatee']
+    assert index.get_terms('objects', prefix='name:deleg') == ['name:delegate', 'name:delegates']
+
+
+def test_parameter_subquery():
+    index = _index()
+
+    # Only objects with a parameter matching both conditions at once
+    assert _names(index, 'param:(name:threshold AND typecat:uint)') == ['delegateBySig']
+    assert _names(index, 'param:(name:threshold)') == ['delegateBySig', 'propose']
+    assert _names(index, 'type:function AND name:deleg* AND NOT param:(typecat:uint)') == ['delegate', 'delegates']
+
+
+@pytest.mark.parametrize('expression', ['name:delegate)', '(name:delegate', 'delegate', 'name:delegate AND'])
+def test_query_errors(expression):
+    with pytest.raises(ValueError):
+        _index().search(expression)
+
+
+def test_remove_and_replace_project():
+    index = _index()
+
+    index.remove_project('token')
+    assert _names(index, 'name:deleg*') == ['delegate', 'delegateBySig']
+    assert 'name:delegates' not in index.get_terms('objects')
+
+    index.add_project('gov', GOV_OBJECTS.iloc[:2], GOV_PARAMETERS.iloc[:2])
+    assert _names(index, 'name:deleg*') == ['delegate']
+    assert _names(index, 'param:(name:threshold)') == []
+
+
+def _write_project(tmpDir, label, df_objects, df_parameters):
+    df_objects.reset_index().to_csv(os.path.join(tmpDir, f'contract_objects_{label}.csv'))
+    df_parameters.reset_index().to_csv(os.path.join(tmpDir, f'contract_parameters_{label}.csv'))
+
+
+def test_update_from_files(tmp_path):
+    tmpDir = str(tmp_path)
+    _write_project(tmpDir, 'gov', GOV_OBJECTS, GOV_PARAMETERS)
+    _write_project(tmpDir, 'token', TOKEN_OBJECTS, TOKEN_PARAMETERS)
+    index = ContractIndex()
+
+    assert index.update(tmpDir) == (['gov', 'token'], [])
+    assert _names(index, 'param:(name:threshold AND typecat:uint)') == ['delegateBySig']
+    assert index.update(tmpDir) == ([], [])
+
+    _write_project(tmpDir, 'gov', GOV_OBJECTS.iloc[:2], GOV_PARAMETERS.iloc[:2])
+    assert index.update(tmpDir) == (['gov'], [])
+    assert _names(index, 'name:deleg*') == ['delegate', 'delegates']
+
+    os.remove(os.path.join(tmpDir, 'contract_objects_token.csv'))
+    assert index.update(tmpDir) == ([], ['token'])
+    assert _names(index, 'name:deleg*') == ['delegate']
+
+
+def test_query_saves_removals(tmp_path, monkeypatch):
+    tmpDir = str(tmp_path)
+    indexFile = os.path.join(tmpDir, 'index.pkl')
+    monkeypatch.setattr(query_contracts, 'INDEX_FILE', indexFile)
+    _write_project(tmpDir, 'gov', GOV_OBJECTS, GOV_PARAMETERS)
+    _write_project(tmpDir, 'token', TOKEN_OBJECTS, TOKEN_PARAMETERS)
+
+    query_contracts.query('name:delegates', tmpDir=tmpDir)
+    assert _names(ContractIndex.load(indexFile), 'name:delegates') == ['delegates']
+
+    os.remove(os.path.join(tmpDir, 'contract_objects_token.csv'))
+    query_contracts.query('name:delegates', tmpDir=tmpDir)
+    assert _names(ContractIndex.load(indexFile), 'name:delegates') == []
@@ -0,0 +1,201 @@
+import os
+import glob
+import pickle
+import pytest
+import pandas as pd
+from solidity_parser import parser
+
+from metagov import contractkeywords
+from metagov.contractkeywords import CodingCache, CodingMatcher, get_coding_matcher, find_keywords_in_str, \
+    find_topics_in_str, find_keywords_in_obj, find_topics_in_obj, code_objects
+from metagov.contractmodel import extract_commented_objects_and_parameters
+
+CWD = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPOUND_FILES = sorted(glob.glob(os.path.join(CWD, 'data', 'contracts', 'Compound', '*.sol')))
+
+TIMELOCK = {'keywords': ['Timelock'], 'topics': ['delay']}
+
+
+@pytest.fixture
+def matcher():
+    return CodingMatcher(contractkeywords.CODING)
+
+
+def test_cache_counts_hits_and_misses(matcher):
+    cache = CodingCache()
+
+    results = [cache.match(matcher, s, camelCase=True) for s in ['castVote', 'propose', 'castVote', 'castVote']]
+    cache.match(matcher, 'castVote') # (Not camelCase, so another key)
+
+    assert results[0] == results[2] == matcher.match('castVote', camelCase=True)
+    assert cache.get_stats() == {'hits': 2, 'misses': 3, 'hit_rate': 0.4, 'size': 3}
+
+
+def test_cache_drops_least_recently_used(matcher):
+    cache = CodingCache(maxSize=2)
+
+    cache.match(matcher, 'a')
+    cache.match(matcher, 'b')
+    cache.match(matcher, 'a') # (Now 'b' is least recently used)
+    cache.match(matcher, 'c')
+
+    assert list(cache.entries.keys()) == [('a', False), ('c', False)]
+    cache.match(matcher, 'b')
+    assert cache.get_stats()['misses'] == 4
+
+
+def test_cache_cleared_when_coding_changes(matcher, monkeypatch):
+    cache = CodingCache()
+    cache.match(matcher, 'queueTimelock', camelCase=True)
+
+    coding = dict(contractkeywords.CODING, timelock=TIMELOCK)
+    monkeypatch.setattr(contractkeywords, 'CODING', coding)
+    keywords, topics = cache.match(CodingMatcher(coding), 'queueTimelock', camelCase=True)
+
+    assert keywords == ['timelock']
+    assert cache.get_stats()['size'] == 1 and cache.get_stats()['misses'] == 2
+
+
+def test_cache_only_loaded_for_same_coding(matcher, tmp_path, monkeypatch):
+    path = str(tmp_path / 'coding_cache.pkl')
+    cache = CodingCache()
+    cache.match(matcher, 'castVote', camelCase=True)
+    cache.save(path)
+
+    loaded = CodingCache.load(path)
+    assert loaded.entries == cache.entries
+    loaded.match(matcher, 'castVote', camelCase=True)
+    assert loaded.get_stats()['hits'] == 1
+
+    monkeypatch.setattr(contractkeywords, 'CODING', dict(contractkeywords.CODING, timelock=TIMELOCK))
+    assert CodingCache.load(path).get_stats()['size'] == 0
+
+
+def test_cache_updates_merged_back(matcher):
+    parent = CodingCache()
+    parent.match(matcher, 'castVote', camelCase=True)
+
+    # A worker gets a copy of the parent's cache, and tracks what it adds
+    worker = pickle.loads(pickle.dumps(parent))
+    worker.track_updates()
+    worker.match(matcher, 'castVote', camelCase=True)
+    worker.match(matcher, 'propose', camelCase=True)
+    parent.merge(worker.take_updates())
+
+    assert parent.get_stats() == {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3, 'size': 2}
+    assert worker.take_updates() == {'entries': [], 'hits': 0, 'misses': 0, 'coding': matcher.snapshot}
+    assert CodingCache().take_updates() is None
+
+
+def test_cache_updates_for_other_coding_not_merged(matcher):
+    parent = CodingCache()
+    parent.match(matcher, 'castVote', camelCase=True)
+    worker = CodingCache()
+    worker.track_updates()
+    worker.match(CodingMatcher(dict(contractkeywords.CODING, timelock=TIMELOCK)), 'propose')
+
+    parent.merge(worker.take_updates())
+
+    assert list(parent.entries.keys()) == [('castVote', True)]
+
+
+def test_matcher_rebuilt_when_coding_changes(monkeypatch):
+    matcher = get_coding_matcher()
+    assert get_coding_matcher() is matcher
+    assert find_keywords_in_str('queueTimelock', camelCase=True) == []
+
+    # Replaced...
+    monkeypatch.setattr(contractkeywords, 'CODING', dict(contractkeywords.CODING, timelock=TIMELOCK))
+    assert get_coding_matcher() is not matcher
+    assert find_keywords_in_str('queueTimelock', camelCase=True) == ['timelock']
+    assert find_topics_in_str('Sets the delay', 'timelock') == ['delay']
+
+    # ...or changed in place
+    matcher = get_coding_matcher()
+    monkeypatch.setitem(contractkeywords.CODING['voting'], 'topics', ['cast', 'queue'])
+    assert get_coding_matcher() is not matcher
+    assert find_topics_in_str('Queues a vote', 'voting') == ['queue']
+
+
+def _frames(fpath):
+    with open(fpath) as f:
+        lines = f.read().split('\n')
+    return extract_commented_objects_and_parameters(parser.parse_file(fpath, loc=True), lines)
+
+
+def _code_each_object(df_objects, df_parameters):
+    """Previous coding: find_keywords_in_obj and then find_topics_in_obj, applied to each object"""
+    
+    df = df_objects.copy()
+    df['coding_keyword_search'] = df.apply(lambda x: find_keywords_in_obj(x, df_parameters), axis=1)
+    df['coding_topic_search'] = df.apply(lambda x: find_topics_in_obj(x, df_parameters), axis=1)
+    
+    return list(df['coding_keyword_search']), list(df['coding_topic_search'])
+
+
+def _sets_of_str(s, camelCase=False):
+    """Original search of a string, by category (as a set of keywords and a set of topics for each)"""
+    
+    if not s:
+        return set(), {}
+    coding = contractkeywords.CODING
+    if camelCase:
+        sLower = s.strip('_').lower()
+        kw = {c for c, v in coding.items() if any(k in s or sLower.startswith(k.lower()) for k in v['keywords'])}
+        topics = {c: {t for t in v['topics'] if t in s or sLower.startswith(t.lower())} for c, v in coding.items()}
+    else:
+        kw = {c for c, v in coding.items() if any(k.lower() in s.lower() for k in v['keywords'])}
+        topics = {c: {t for t in v['topics'] if t.lower() in s.lower()} for c, v in coding.items()}
+    
+    return kw, topics
+
+
+def _sets_of_obj(obj, df_parameters):
+    """Original search of an object, as (set of keywords, set of (keyword, topic)), whatever their order"""
+    
+    strings = [(obj['object_name'], True), (obj['description'], False)]
+    if 'object_name' in df_parameters.columns:
+        params = df_parameters.loc[df_parameters['object_name'] == obj['object_name']]
+        for paramName, paramDescription in zip(params['parameter_name'], params['description']):
+            strings += [(paramName, True), (paramDescription, False)]
+    
+    found = [_sets_of_str(s, camelCase=camelCase) for s, camelCase in strings]
+    keywords = set().union(*[kw for kw, _ in found])
+    topics = {(kw, t) for kw in keywords for _, strTopics in found for t in strTopics.get(kw, set())}
+    
+    return keywords, topics
+
+
+@pytest.mark.parametrize('fpath', COMPOUND_FILES, ids=os.path.basename)
+def test_code_objects_matches_each_object(fpath):
+    df_objects, df_parameters = _frames(fpath)
+    
+    keywords, topics = code_objects(df_objects, df_parameters, cache=CodingCache())
+    
+    assert (keywords, topics) == _code_each_object(df_objects, df_parameters)
+
+
+@pytest.mark.parametrize('fpath', COMPOUND_FILES, ids=os.path.basename)
+def test_code_objects_finds_the_same_keywords_and_topics_in_any_order(fpath):
+    df_objects, df_parameters = _frames(fpath)
+    
+    keywords, topics = code_objects(df_objects, df_parameters, cache=CodingCache())
+    
+    for (i, obj), objectKeywords, objectTopics in zip(df_objects.iterrows(), keywords, topics):
+        expectedKeywords, expectedTopics = _sets_of_obj(obj, df_parameters)
+        assert sorted(objectKeywords) == sorted(expectedKeywords)
+        # (Each keyword's topics, once each, so a topic may be listed under several keywords)
+        assert sorted(objectTopics) == sorted(t for _, t in expectedTopics)
+
+
+def test_code_objects_edge_cases():
+    df_objects = pd.DataFrame({'object_name': ['_proposeVote', 'Elector', 'castBallot', 'noParams', ''],
+                               'description': ['Creates a proposal', '', None, 'Dispute ruling', 'A member role']})
+    df_parameters = pd.DataFrame({'object_name': ['castBallot', 'castBallot', 'Elector'],
+                                  'parameter_name': ['reputationDelta', 'juror', 'candidate'],
+                                  'description': ['Reward for voting', '', 'Candidate to elect']})
+    
+    keywords, topics = code_objects(df_objects, df_parameters, cache=CodingCache())
+    
+    assert (keywords, topics) == _code_each_object(df_objects, df_parameters)
+    assert keywords[1] == ['election'] and topics[1] == ['']
@@ -0,0 +1,71 @@
+import os
+import glob
+import pytest
+import pandas as pd
+from solidity_parser import parser
+
+from metagov.contractmodel import ContractObject, ContractParameter, IGNORE_CONTRACTS
+from metagov.contractmodel import extract_objects_and_parameters
+
+CWD = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPOUND_FILES = sorted(glob.glob(os.path.join(CWD, 'data', 'contracts', 'Compound', '*.sol')))
+
+
+def concat_objects_and_parameters(sourceUnit):
+    """Previous construction of the DataFrames: one to_row() frame per object/parameter, concatenated"""
+    
+    contracts = [c for c in sourceUnit['children'] if c.get('type') == 'ContractDefinition']
+    contracts = [c for c in contracts if c['name'] not in IGNORE_CONTRACTS]
+    
+    df_objects = pd.DataFrame()
+    df_parameters = pd.DataFrame()
+    for c in contracts:
+        contractName = c['name']
+        contract = ContractObject.from_ast_node(c, contractName)
+        df_objects = pd.concat([df_objects, contract.to_row()], ignore_index=True)
+        for item in c.get('subNodes', []):
+            itemType = item['type']
+            if itemType == 'StateVariableDeclaration':
+                for param in item.get('variables', {}):
+                    stateVar = ContractParameter.from_ast_node(param, contract)
+                    df_parameters = pd.concat([df_parameters, stateVar.to_row()], ignore_index=True)
+            else:
+                try:
+                    contractObj = ContractObject.from_ast_node(item, contractName)
+                    df_objects = pd.concat([df_objects, contractObj.to_row()], ignore_index=True)
+                    paramObj = item.get('parameters', (item.get('members', {})))
+                    if isinstance(paramObj, dict):
+                        values = paramObj.get('parameters', [])
+                    elif isinstance(paramObj, list) and itemType == 'StructDefinition':
+                        values = paramObj
+                    else:
+                        values = []
+                    for param in values:
+                        contractParam = ContractParameter.from_ast_node(param, contractObj)
+                        df_parameters = pd.concat([df_parameters, contractParam.to_row()], ignore_index=True)
+                except AssertionError:
+                    pass
+    
+    return df_objects, df_parameters
+
+
+def test_compound_files_found():
+    assert len(COMPOUND_FILES) > 0
+
+
+@pytest.mark.parametrize('fpath', COMPOUND_FILES, ids=os.path.basename)
+def test_extract_matches_concatenated_rows(fpath):
+    sourceUnit = parser.parse_file(fpath, loc=True)
+    
+    df_objects, df_parameters = extract_objects_and_parameters(sourceUnit)
+    expected_objects, expected_parameters = concat_objects_and_parameters(sourceUnit)
+    
+    pd.testing.assert_frame_equal(df_objects, expected_objects)
+    pd.testing.assert_frame_equal(df_parameters, expected_parameters)
+
+
+def test_empty_source_unit():
+    df_objects, df_parameters = extract_objects_and_parameters({'children': []})
+    
+    pd.testing.assert_frame_equal(df_objects, pd.DataFrame())
+    pd.testing.assert_frame_equal(df_parameters, pd.DataFrame())
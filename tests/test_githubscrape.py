@@ -0,0 +1,79 @@
+import os
+import time
+
+from metagov import githubscrape
+from metagov.githubscrape import download_repo, download_repos, get_repo_dir
+
+REPOS = [(f"org{i}", f"gov{i}") for i in range(6)]
+
+
+def _list_files(repoDir):
+    return sorted(os.path.relpath(os.path.join(root, f), repoDir)
+                  for root, _, files in os.walk(repoDir) for f in files if f != githubscrape.EXTRACTED_FILE)
+
+
+def test_download_repos_keeps_order(github_stub):
+    # Earlier repositories take longest, so downloads finish in reverse order
+    stub = github_stub(REPOS, delays={key: 0.05 * (len(REPOS) - i) for i, key in enumerate(REPOS)})
+    urls = [f"https://github.com/{o}/{n}" + ('/tree/v1.0' if i % 2 else '') for i, (o, n) in enumerate(REPOS)]
+
+    results = download_repos([(url, 'contracts') for url in urls], jobs=3)
+
+    assert [repoDict['url'] for _, repoDict in results] == urls
+    for (repoDir, repoDict), (o, n) in zip(results, REPOS):
+        assert repoDir == get_repo_dir(repoDict, subdir='contracts')
+        assert repoDict['sha'] == stub.shas[(o, n)]
+        assert _list_files(repoDir) == ['contracts/Comp.sol', 'contracts/GovernorBravoDelegate.sol',
+                                        'contracts/GovernorBravoInterfaces_delegate.sol']
+
+
+def test_download_repos_concurrently_over_kept_alive_connections(github_stub):
+    stub = github_stub(REPOS, delay=0.2)
+    repos = [(f"https://github.com/{o}/{n}", 'contracts') for o, n in REPOS]
+
+    start = time.perf_counter()
+    download_repos(repos, jobs=6)
+    seconds = time.perf_counter() - start
+
+    # 3 requests (repository, commit, zipball) of 0.2s each per repository, all at once
+    assert stub.maxInFlight > 4
+    assert seconds < 0.2 * len(stub.requests) / 2
+    # (More threads than DOWNLOAD_JOBS, so the session's pool must have been enlarged to keep them all)
+    assert len(stub.connections) <= 6 < len(stub.requests)
+
+
+def test_download_repos_rerun_uses_stored_metadata_and_files(github_stub):
+    stub = github_stub(REPOS[:2])
+    repos = [(f"https://github.com/{o}/{n}", 'contracts') for o, n in REPOS[:2]]
+
+    first = download_repos(repos)
+    requestCount = len(stub.requests)
+    second = download_repos(repos)
+
+    assert len(stub.requests) == requestCount
+    assert second == first
+
+
+def test_subdirs_of_one_repository_are_kept_apart(github_stub):
+    github_stub([('MolochVentures', 'moloch')])
+    url = 'https://github.com/MolochVentures/moloch'
+
+    (v1Dir, _), (v2Dir, _) = download_repos([(url, 'v1_contracts'), (url, 'contracts')], jobs=2)
+
+    assert v1Dir != v2Dir
+    assert _list_files(v1Dir) == ['v1_contracts/Timelock.sol']
+    assert _list_files(v2Dir) == ['contracts/Comp.sol', 'contracts/GovernorBravoDelegate.sol',
+                                  'contracts/GovernorBravoInterfaces_delegate.sol']
+
+    # Downloading one again does not touch the other
+    download_repo(url, subdir='contracts')
+    assert _list_files(v1Dir) == ['v1_contracts/Timelock.sol']
+
+
+def test_missing_subdir(github_stub):
+    github_stub(REPOS[:1])
+
+    repoDir, repoDict = download_repo('https://github.com/org0/gov0', subdir='src')
+
+    assert repoDir == ''
+    assert repoDict['id'] == 'org0_gov0_main'
@@ -0,0 +1,221 @@
+import os
+import shutil
+import pytest
+import pandas as pd
+from concurrent.futures import Future
+
+import download_and_parse_contracts as dpc
+from metagov import contractkeywords
+
+CWD = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPOUND_DIR = os.path.join(CWD, 'data', 'contracts', 'Compound')
+REPO_DICT = {'owner': 'compound-finance', 'name': 'compound-protocol', 'default_branch': 'master', 'ref': '',
+             'updated_at': '2022-01-01T00:00:00Z', 'url': 'https://github.com/compound-finance/compound-protocol',
+             'id': 'compound-finance_compound-protocol_master', 'sha': ''}
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """Copy of the Compound contracts, with parse_repo outputs going to a temporary directory"""
+    
+    monkeypatch.setattr(dpc, 'TMPDIR', str(tmp_path / 'out'))
+    os.makedirs(dpc.TMPDIR)
+    projectDir = str(tmp_path / 'Compound')
+    shutil.copytree(COMPOUND_DIR, projectDir)
+    
+    return projectDir
+
+
+def _parse(projectDir, **kwargs):
+    dpc.parse_repo(projectDir, REPO_DICT, projectLabel='compound', useCache=False, **kwargs)
+    
+    return os.path.join(dpc.TMPDIR, 'contract_objects_compound.csv')
+
+
+def test_changed_coding_invalidates_manifest(project, monkeypatch):
+    objectsFile = _parse(project)
+    assert not pd.read_csv(objectsFile)['coding_keyword_search'].str.contains('timelock').any()
+    
+    coding = dict(contractkeywords.CODING, timelock={'keywords': ['Timelock'], 'topics': ['delay']})
+    monkeypatch.setattr(contractkeywords, 'CODING', coding)
+    _parse(project)
+    assert pd.read_csv(objectsFile)['coding_keyword_search'].str.contains('timelock').any()
+
+
+def test_outputs_removed_when_no_files_left(project):
+    objectsFile = _parse(project)
+    parametersFile = os.path.join(dpc.TMPDIR, 'contract_parameters_compound.csv')
+    assert os.path.isfile(objectsFile) and os.path.isfile(parametersFile)
+    
+    _parse(project, includeFiles=['None.sol'])
+    assert not os.path.isfile(objectsFile) and not os.path.isfile(parametersFile)
+    
+    _parse(project, includeFiles=['None.sol'])
+    assert not os.path.isfile(objectsFile)
+
+
+def _read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_parallel_parse_matches_serial(project):
+    objectsFile = _parse(project, incremental=False)
+    parametersFile = os.path.join(dpc.TMPDIR, 'contract_parameters_compound.csv')
+    serial = [_read_bytes(objectsFile), _read_bytes(parametersFile)]
+    os.remove(objectsFile)
+    os.remove(parametersFile)
+    
+    _parse(project, incremental=False, jobs=2)
+    assert [_read_bytes(objectsFile), _read_bytes(parametersFile)] == serial
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_stream_matches_in_memory(project, jobs):
+    objectsFile = _parse(project, incremental=False)
+    parametersFile = os.path.join(dpc.TMPDIR, 'contract_parameters_compound.csv')
+    inMemory = [_read_bytes(objectsFile), _read_bytes(parametersFile)]
+    os.remove(objectsFile)
+    os.remove(parametersFile)
+    
+    _parse(project, stream=True, chunkSize=7, jobs=jobs)
+    assert [_read_bytes(objectsFile), _read_bytes(parametersFile)] == inMemory
+
+
+def test_parallel_parse_shares_coding_cache(project, monkeypatch):
+    cache = contractkeywords.CodingCache()
+    monkeypatch.setattr(contractkeywords, '_codingCache', cache)
+    objectsFile = _parse(project, incremental=False, jobs=2)
+    first = cache.get_stats()
+    # (Each worker codes names it has not seen, even if another worker has)
+    assert first['misses'] >= first['size'] > 0
+    
+    # Workers start with the entries merged back from the last run, so code nothing again
+    os.remove(objectsFile)
+    _parse(project, incremental=False, jobs=2)
+    second = cache.get_stats()
+    assert second['misses'] == first['misses'] and second['size'] == first['size']
+    assert second['hits'] - first['hits'] == first['hits'] + first['misses']
+
+
+def test_parse_window_bounds_submitted_files():
+    submitted = []
+    
+    class Pool():
+        def submit(self, fcn, item):
+            submitted.append(item)
+            future = Future()
+            future.set_result(fcn(item))
+            return future
+    
+    results = dpc._map_in_order(Pool(), lambda x: 2 * x, iter(range(10)), window=3)
+    assert next(results) == 0
+    assert submitted == [0, 1, 2]
+    assert list(results) == [2 * x for x in range(1, 10)]
+
+
+def test_pipeline_keeps_subdirs_of_one_repository_apart(github_stub, tmp_path, monkeypatch):
+    github_stub([('MolochVentures', 'moloch')])
+    monkeypatch.setattr(dpc, 'TMPDIR', str(tmp_path / 'out'))
+    os.makedirs(dpc.TMPDIR)
+    url = 'https://github.com/MolochVentures/moloch'
+    rows = [('Moloch v1', 'v1_contracts'), ('Moloch v2', 'contracts')] * 2
+    
+    def download(row):
+        return dpc.download_repo(url, subdir=row[1])
+    
+    def parse(row, downloaded):
+        repoDir, repoDict = downloaded
+        dpc.parse_downloaded_repo(repoDir, repoDict, label=row[0],
+                                  kwargs={'jobs': 2, 'incremental': False, 'useCache': False})
+    
+    dpc.run_pipeline(rows, download, parse, downloadJobs=2, parseJobs=2, queueSize=1)
+    
+    files = {label: set(pd.read_csv(os.path.join(dpc.TMPDIR, f'contract_objects_{label}.csv'))['url'])
+             for label in ['Moloch v1', 'Moloch v2']}
+    assert {f.split('/blob/main/')[-1] for f in files['Moloch v1']} == {'v1_contracts/Timelock.sol'}
+    assert {f.split('/blob/main/')[-1] for f in files['Moloch v2']} == {'contracts/Comp.sol', 
+        'contracts/GovernorBravoDelegate.sol', 'contracts/GovernorBravoInterfaces_delegate.sol'}
+
+
+# Zipball members: some under a 'contracts' directory at various depths (including excluded
+# 'test' and 'lib' directories), and some that download_repo would not extract
+ZIP_SUBDIRS = {'contracts': ['Comp.sol', 'GovernorBravoDelegate.sol', 'Timelock.sol'],
+               'contracts/governance': ['GovernorBravoDelegator.sol', 'GovernorBravoInterfaces_delegator.sol'],
+               'contracts/test': ['GovernorBravoInterfaces_delegate.sol'],
+               'lib/contracts': ['Comp.sol'],
+               'packages/core/contracts': ['Timelock.sol', 'GovernorBravoDelegator.sol'],
+               'v1_contracts': ['GovernorBravoDelegate.sol']}
+
+
+def _sorted_rows(csvFile):
+    """Rows of a parse_repo output file, by file (as files may be walked in another order) and then in order"""
+    
+    df = pd.read_csv(csvFile, index_col=0)
+    return df.sort_values('url', kind='stable').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'excludeFiles': ['Timelock.sol']},
+                                    {'includeDirs': ['packages', 'core', 'contracts']},
+                                    {'includeFiles': ['Comp.sol', 'Timelock.sol'], 'useDefaults': False}])
+def test_zipped_repo_matches_extracted(github_stub, tmp_path, monkeypatch, kwargs):
+    from githubstub import make_zipball
+    
+    stub = github_stub([('org0', 'gov0')])
+    stub.zipballs[('org0', 'gov0')] = make_zipball('org0', 'gov0', stub.shas[('org0', 'gov0')], subdirs=ZIP_SUBDIRS)
+    url = 'https://github.com/org0/gov0'
+    
+    def set_output_dir(name):
+        monkeypatch.setattr(dpc, 'TMPDIR', str(tmp_path / name))
+        os.makedirs(dpc.TMPDIR)
+    
+    def parse_kwargs():
+        return {k: list(v) if isinstance(v, list) else v for k, v in kwargs.items()}
+    
+    set_output_dir('extracted')
+    repoDir, repoDict = dpc.download_repo(url, subdir='contracts')
+    dpc.parse_downloaded_repo(repoDir, repoDict, label='gov', kwargs=parse_kwargs())
+    set_output_dir('zipped')
+    dpc.parse_zipped_repo(url, 'contracts', label='gov', kwargs=parse_kwargs())
+    
+    for kind in ['objects', 'parameters']:
+        extracted = _sorted_rows(str(tmp_path / 'extracted' / f'contract_{kind}_gov.csv'))
+        zipped = _sorted_rows(str(tmp_path / 'zipped' / f'contract_{kind}_gov.csv'))
+        pd.testing.assert_frame_equal(zipped, extracted)
+    
+    # (Just the files expected, so that the filtering is not trivially the same)
+    files = {u.split('/blob/main/')[-1] for u in extracted['url']}
+    expected = {f"{d}/{f}" for d, fnames in ZIP_SUBDIRS.items() for f in fnames
+                if d in ['contracts', 'contracts/governance', 'packages/core/contracts']}
+    if 'excludeFiles' in kwargs:
+        expected = {f for f in expected if not f.endswith('/Timelock.sol')}
+    elif 'includeDirs' in kwargs:
+        expected = {f for f in expected if not f.startswith('contracts/governance/')}
+    elif 'includeFiles' in kwargs:
+        expected = {f for f in expected if f.endswith(('/Comp.sol', '/Timelock.sol'))} | {'lib/contracts/Comp.sol'}
+    assert files == expected
+
+
+def test_zipped_repo_stops_when_rate_limit_exceeded(github_stub, tmp_path, monkeypatch):
+    from metagov import githubscrape
+    from metagov.ratelimit import RequestScheduler, RateLimitExceeded
+    
+    stub = github_stub([('org0', 'gov0')], limit=5, window=3600)
+    stub.remaining = 0
+    monkeypatch.setattr(githubscrape, '_scheduler', RequestScheduler(githubscrape.get_session(), maxWait=1))
+    monkeypatch.setattr(dpc, 'TMPDIR', str(tmp_path / 'out'))
+    
+    with pytest.raises(RateLimitExceeded):
+        dpc.parse_zipped_repo('https://github.com/org0/gov0', 'contracts')
+    with pytest.raises(RateLimitExceeded):
+        dpc.prefetch_zipped_repo('https://github.com/org0/gov0')
+
+
+def test_zipped_repo_reports_missing_repository(github_stub, tmp_path, monkeypatch, capsys):
+    github_stub([('org0', 'gov0')])
+    monkeypatch.setattr(dpc, 'TMPDIR', str(tmp_path / 'out'))
+    
+    dpc.parse_zipped_repo('https://github.com/org0/missing', 'contracts')
+    dpc.prefetch_zipped_repo('https://github.com/org0/missing')
+    
+    assert '404' in capsys.readouterr().out
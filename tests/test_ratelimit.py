@@ -0,0 +1,121 @@
+import time
+import pytest
+import requests
+
+from metagov.ratelimit import TokenBucket, RequestScheduler, RateLimitExceeded
+
+REPO = ('org0', 'gov0')
+
+
+@pytest.fixture
+def session():
+    with requests.Session() as s:
+        yield s
+
+
+def test_token_bucket_paces_after_burst():
+    bucket = TokenBucket(rate=50, capacity=5)
+
+    start = time.monotonic()
+    waits = [bucket.acquire() for _ in range(15)]
+    seconds = time.monotonic() - start
+
+    assert waits[:5] == [0.0] * 5
+    assert seconds >= 10 / 50 * 0.9
+
+
+def test_scheduler_paces_requests(github_stub, session):
+    stub = github_stub([REPO])
+    scheduler = RequestScheduler(session, rate=20, burst=1)
+
+    start = time.monotonic()
+    statuses = [scheduler.get(f"{stub.url}/repos/org0/gov0").status_code for _ in range(6)]
+    seconds = time.monotonic() - start
+
+    assert statuses == [200] * 6
+    assert seconds >= 5 / 20 * 0.9
+    assert scheduler.get_stats()['paced_sec'] > 0
+
+
+def test_scheduler_retries_server_errors(github_stub, session):
+    stub = github_stub([REPO], fail=2)
+    scheduler = RequestScheduler(session, backoff=0.01)
+
+    r = scheduler.get(f"{stub.url}/repos/org0/gov0")
+
+    assert r.status_code == 200
+    assert [status for _, status in stub.requests] == [502, 502, 200]
+    assert scheduler.get_stats()['retries'] == 2
+
+
+def test_scheduler_gives_up_after_max_retries(github_stub, session):
+    stub = github_stub([REPO], fail=10)
+    scheduler = RequestScheduler(session, backoff=0.01, maxRetries=2)
+
+    r = scheduler.get(f"{stub.url}/repos/org0/gov0")
+
+    assert r.status_code == 502
+    assert len(stub.requests) == 3
+
+
+def test_scheduler_conditional_request(github_stub, session):
+    stub = github_stub([REPO])
+    scheduler = RequestScheduler(session)
+    url = f"{stub.url}/repos/org0/gov0"
+
+    r = scheduler.get(url)
+    remaining = int(r.headers['X-RateLimit-Remaining'])
+    r = scheduler.get(url, etag=r.headers['ETag'])
+
+    assert r.status_code == 304
+    assert int(r.headers['X-RateLimit-Remaining']) == remaining
+    assert scheduler.get_stats()['not_modified'] == 1
+
+
+def test_scheduler_waits_for_reset(github_stub, session):
+    stub = github_stub([REPO], limit=2, window=1)
+    scheduler = RequestScheduler(session, backoff=0.01)
+    url = f"{stub.url}/repos/org0/gov0"
+
+    statuses = [scheduler.get(url).status_code for _ in range(3)]
+    stats = scheduler.get_stats()
+
+    # The third request waits for the reset rather than being refused
+    assert statuses == [200, 200, 200]
+    assert 403 not in [status for _, status in stub.requests]
+    assert stats['rate_limit_wait_sec'] > 0
+
+
+def test_scheduler_slows_down_when_limit_is_low(github_stub, session):
+    stub = github_stub([REPO], limit=10, window=3600)
+    scheduler = RequestScheduler(session, rate=100, lowFraction=0.5)
+
+    scheduler.get(f"{stub.url}/repos/org0/gov0")
+    assert scheduler.bucket.rate == 100
+    for _ in range(5):
+        scheduler.get(f"{stub.url}/repos/org0/gov0")
+
+    # 4 requests left for the next hour or so
+    assert scheduler.bucket.rate < 1
+
+
+def test_scheduler_raises_if_reset_is_too_far_away(github_stub, session):
+    stub = github_stub([REPO], limit=1, window=3600)
+    scheduler = RequestScheduler(session, maxWait=1)
+    url = f"{stub.url}/repos/org0/gov0"
+
+    assert scheduler.get(url).status_code == 200
+    with pytest.raises(RateLimitExceeded):
+        scheduler.get(url)
+
+
+def test_scheduler_retries_rate_limited_request_after_reset(github_stub, session):
+    stub = github_stub([REPO], limit=5, window=1)
+    stub.remaining = 0 # (Used up by another client)
+    scheduler = RequestScheduler(session, backoff=0.01)
+
+    r = scheduler.get(f"{stub.url}/repos/org0/gov0")
+
+    assert r.status_code == 200
+    assert [status for _, status in stub.requests] == [403, 200]
+    assert scheduler.get_stats()['rate_limit_wait_sec'] > 0
@@ -0,0 +1,80 @@
+import os
+import time
+import pandas as pd
+
+from metagov import githubscrape
+from metagov.githubscrape import get_repo_dict
+from metagov.repostore import RepoStore, REPO_FIELDS
+
+URL = 'https://github.com/org0/gov0'
+
+
+def _repo_dict(owner, name, ref='', sha='abc123'):
+    return {'owner': owner, 'name': name, 'default_branch': 'main', 'ref': ref, 'updated_at': '2022-01-01T00:00:00Z',
+            'url': f"https://github.com/{owner}/{name}" + (f"/tree/{ref}" if ref else ''),
+            'id': f"{owner}_{name}_{ref or 'main'}", 'sha': sha}
+
+
+def test_new_store_seeded_from_csv(tmp_path):
+    seedFile = str(tmp_path / 'repodicts.csv')
+    # (Entries from before commits were resolved have no sha)
+    seeded = [_repo_dict('org0', 'gov0'), _repo_dict('org1', 'gov1', ref='v1.0')]
+    pd.DataFrame(seeded).drop(columns=['sha']).to_csv(seedFile, index=False)
+    fetchedAt = time.time() - 3600
+    os.utime(seedFile, (fetchedAt, fetchedAt))
+
+    store = RepoStore(str(tmp_path / 'store.sqlite'), seedFile=seedFile)
+
+    assert len(store) == 2
+    assert store.get(seeded[1]['url']) == dict(seeded[1], sha='')
+    assert store.get_by_id('org0_gov0_main') == dict(seeded[0], sha='')
+    assert store.get_entry(seeded[0]['url'])['fetched_at'] == fetchedAt
+
+    # An existing store is not seeded again, and importing keeps the entries it has
+    store.put(_repo_dict('org0', 'gov0', sha='def456'))
+    pd.DataFrame([_repo_dict('org2', 'gov2')]).to_csv(seedFile, index=False)
+    assert len(RepoStore(store.path, seedFile=seedFile)) == 2
+    store.import_csv(seedFile)
+    assert len(store) == 3 and store.get(seeded[0]['url'])['sha'] == 'def456'
+
+
+def test_values_are_quoted(tmp_path):
+    repoDicts = [_repo_dict("o'brien", 'gov"quoted'), _repo_dict('org; DROP TABLE repos; --', 'gov,0', ref="v1.0'")]
+    store = RepoStore(str(tmp_path / 'store.sqlite'), seedFile=None)
+
+    for repoDict in repoDicts:
+        store.put(repoDict)
+
+    assert [store.get(r['url']) for r in repoDicts] == repoDicts
+    assert [store.get_by_id(r['id']) for r in repoDicts] == repoDicts
+    assert store.get(URL) is None
+
+    # Exported and seeded back unchanged
+    csvFile = str(tmp_path / 'repodicts.csv')
+    store.export_csv(csvFile)
+    seeded = RepoStore(str(tmp_path / 'seeded.sqlite'), seedFile=csvFile)
+    assert seeded.to_frame().equals(store.to_frame())
+    assert list(seeded.to_frame().columns) == REPO_FIELDS
+
+
+def test_stale_entries_refreshed(github_stub, tmp_path, monkeypatch):
+    stub = github_stub([('org0', 'gov0')])
+    store = RepoStore(str(tmp_path / 'store.sqlite'), ttl=60, seedFile=None)
+    monkeypatch.setattr(githubscrape, '_repoStore', store)
+
+    repoDict = get_repo_dict(URL)
+    assert get_repo_dict(URL) == repoDict
+    assert len(stub.requests) == 2
+
+    # Once older than the ttl, the entry is refreshed with conditional requests
+    entry = store.get_entry(URL)
+    store.put(repoDict, etags=entry['etags'], fetchedAt=time.time() - 120)
+    assert get_repo_dict(URL) == repoDict
+    assert [status for _, status in stub.requests[2:]] == [304, 304]
+    assert not store.is_stale(store.get_entry(URL))
+
+    # ...and picks up a new commit
+    stub.shas[('org0', 'gov0')] = 'f' * 40
+    store.put(repoDict, etags=entry['etags'], fetchedAt=time.time() - 120)
+    assert get_repo_dict(URL)['sha'] == 'f' * 40
+    assert store.get(URL)['sha'] == 'f' * 40